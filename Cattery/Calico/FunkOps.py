@@ -4,31 +4,163 @@
 """This is a library of "funklet operations".
 Each function here is compatible with ParmTab.apply().
 Input argument is a ParmTab.FunkSlie object.
-Return value is a list of output funklets.
+Return value is a list of output funklets, or a ParmTables.FunkletArrays
+object (in which case the funklets are only built when written out).
+Since ParmTab.apply() may call these in worker processes, they should only
+operate on the slice given to them, and not on any other global state.
 """;
 
 import copy
+import numpy
+import numpy.lib.stride_tricks
+from scipy import interpolate
 
 from Timba.Meq import meq
 from Timba import dmi
 from Timba import mequtils
 
+# Array-native reductions.
+# These take the stacked coefficients (N,)+coeff_shape and domains (N,naxes,2) of a slice
+# (see FunkSlice.coeff_array() and FunkSlice.domain_array()), and return a tuple of (coeff,domains),
+# (coeff,domains,polc_kw) or (coeff,domains,polc_kw,source). polc_kw is a dict of funklet attributes to
+# set (scalars or arrays of length N), and 'source' gives the index of the input funklet that each output
+# funklet is copied from (see ParmTables.FunkletArrays). If 'source' is not given, output funklet i is copied
+# from input funklet i if the number of funklets is unchanged, else from the input funklet with the nearest
+# domain center. Use array_op() to turn them into functions suitable for ParmTab.apply().
+
+def _centers (domains):
+  """Helper function: returns domain centers along the (single) slice axis, and checks that the slice is rank-1""";
+  if domains.shape[1] != 1:
+    raise TypeError,"this operation is only available for rank-1 slices";
+  return domains[:,0,:].mean(1);
+
+def average_arrays (coeff,domains):
+  """Replaces all funklets in a slice with their mean, defined over the envelope domain.""";
+  envelope = numpy.array([domains[:,:,0].min(0),domains[:,:,1].max(0)]).T;
+  return coeff.mean(0)[numpy.newaxis,...],envelope[numpy.newaxis,...],{},[0];
+
+def linear_interpol_arrays (coeff,domains,axis_index=0):
+  """Array version of linear_interpol(), see below. 'axis_index' is the axis number of the slice axis.""";
+  x = _centers(domains);
+  c00 = coeff.reshape((len(coeff),-1))[:,0];
+  out_domains = numpy.array([x[:-1],x[1:]]).T[:,numpy.newaxis,:];
+  out_domains[0,0,0] = domains[0,0,0];
+  out_domains[-1,0,1] = domains[-1,0,1];
+  out_coeff = numpy.array([c00[:-1],c00[1:]-c00[:-1]]).T;
+  return out_coeff,out_domains,dict(offset=x[:-1],scale=x[1:]-x[:-1],axis_index=axis_index),numpy.arange(len(x)-1);
+
+def force_rank0_arrays (coeff,domains):
+  """Reduces the polynomial rank of funklets to 0, by keeping only the c00 coefficient.""";
+  return coeff.reshape((len(coeff),-1))[:,0],domains;
+
+def gaussian_smooth_arrays (coeff,domains,sigma,cutoff=5):
+  """Smooths coefficients along the slice axis with a Gaussian kernel. 'sigma' is given in axis units
+  (e.g. seconds for time), and the kernel is evaluated at the actual domain centers, so gaps in the
+  slice are handled properly. The kernel is cut off at 'cutoff' sigmas, so time and memory go as the
+  number of funklets times the number of funklets in the kernel window. Domains are left as is.""";
+  x = _centers(domains);
+  nfunk = len(coeff);
+  order = numpy.argsort(x,kind='mergesort');
+  x = x[order];
+  cc = coeff.reshape((nfunk,-1))[order];
+  # the kernel window of funklet i is [lo[i],hi[i]). Loop over offsets from i within the widest window,
+  # accumulating the weighted sum and the sum of weights
+  lo = numpy.searchsorted(x,x-cutoff*sigma,'left');
+  hi = numpy.searchsorted(x,x+cutoff*sigma,'right');
+  index = numpy.arange(nfunk);
+  total = numpy.zeros(cc.shape,numpy.result_type(cc,float));
+  norm = numpy.zeros(nfunk);
+  for offset in range((lo-index).min(),(hi-index).max()):
+    j = index+offset;
+    valid = (j >= lo)&(j < hi);
+    i,j = index[valid],j[valid];
+    weights = numpy.exp(-0.5*((x[j]-x[i])/sigma)**2);
+    total[i] += weights[:,numpy.newaxis]*cc[j];
+    norm[i] += weights;
+  out = numpy.empty_like(total);
+  out[order] = total/norm[:,numpy.newaxis];
+  return out.reshape(coeff.shape),domains;
+
+def median_smooth_arrays (coeff,domains,size=5):
+  """Applies a running median of 'size' funklets along the slice axis (edges are padded with
+  the first and last value). Windows are centred on each funklet, so an even 'size' is rounded up
+  to the next odd number. Domains are left as is.""";
+  _centers(domains);
+  nfunk = len(coeff);
+  half = size//2;
+  cc = coeff.reshape((nfunk,-1));
+  padded = numpy.concatenate([cc[:1].repeat(half,0),cc,cc[-1:].repeat(half,0)]);
+  # make (nfunk,size,ncoeff) view of sliding windows
+  windows = numpy.lib.stride_tricks.as_strided(padded,shape=(nfunk,half*2+1,cc.shape[1]),
+              strides=(padded.strides[0],)+padded.strides);
+  return numpy.median(windows,axis=1).reshape(coeff.shape),domains;
+
+def decimate_arrays (coeff,domains,factor=2):
+  """Averages every 'factor' consecutive funklets along the slice axis into one funklet,
+  defined over the envelope of their domains.""";
+  _centers(domains);
+  starts = numpy.arange(0,len(coeff),factor);
+  counts = numpy.diff(numpy.append(starts,len(coeff)));
+  out_coeff = numpy.add.reduceat(coeff,starts,axis=0)/counts.reshape((-1,)+(1,)*(coeff.ndim-1));
+  out_domains = numpy.array([numpy.minimum.reduceat(domains[:,:,0],starts,axis=0),
+                             numpy.maximum.reduceat(domains[:,:,1],starts,axis=0)]).transpose((1,2,0));
+  return out_coeff,out_domains,{},starts;
+
+def spline_resample_arrays (coeff,domains,num=None,step=None,k=3):
+  """Resamples coefficients onto a regular grid of domains along the slice axis, using an
+  interpolating spline of order k through the domain centers. The output grid spans the envelope
+  of the slice, and has either 'num' domains, or domains of size 'step'. Default is to keep the number of
+  domains the same.""";
+  x = _centers(domains);
+  if len(x) < 2:
+    return coeff,domains;
+  x0,x1 = domains[0,0,0],domains[-1,0,1];
+  if step:
+    num = max(int(numpy.ceil((x1-x0)/step)),1);
+  num = num or len(x);
+  edges = numpy.linspace(x0,x1,num+1);
+  spline = interpolate.make_interp_spline(x,coeff.reshape((len(coeff),-1)),k=min(k,len(x)-1),axis=0);
+  out_coeff = spline((edges[:-1]+edges[1:])/2).reshape((num,)+coeff.shape[1:]);
+  return out_coeff,numpy.array([edges[:-1],edges[1:]]).T[:,numpy.newaxis,:];
+
+def apply_arrays (array_func,funkslice,**kw):
+  """Calls an array-native reduction function on the coefficient and domain arrays of a slice.
+  Extra keywords are passed to array_func. Returns a FunkletArrays object, so output funklets are only
+  built when written out.""";
+  # imported here, since ParmTables imports this module in turn
+  import ParmTables
+  in_domains = funkslice.domain_array();
+  result = array_func(funkslice.coeff_array(),in_domains,**kw);
+  coeff,domains = result[:2];
+  polc_kw = result[2] if len(result) > 2 else {};
+  source = result[3] if len(result) > 3 else None;
+  if source is None:
+    if len(coeff) == len(funkslice):
+      source = numpy.arange(len(coeff));
+    else:
+      dist = abs(numpy.asarray(domains).mean(2)[:,numpy.newaxis,:] - in_domains.mean(2)[numpy.newaxis,:,:]).sum(2);
+      source = dist.argmin(1);
+  # only pass on the input funklets that are actually used
+  used,source = numpy.unique(source,return_inverse=True);
+  return ParmTables.FunkletArrays(coeff,domains,funkslice.slice_axes,[ funkslice[i] for i in used ],source,**polc_kw);
+
+def array_op (array_func,**kw):
+  """Makes a ParmTab.apply()-compatible function out of an array-native reduction function.
+  Extra keywords are passed to array_func. E.g.:
+    pt.apply(FunkOps.array_op(FunkOps.gaussian_smooth_arrays,sigma=600),"time")
+  """;
+  def op (funkslice):
+    return apply_arrays(array_func,funkslice,**kw);
+  op.__name__ = array_func.__name__.replace("_arrays","");
+  return op;
+
+# Functions for ParmTab.apply()
 
 def average (funkslice):
   """Reduction function to replace all funklets in a slice with their mean.
   This is the canonical example of a reduction function.
   """
-  outfunk = funkslice[0];
-  shape = getattr(outfunk.coeff,'shape',None);   # shape will be None when coeff is just a float
-  # accumulate sum of coefficients and take mean
-  for funk in funkslice[1:]:
-    outfunk.coeff += funk.coeff;
-    # adjust domain to envelope
-    for axis in funkslice.slice_axes:
-      outfunk.domain[axis] = (min(outfunk.domain[axis][0],funk.domain[axis][0]),
-                              max(outfunk.domain[axis][1],funk.domain[axis][1]));
-  outfunk.coeff /= len(funkslice);
-  return [ outfunk ];
+  return apply_arrays(average_arrays,funkslice);
 
 def linear_interpol (funkslice):
   """Reduction function to replace a set of funklets with piecewise linear interpolations. If the original
@@ -41,38 +173,30 @@ def linear_interpol (funkslice):
     return funkslice;
   if funkslice.rank > 1:
     raise TypeError,"linear interpolation only available for rank-1 slices";
-  iaxis0 = funkslice.slice_iaxes[0];
-  axis0 = funkslice.slice_axes[0];
-  output = [];
-  for ifunk0,funk0 in enumerate(funkslice[:-1]):
-    # funklet for next domain
-    funk1 = funkslice[ifunk0+1];
-    dom0,dom1 = funk0.domain,funk1.domain;
-    # centerpoint and c00 of ourselves
-    x0 = sum(dom0[axis0])/2;
-    c0 = funk0.coeff if isinstance(funk0.coeff,float) else funk0.coeff.ravel()[0];
-    # centerpoint and c00 of next domain
-    x1 = sum(dom1[axis0])/2;
-    c1 = funk1.coeff if isinstance(funk1.coeff,float) else funk1.coeff.ravel()[0];
-    # make output domain
-    out_domain = copy.copy(dom0);
-    # output domain boundaries are original subdomains' centers, with the exception of the first
-    # and the last funklet, in which case the domain needs to extend to the edge of the first/last
-    # subdomain
-    a0 = dom0[axis0][0] if funk0 is funkslice[0] else x0;
-    a1 = dom1[axis0][1] if funk1 is funkslice[-1] else x1;
-    out_domain[axis0] = (a0,a1);
-    # now make output polc
-    output.append(meq.polc(coeff=[c0,c1-c0],domain=out_domain,offset=x0,scale=x1-x0,axis_index=iaxis0))
-  return output;
+  return apply_arrays(linear_interpol_arrays,funkslice,axis_index=funkslice.slice_iaxes[0]);
 
 def force_rank0 (funkslice):
   """Reduction function to reduce the polynomial rank of a set of funklets"""
-  output = [];
-  for funk in funkslice:
-    c00 = funk.coeff if isinstance(funk.coeff,float) else funk.coeff.ravel()[0];
-    output.append(meq.polc(coeff=c00,domain=funk.domain));
-  return output;
+  return apply_arrays(force_rank0_arrays,funkslice);
+
+def gaussian_smooth (funkslice,sigma=None):
+  """Reduction function to smooth funklets along the slice axis with a Gaussian kernel.
+  Default 'sigma' is 3 times the median domain size. See gaussian_smooth_arrays().""";
+  if sigma is None:
+    sigma = 3*numpy.median(numpy.diff(funkslice.domain_array()[:,0,:],axis=1));
+  return apply_arrays(gaussian_smooth_arrays,funkslice,sigma=sigma);
+
+def median_smooth (funkslice,size=5):
+  """Reduction function to apply a running median along the slice axis. See median_smooth_arrays().""";
+  return apply_arrays(median_smooth_arrays,funkslice,size=size);
+
+def decimate (funkslice,factor=2):
+  """Reduction function to decimate funklets along the slice axis. See decimate_arrays().""";
+  return apply_arrays(decimate_arrays,funkslice,factor=factor);
+
+def spline_resample (funkslice,num=None,step=None,k=3):
+  """Reduction function to resample funklets along the slice axis. See spline_resample_arrays().""";
+  return apply_arrays(spline_resample_arrays,funkslice,num=num,step=step,k=k);
 
 _sub = dict([(a+b+c,b+c+':'+a) for a in 'ri' for b in 'xy' for c in 'xy' ]);
 
@@ -6,6 +6,8 @@ import sys
 import traceback
 import cPickle
 import copy
+import itertools
+import multiprocessing
 import numpy
 import numpy.ma
 
@@ -97,6 +99,28 @@ class FunkSlice (object):
     return self.funklets[key];
   def __iter__ (self):
     return iter(self.funklets);
+  def coeff_array (self):
+    """Returns coefficients of all funklets stacked into one array, of shape (N,)+coeff_shape.
+    If funklets have coefficient arrays of different shapes (or some are scalars), they're padded with
+    zeroes (i.e. treated as zero higher-order coefficients) to a common shape.
+    """;
+    coeffs = [ numpy.asarray(funk.coeff) for funk in self.funklets ];
+    shapes = set([ c.shape for c in coeffs ]);
+    if len(shapes) == 1:
+      return numpy.array(coeffs);
+    ndim = max([ c.ndim for c in coeffs ]);
+    coeffs = [ c.reshape(c.shape+(1,)*(ndim-c.ndim)) for c in coeffs ];
+    shape = tuple(numpy.array([ c.shape for c in coeffs ]).max(0));
+    arr = numpy.zeros((len(coeffs),)+shape,float);
+    for i,c in enumerate(coeffs):
+      arr[(i,)+tuple([ slice(0,n) for n in c.shape ])] = c;
+    return arr;
+  def domain_array (self,axes=None):
+    """Returns domain boundaries of all funklets as an array of shape (N,len(axes),2), where
+    [:,i,0] and [:,i,1] are the start and end of each domain along axis i.
+    Default 'axes' is the slice axes.""";
+    axes = axes if axes is not None else self.slice_axes;
+    return numpy.array([ [ funk.domain[axis] for axis in axes ] for funk in self.funklets ],float);
   def array (self,coeff=0,fill_value=0,masked=True,collapse=True):
     """Returns funklet coefficients arranged into a hypercube.
     'coeff' is applied as an index into each funklet's coeff array, so coeff=0 or coeff=(0,0) selects
@@ -155,6 +179,51 @@ class FunkSlice (object):
       arr.shape = shape[:(self.slice_iaxes[-1]+1)];
     return arr;
 
+class FunkletArrays (object):
+  """FunkletArrays represents a set of funklets as stacked arrays. Array-native reduction functions
+  (see FunkOps) return this instead of a funklet list, so that the funklets themselves are only
+  built when ParmTab.apply() writes them out, and only arrays need to be passed back from worker processes.
+  'coeff' is an array of shape (N,)+coeff_shape. 'domains' is an array of shape (N,len(axes),2) giving domain
+  boundaries along 'axes'. Each output funklet is a copy of one of the input funklets in 'templates' (given by
+  the index array 'source', default is one template per output funklet), with the coefficients and the domain
+  boundaries along 'axes' replaced, so that offset, scale and other funklet attributes are preserved.
+  Other keywords are funklet attributes to be replaced as well (e.g. offset, scale), and may be scalars or
+  arrays of length N.
+  """;
+  def __init__ (self,coeff,domains,axes,templates,source=None,**polc_kw):
+    self.coeff = numpy.asarray(coeff);
+    self.domains = numpy.asarray(domains);
+    self.axes = axes;
+    self.templates = list(templates);
+    self.source = numpy.arange(len(self.coeff)) if source is None else numpy.asarray(source,int);
+    self.polc_kw = polc_kw;
+  def __len__ (self):
+    return len(self.coeff);
+  def __iter__ (self):
+    return self.make_funklets();
+  def make_funklets (self):
+    """Generates the funklets""";
+    for i,coeff in enumerate(self.coeff):
+      funk = copy.deepcopy(self.templates[self.source[i]]);
+      for iaxis,axis in enumerate(self.axes):
+        funk.domain[axis] = tuple(map(float,self.domains[i,iaxis]));
+      funk.coeff = float(coeff) if not coeff.ndim else coeff;
+      for key,value in self.polc_kw.iteritems():
+        value = value[i] if numpy.ndim(value) else value;
+        setattr(funk,key,value.item() if isinstance(value,numpy.generic) else value);
+      yield funk;
+
+def _is_funklet_arrays (outfunk):
+  """Helper function: True if outfunk is a FunkletArrays object. This checks for the interface rather than the
+  class, since FunkOps may see this module under a different name (e.g. when it is run as a script).""";
+  return hasattr(outfunk,'make_funklets');
+
+def _num_funklets (outfunk):
+  """Helper function: counts output funklets in the return value of an op_func""";
+  if _is_funklet_arrays(outfunk):
+    return len(outfunk);
+  return sum([ len(ff) if _is_funklet_arrays(ff) else 1 for ff in (outfunk or []) if not isinstance(ff,str) ]);
+
 class FunkSet (object):
   """FunkSet represents a set of funklets with the same name""";
   def __init__ (self,parmtab,name):
@@ -248,7 +317,37 @@ class FunkSet (object):
       arr.shape = [ n for i,n in enumerate(arr.shape) if not self.pt.axis_stats(i).empty() ];
     return arr;
 
-  def apply (self,op_func,slicing=[],outtab=None,remove=False):
+  def get_slices (self,slicing=[],domains=None):
+    """Bulk version of get_slice(). Reads all funklets for this name in one pass, and returns a list
+    of FunkSlices, one for every slice of 'slicing' (see ParmTab.make_slicing()) that contains any funklets.
+    Slices are returned in the order of the slicing.
+    'domains' is a list of domain indices to read (see ParmTab.funklet_domains()). Default is to try
+    every domain in the table.
+    """;
+    slicing = self.pt.make_slicing(slicing);
+    iaxes = self.pt.slice_iaxes(slicing);
+    if domains is None:
+      domains = range(len(self.pt._domain_cell_index));
+    pt = self.pt.parmtable();
+    # read funklets and sort them into slices
+    slices = {};
+    for idom in domains:
+      idx = self.pt._domain_cell_index[idom];
+      funk = pt.get_funklet(self.name,idom);
+      if funk:
+        funk.domain_index = idom;
+        funk.slice_index = idx;
+        slices.setdefault(self.pt.slice_key(idx,iaxes),[]).append(funk);
+    # now make FunkSlices, with funklets ordered as get_slice() would have them
+    output = [];
+    for sl0 in slicing:
+      funklist = slices.get(tuple(sl0));
+      if funklist:
+        funklist.sort(key=lambda funk:[ funk.slice_index[iaxis] for iaxis in iaxes ]);
+        output.append(FunkSlice(self.pt,self.name,funklist,list(sl0),iaxes));
+    return output;
+
+  def apply (self,op_func,slicing=[],outtab=None,remove=False,**kw):
     """For each funklet in the subset, takes all funklets along the designated slicing axis
     (i.e. for each slice along the non-listed axes), creates a FunkSlice, and calls
     op_func(slice).
@@ -259,64 +358,125 @@ class FunkSet (object):
     if 'outtab' is None, a new output table is created. Otherwise set outtab to a filename, or a
     ParmTab, or a FastParmTable.
     If 'remove' is True, input funklets will be removed if an output funklet is returned.
+    Other keyword arguments (ncpu, batch_size, dry_run) are passed to ParmTab.apply().
     """;
-    # resolve tables
-    outtab = self.pt.resolve_output_table(outtab);
-    pt = self.pt.parmtable();
-    # resolve slicing
-    slicing = self.pt.make_slicing(slicing);
-    # loop over funklets and slices
-    num_infunk = num_outfunk = num_slices = 0;
-    for sl0 in slicing:
-      funklets = self.get_slice(*sl0);
-      # call reduction function if we find any
-      if funklets:
-        num_slices += 1;
-        num_infunk += len(funklets);
-        dprintf(4,"%s slice %s: %d funklets found\n",self.name,sl0,len(funklets));
-        dprint(6,"first funklet:",funklets[0]);
-        dprint(6,"last funklet:",funklets[-1]);
+    return self.pt.apply(op_func,slicing,outtab=outtab,remove=remove,names=[self.name],**kw);
+
+
+# Context of the current ParmTab.apply() call, as a (parmtab,op_func) tuple. This is set up before
+# the worker pool is forked, so the workers inherit the parmtab index and op_func without having
+# to pickle them.
+_apply_context = None;
+
+def _apply_worker (task):
+  """Helper function for ParmTab.apply(). Calls op_func on one slice, and returns a
+  (name,slice_index,domains,outfunk,error) tuple. 'domains' is the list of input domain indices,
+  'error' is a formatted traceback if op_func failed, or None on success.
+  Runs in a worker process (or in-process, when apply() is called with ncpu=1).""";
+  pt,op_func = _apply_context;
+  name,index,iaxes,funklist = task;
+  domains = [ funk.domain_index for funk in funklist ];
+  try:
+    return name,index,domains,op_func(FunkSlice(pt,name,funklist,index,iaxes)),None;
+  except:
+    return name,index,domains,None,traceback.format_exc();
+
+class _FunkletWriter (object):
+  """Helper class for ParmTab.apply(). Buffers up output funklets and writes them out in batches.
+  Input funklets slated for removal are deleted in close(), once all slices have been read. If the output
+  table is the input table, they are deleted as each slice is added instead, before its output funklets
+  are written, since these may go to the same domains.
+  A single writer is used per apply() call, so only one process ever writes to the tables.""";
+  def __init__ (self,intab,outtab,batch_size):
+    self.intab,self.outtab = intab,outtab;
+    self.inplace = outtab is intab or os.path.realpath(outtab.filename) == os.path.realpath(intab.filename);
+    self.batch_size = batch_size;
+    self.num_outfunk = 0;
+    self._pending = [];
+    self._num_pending = 0;
+    self._remove = [];
+    # name:set_of_domain_indices of input funklets deleted so far
+    self._removed = {};
+    # names written to the output table
+    self._written = set();
+
+  def add (self,name,sl0,outfunk,domains=None):
+    """Adds output of op_func() for one slice. 'outfunk' is the list of funklets and names returned
+    by op_func(), or a FunkletArrays object. 'domains' is a list of input domain indices to be removed, or None.""";
+    if _is_funklet_arrays(outfunk):
+      outfunk = [ outfunk ];
+    funkname = name;
+    for ff in outfunk:
+      if isinstance(ff,str):
+        funkname = ff;
+      else:
+        self._pending.append((funkname,ff,name,sl0));
+        self._num_pending += len(ff) if _is_funklet_arrays(ff) else 1;
+    if domains:
+      dprintf(4,"%s slice %s: removing %d input funklets\n",name,sl0,len(domains));
+      self._remove += [ (name,idom) for idom in domains ];
+      if self.inplace:
+        self._delete_funklets();
+    if self._num_pending >= self.batch_size:
+      self.flush();
+
+  def flush (self):
+    """Writes out pending output funklets""";
+    if not self._pending:
+      return;
+    dprintf(4,"writing %d output funklets\n",self._num_pending);
+    self.outtab.mtime = time.time();
+    pt = self.outtab.parmtable(True);
+    names = set();
+    domains = [];
+    for funkname,ff,name,sl0 in self._pending:
+      # FunkletArrays are turned into funklets here
+      for funk in (ff.make_funklets() if _is_funklet_arrays(ff) else [ff]):
         try:
-          outfunk = op_func(funklets);
-          dprint(6,"output funklets:",outfunk);
+          pt.put_funklet(funkname,funk);
+          names.add(funkname);
+          domains.append(funk.domain);
+          self.num_outfunk += 1;
         except:
+          dprintf(0,"error saving funklet for %s slice %s\n",name,sl0);
           if verbosity.get_verbose() > 0:
-            dprintf(1,"exception computing funklets for %s slice %s\n",self.name,sl0);
             traceback.print_exc();
-            dprintf(1,"this slice will be ignored\n");
-          outfunk = None;
-        # if a new funklet was generated, write it to output
-        if outfunk:
-          # remove input funklets if successful
-          if remove:
-            dprintf(4,"%s slice %s: removing %d input funklets\n",self.name,sl0,len(funklist));
-            for funk in funklist:
-              try:
-                self.mtime = time.time();
-                self.parmtable(True).delete_funklet(self.name,funk.domain_index);
-              except:
-                if verbosity.get_verbose() > 0:
-                  traceback.print_exc();
-                dprintf(0,"error deleting funklet for %s slice %s\n",self.name,funk.slice_index);
-          dprintf(4,"%s slice %s: writing %d output funklets\n",self.name,sl0,len(outfunk));
-          name = self.name;
-          for ff in outfunk:
-            if isinstance(ff,str):
-              name = ff;
-            else:
-              num_outfunk += 1;
-              try:
-                outtab.mtime = time.time();
-                outtab.parmtable(True).put_funklet(name,ff);
-              except:
-                dprintf(0,"error saving funklet for %s slice %s\n",self.name,sl0);
-                if verbosity.get_verbose() > 0:
-                  traceback.print_exc();
-                dprintf(0,"this slice will be ignored\n");
-                funk = None;
-                break;
-    dprintf(3,"%s: %s() transformed %d input funklets over %d slices into %d output funklets\n",self.name,op_func.__name__,num_infunk,num_slices,num_outfunk);
+          dprintf(0,"this funklet will be ignored\n");
+    self._pending = [];
+    self._num_pending = 0;
+    pt = None;
+    self._written.update(names);
+    self.outtab.update_index(names,domains=domains);
+
+  def _delete_funklets (self):
+    """Deletes the input funklets slated for removal""";
+    if not self._remove:
+      return;
+    dprintf(3,"removing %d input funklets\n",len(self._remove));
+    self.intab.mtime = time.time();
+    pt = self.intab.parmtable(True);
+    for name,idom in self._remove:
+      try:
+        pt.delete_funklet(name,idom);
+        self._removed.setdefault(name,set()).add(idom);
+      except:
+        if verbosity.get_verbose() > 0:
+          traceback.print_exc();
+        dprintf(0,"error deleting funklet for %s domain %d\n",name,idom);
+    self._remove = [];
 
+  def close (self,domains={}):
+    """Writes out pending output funklets, and removes input funklets. 'domains' is a dict of
+    name:list_of_domain_indices for the input table (see ParmTab.funklet_domains()), used to work
+    out which names have had all their funklets removed.""";
+    self.flush();
+    self._delete_funklets();
+    if not self._removed:
+      return;
+    # names written back to the input table keep their index entries
+    written = self._written if self.inplace else set();
+    self.intab.update_index(removed_names=[ name for name,idoms in self._removed.iteritems()
+                                            if name not in written and idoms.issuperset(domains.get(name,[])) ]);
 
 
 class ParmTab (object):
@@ -362,6 +522,7 @@ class ParmTab (object):
     self.filename = filename;
     self.parmtable(write);
     self._cachepath = os.path.join(filename,'ParmTab.cache');
+    self._journalpath = os.path.join(filename,'ParmTab.journal');
     self._make_axis_index();
 
   def merge (self,filename):
@@ -382,8 +543,10 @@ class ParmTab (object):
           self.mtime = time.time();
           pt.put_funklet(name,pt1.get_funklet(name,idom));
         dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
-        pt1 = None;
-        self._make_axis_index();
+        pt = pt1 = None;
+        self.update_index(set([ name for name,idom,domain in funklist ]),
+                          domains=[ domain for name,idom,domain in funklist ]);
+        dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
       finally:
         self._end_progress();
 
@@ -453,12 +616,18 @@ class ParmTab (object):
 
   def _make_axis_index (self):
     """Builds up various indices based on content of the parmtable""";
-    # check if cache is up-to-date
-    cachepath = os.path.join(self.filename,'ParmTab.cache');
+    # check if cache is up-to-date. The journal records incremental updates made since the cache was written,
+    # so the cache is valid if either it or the journal is newer than the funklets.
+    cachepath = self._cachepath;
+    journalpath = self._journalpath;
     funkpath = os.path.join(self.filename,'funklets');
     self.mtime = os.path.getmtime(funkpath) if os.path.exists(funkpath) else time.time();
     try:
-      has_cache = os.path.getmtime(cachepath) >= self.mtime;
+      cache_mtime = os.path.getmtime(cachepath) if os.path.exists(cachepath) else 0;
+      journal_mtime = os.path.getmtime(journalpath) if os.path.exists(journalpath) else 0;
+      if journal_mtime < cache_mtime:
+        journal_mtime = 0;
+      has_cache = max(cache_mtime,journal_mtime) >= self.mtime;
       if not has_cache:
         dprintf(2,"cache is out of date, will regenerate\n");
     except:
@@ -473,6 +642,11 @@ class ParmTab (object):
         self._domain_fullset,self._domain_cell_index,self._domain_reverse_index \
           = cPickle.load(file(cachepath));
         dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
+        self._journal_size = 0;
+        if journal_mtime:
+          dprintf(2,"replaying index journal\n");
+          self._replay_journal();
+          dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
         return;
       except:
         if verbosity.get_verbose() > 0:
@@ -482,67 +656,189 @@ class ParmTab (object):
     # no cache, so regenerate everything
     if not has_cache:
       self._axis_stats = [ _AxisStats(mequtils.get_axis_id(i)) for i in range(mequtils.max_axis) ];
+      self._domain_list = [];
+      self._domain_fullset = [None]*mequtils.max_axis;
+      self._domain_cell_index = [];
+      self._domain_reverse_index = {};
+      self._funklet_names = [];
+      self._name_components = [];
       pt = self.parmtable();
       dprintf(2,"loading domain list\n");
-      self._domain_list = pt.domain_list();
-      dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
-      dprintf(2,"collecting axis stats\n");
-      self._axes = {};
-      for domain in self._domain_list:
-        for axis,rng in domain.iteritems():
-          if str(axis) != 'axis_map':
-            self._axis_stats[mequtils.get_axis_number(axis)].add_cell(*rng);
+      domain_list = pt.domain_list();
       dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
-      dprintf(2,"finalizing axis stats\n");
-      self._domain_fullset = [None]*mequtils.max_axis;
+      dprintf(2,"making subdomain indices\n");
+      self._index_domains(list(enumerate(domain_list)));
       for iaxis,stats in enumerate(self._axis_stats):
-        stats.update();
         if not stats.empty():
-          self._domain_fullset[iaxis] = range(len(stats.cells));
           dprintf(2,"axis %s: %d unique cells from %g to %g\n",stats.name,len(stats.cells),*stats.minmax);
       dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
-      dprintf(2,"making subdomain indices\n");
-      # now make a subdomain index
-      self._domain_cell_index = [0]*len(self._domain_list);
-      self._domain_reverse_index = {};
-      for idom,domain in enumerate(self._domain_list):
-        index = [None]*mequtils.max_axis;
-        for axis,rng in domain.iteritems():
-          if str(axis) != 'axis_map':
-            iaxis = mequtils.get_axis_number(axis);
-            index[iaxis] = self._axis_stats[iaxis].lookup_cell(*rng);
-        # insert into domain_cells_index and domain_reverse_index
-        index = tuple(index);
-        self._domain_cell_index[idom] = index;
-        self._domain_reverse_index[index] = idom;
-      dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
 
       dprintf(2,"loading funklet name list\n");
-      self._funklet_names = list(pt.name_list());
+      funklet_names = list(pt.name_list());
       dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
       dprintf(2,"computing funklet indices\n");
-      self._name_components = {};
-      for name in self._funklet_names:
-        for i,token in enumerate(name.split(':')):
-          self._name_components.setdefault(i,set()).add(token);
-      self._name_components = [ self._name_components[i] for i in range(len(self._name_components)) ];
+      self._index_names(funklet_names);
       for i,values in enumerate(self._name_components):
         dprintf(2,"component %d: %s\n",i,' '.join(values));
       dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
 
       dprintf(2,"writing cache\n");
+      self._write_index_cache();
+      dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
+
+  def _write_index_cache (self):
+    """Writes index to the cache file, and removes the journal (since its contents are now in the cache)""";
+    self._journal_size = 0;
+    try:
+      if os.path.exists(self._journalpath):
+        os.remove(self._journalpath);
+      cPickle.dump((
+          self._funklet_names,self._domain_list,self._axis_stats,self._name_components, \
+          self._domain_fullset,self._domain_cell_index,self._domain_reverse_index \
+        ),file(self._cachepath,'w'),cPickle.HIGHEST_PROTOCOL
+      );
+    except:
+      if verbosity.get_verbose() > 0:
+        traceback.print_exc();
+      dprintf(0,"%s: error writing stats to cache, will probably regenerate next time\n",self.filename);
+
+  def _replay_journal (self):
+    """Applies the updates recorded in the journal to the index""";
+    ff = file(self._journalpath,'rb');
+    while True:
+      try:
+        domains,names,removed_names = cPickle.load(ff);
+      except EOFError:
+        break;
+      self._index_domains(domains);
+      self._index_names(names);
+      self._unindex_names(removed_names);
+      self._journal_size += 1;
+
+  # once the journal has this many entries, the index is written out to the cache in full
+  max_journal_size = 100;
+
+  def update_index (self,names=[],removed_names=[],domains=None):
+    """Incrementally updates the index after funklets have been written to (or removed from) the table.
+    'names' is a list of funklet names that have been written, 'removed_names' is a list of names
+    that no longer have any funklets in the table. 'domains' is a list of the domains of the funklets
+    that have been written: those not yet in the index are added (the table numbers new domains in order
+    of appearance). If 'domains' is None, new domains are picked up from the end of the table's domain
+    list, which means reading the whole list. The update is appended to the on-disk journal, rather
+    than rewriting the cache.
+    """;
+    # reopen the table, so that any pending writes are flushed out before we write the journal
+    self.close();
+    if domains is None:
+      domain_list = self.parmtable().domain_list();
+      domains = [ (idom,domain_list[idom]) for idom in range(len(self._domain_list),len(domain_list)) ];
+    else:
+      domains = self._new_domains(domains);
+    names = list(names);
+    dprintf(2,"updating index with %d new domains and %d new names, %d names removed\n",
+      len(domains),len(names),len(removed_names));
+    self._index_domains(domains);
+    self._index_names(names);
+    self._unindex_names(removed_names);
+    funkpath = os.path.join(self.filename,'funklets');
+    self.mtime = os.path.getmtime(funkpath) if os.path.exists(funkpath) else time.time();
+    if self._journal_size >= self.max_journal_size:
+      self._write_index_cache();
+    else:
       try:
-        cPickle.dump((
-            self._funklet_names,self._domain_list,self._axis_stats,self._name_components, \
-            self._domain_fullset,self._domain_cell_index,self._domain_reverse_index \
-          ),file(cachepath,'w')
-        );
+        cPickle.dump((domains,names,removed_names),file(self._journalpath,'ab'),cPickle.HIGHEST_PROTOCOL);
+        self._journal_size += 1;
       except:
         if verbosity.get_verbose() > 0:
           traceback.print_exc();
-        dprintf(0,"%s: error writing stats to cache, will probably regenerate next time\n",self.filename);
-      dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
+        dprintf(0,"%s: error writing index journal, will probably regenerate next time\n",self.filename);
+
+  def _new_domains (self,domains):
+    """Returns the domains in the given list that are not yet in the index, as a list of (idom,domain) pairs,
+    numbering them from the end of the current domain list.""";
+    new = [];
+    seen = set();
+    for domain in domains:
+      centres = [ (mequtils.get_axis_number(axis),(rng[0]+rng[1])/2)
+                  for axis,rng in domain.iteritems() if str(axis) != 'axis_map' ];
+      key = tuple(sorted(centres));
+      if key in seen:
+        continue;
+      seen.add(key);
+      # look up the cell numbers: a domain with cells not yet in the grid, or a combination
+      # of cells not yet indexed, is new
+      index = [None]*mequtils.max_axis;
+      try:
+        for iaxis,x0 in centres:
+          index[iaxis] = self._axis_stats[iaxis].cell_index[x0];
+      except (AttributeError,KeyError):
+        index = None;
+      if index is None or tuple(index) not in self._domain_reverse_index:
+        new.append((len(self._domain_list)+len(new),domain));
+    return new;
 
+  def _index_domains (self,domains):
+    """Adds domains to the axis stats and subdomain indices. 'domains' is a list of (idom,domain) pairs.
+    If the new domains insert cells into the middle of an axis grid, cell numbers of the existing domains are
+    remapped.""";
+    # add cells to axis stats
+    changed_axes = set();
+    for idom,domain in domains:
+      for axis,rng in domain.iteritems():
+        if str(axis) != 'axis_map':
+          iaxis = mequtils.get_axis_number(axis);
+          self._axis_stats[iaxis].add_cell(*rng);
+          changed_axes.add(iaxis);
+    # update grids, and remap existing cell numbers if needed
+    remap = False;
+    for iaxis in changed_axes:
+      stats = self._axis_stats[iaxis];
+      grid0 = getattr(stats,'grid',[]);
+      stats.update();
+      self._domain_fullset[iaxis] = range(len(stats.cells));
+      if stats.grid[:len(grid0)] != grid0:
+        dprintf(3,"axis %s: grid has changed, remapping cell numbers\n",stats.name);
+        cellmap = [ stats.cell_index[x0] for x0 in grid0 ];
+        for idom,index in enumerate(self._domain_cell_index):
+          if index[iaxis] is not None:
+            index = list(index);
+            index[iaxis] = cellmap[index[iaxis]];
+            self._domain_cell_index[idom] = tuple(index);
+        remap = True;
+    if remap:
+      self._domain_reverse_index = dict([ (index,idom) for idom,index in enumerate(self._domain_cell_index) ]);
+    # now add new domains to the subdomain indices
+    for idom,domain in domains:
+      index = [None]*mequtils.max_axis;
+      for axis,rng in domain.iteritems():
+        if str(axis) != 'axis_map':
+          iaxis = mequtils.get_axis_number(axis);
+          index[iaxis] = self._axis_stats[iaxis].lookup_cell(*rng);
+      index = tuple(index);
+      self._domain_list.append(domain);
+      self._domain_cell_index.append(index);
+      self._domain_reverse_index[index] = idom;
+
+  def _index_names (self,names):
+    """Adds funklet names to the name indices""";
+    known_names = set(self._funklet_names);
+    for name in names:
+      if name not in known_names:
+        known_names.add(name);
+        self._funklet_names.append(name);
+        for i,token in enumerate(name.split(':')):
+          if i >= len(self._name_components):
+            self._name_components.append(set());
+          self._name_components[i].add(token);
+
+  def _unindex_names (self,names):
+    """Removes funklet names from the name indices""";
+    if names:
+      names = set(names);
+      funklet_names = [ name for name in self._funklet_names if name not in names ];
+      self._funklet_names = [];
+      self._name_components = [];
+      self._index_names(funklet_names);
 
   def resolve_output_table (self,outtab,new=False):
     """Helper function. Resolves outtab to a ParmTab object as follows:
@@ -567,10 +863,29 @@ class ParmTab (object):
       slicing = [slicing];
     return DomainSlicing(slicing,self._domain_fullset);
 
+  def slice_iaxes (self,slicing):
+    """Returns list of axis numbers which are part of the slices of the given DomainSlicing""";
+    return [ iaxis for iaxis,stats in enumerate(self._axis_stats)
+             if not stats.empty() and slicing[0][iaxis] is None ];
+
+  def slice_key (self,index,iaxes):
+    """Helper function: converts a domain cell index into the key (as a tuple) of the slice containing it.
+    'iaxes' is the list of slice axes, as returned by slice_iaxes().""";
+    return tuple([ None if iaxis in iaxes else i for iaxis,i in enumerate(index) ]);
+
+  def funklet_domains (self):
+    """Returns dict of name:list_of_domain_indices, giving the domains for which each funklet name has funklets.
+    This only reads the funklet list, and not the funklets themselves.""";
+    domains = {};
+    for name,idom,domain in self.parmtable().funklet_list():
+      domains.setdefault(name,[]).append(idom);
+    return domains;
+
   def funkset (self,name):
     return FunkSet(self,name);
 
-  def apply (self,op_func,slicing,outtab=None,remove=False,newtab=False):
+  def apply (self,op_func,slicing,outtab=None,remove=False,newtab=False,names=None,
+             ncpu=1,batch_size=10000,dry_run=False,sample_slices=20):
     """For each funklet in our table, takes all funklets along the designated slicing axis
     (i.e. for each slice along the non-listed axes), creates a FunkSlice, and calls
     op_func(slice).
@@ -579,25 +894,139 @@ class ParmTab (object):
     if 'outtab' is None, a new output table is created. Otherwise set outtab to a filename, or a
     ParmTab, or a FastParmTable.
     If 'remove' is True, input funklets will be removed if an output funklet is returned.
+    'names' is a list of funklet names to operate on. Default is all names in the table.
+    'ncpu' is the number of worker processes to run op_func in. Slices are read in bulk by this process,
+    op_func is called in a process pool, and output funklets are buffered and written out by this
+    process, so that only one process ever writes to the tables. Use ncpu=1 to run everything in-process,
+    or ncpu=0 to use one worker per CPU.
+    'batch_size' is the number of input funklets read in before they are dispatched to the pool, and
+    the number of output funklets buffered before they are written out.
+    If 'dry_run' is True, nothing is written. Instead, the funklet list is scanned to count slices and
+    input funklets, and op_func is timed on the first 'sample_slices' slices to estimate the number
+    of output funklets and the total run time.
+    Returns a dict of statistics with the keys 'names', 'slices', 'funklets_in', 'funklets_out' and 'time'
+    (for a dry run, 'funklets_out' and 'time' are estimates.)
     """;
+    global _apply_context;
     t0 = time.time();
-    nn = len(self.funklet_names());
-    self._start_progress("applying operation '%s'"%op_func.__name__,nn);
+    names = sort_qualified_names(names if names is not None else self.funklet_names());
+    dprintf(3,"input slicing is %s\n",slicing);
+    slicing = self.make_slicing(slicing);
+    dprintf(2,"%d slices will be iterated over\n",len(slicing));
+    domains = self.funklet_domains();
+    if dry_run:
+      try:
+        return self._estimate_apply(op_func,slicing,names,domains,ncpu,sample_slices);
+      finally:
+        self.close();
+    stats = dict(names=len(names),slices=0,funklets_in=0,funklets_out=0);
+    pool = None;
+    self._start_progress("applying operation '%s'"%op_func.__name__,len(names) or 1);
     try:
       outtab = self.resolve_output_table(outtab,newtab);
       dprintf(1,"using output table %s\n",outtab.filename);
-      pt = self.parmtable();
-      # loop over funklets and slices
-      dprintf(3,"input slicing is %s\n",slicing);
-      slicing = self.make_slicing(slicing);
-      dprintf(2,"%d slices will be iterated over\n",len(slicing));
-      for iname,name in enumerate(sort_qualified_names(self.funklet_names())):
+      writer = _FunkletWriter(self,outtab,batch_size);
+      # set up context before forking, so that workers inherit it
+      _apply_context = self,op_func;
+      if ncpu != 1:
+        ncpu = ncpu or multiprocessing.cpu_count();
+        pool = multiprocessing.Pool(ncpu);
+        dprintf(2,"started pool of %d worker processes\n",ncpu);
+      tasks = [];
+      num_infunk = 0;
+      for iname,name in enumerate(names):
         self._report_progress(iname);
-        self.funkset(name).apply(op_func,slicing,outtab=outtab,remove=remove);
+        for funkslice in self.funkset(name).get_slices(slicing,domains.get(name,[])):
+          dprintf(4,"%s slice %s: %d funklets found\n",name,funkslice.slice_index,len(funkslice));
+          tasks.append((name,funkslice.slice_index,funkslice.slice_iaxes,funkslice.funklets));
+          num_infunk += len(funkslice);
+          stats['slices'] += 1;
+          stats['funklets_in'] += len(funkslice);
+        if num_infunk >= batch_size:
+          self._run_apply_tasks(tasks,pool,ncpu,writer,remove);
+          tasks = [];
+          num_infunk = 0;
+      self._run_apply_tasks(tasks,pool,ncpu,writer,remove);
+      writer.close(domains);
+      stats['funklets_out'] = writer.num_outfunk;
+      if pool:
+        pool.close();
+        pool.join();
+        pool = None;
     finally:
-      dprintf(2,"elapsed time: %f seconds\n",time.time()-t0); t0 = time.time();
+      if pool:
+        pool.terminate();
+      _apply_context = None;
+      stats['time'] = time.time()-t0;
+      dprintf(2,"elapsed time: %f seconds\n",stats['time']);
       self._end_progress(False);
       self.close();
+    dprintf(1,"%s() transformed %d input funklets over %d slices into %d output funklets\n",
+      op_func.__name__,stats['funklets_in'],stats['slices'],stats['funklets_out']);
+    return stats;
+
+  def _run_apply_tasks (self,tasks,pool,ncpu,writer,remove):
+    """Helper function for apply(). Runs a batch of tasks through _apply_worker, and passes the output to writer.""";
+    if not tasks:
+      return;
+    if pool:
+      chunksize = max(len(tasks)//(4*ncpu),1);
+      results = pool.imap_unordered(_apply_worker,tasks,chunksize);
+    else:
+      results = itertools.imap(_apply_worker,tasks);
+    for name,sl0,domains,outfunk,error in results:
+      if error:
+        if verbosity.get_verbose() > 0:
+          dprintf(1,"exception computing funklets for %s slice %s\n",name,sl0);
+          sys.stderr.write(error);
+          dprintf(1,"this slice will be ignored\n");
+      elif outfunk:
+        dprintf(4,"%s slice %s: %d output funklets\n",name,sl0,_num_funklets(outfunk));
+        writer.add(name,sl0,outfunk,domains if remove else None);
+
+  def _estimate_apply (self,op_func,slicing,names,domains,ncpu,sample_slices):
+    """Helper function for apply(dry_run=True). Counts slices and input funklets, and times op_func
+    on a sample of slices to estimate the output size and the run time.""";
+    global _apply_context;
+    iaxes = self.slice_iaxes(slicing);
+    stats = dict(names=len(names),slices=0,funklets_in=0);
+    for name in names:
+      doms = domains.get(name,[]);
+      stats['slices'] += len(set([ self.slice_key(self._domain_cell_index[idom],iaxes) for idom in doms ]));
+      stats['funklets_in'] += len(doms);
+    # time reading and op_func on a sample of slices
+    sample_in = sample_out = 0;
+    read_time = op_time = 0;
+    _apply_context = self,op_func;
+    try:
+      for name in names:
+        if sample_in and sample_slices <= 0:
+          break;
+        t0 = time.time();
+        funkslices = self.funkset(name).get_slices(slicing,domains.get(name,[]))[:max(sample_slices,1)];
+        read_time += time.time()-t0;
+        t0 = time.time();
+        for funkslice in funkslices:
+          sample_slices -= 1;
+          sample_in += len(funkslice);
+          outfunk = _apply_worker((name,funkslice.slice_index,funkslice.slice_iaxes,funkslice.funklets))[3];
+          sample_out += _num_funklets(outfunk);
+        op_time += time.time()-t0;
+    finally:
+      _apply_context = None;
+    # extrapolate to full table
+    if sample_in:
+      if ncpu != 1:
+        ncpu = ncpu or multiprocessing.cpu_count();
+      scale = stats['funklets_in']/float(sample_in);
+      stats['funklets_out'] = int(round(sample_out*scale));
+      stats['time'] = (read_time + op_time/ncpu)*scale;
+    else:
+      stats['funklets_out'] = 0;
+      stats['time'] = 0;
+    dprintf(1,"%s(): %d input funklets over %d slices, estimate %d output funklets in %.1f seconds\n",
+      op_func.__name__,stats['funklets_in'],stats['slices'],stats['funklets_out'],stats['time']);
+    return stats;
 
 
 def open (*args,**kw):
@@ -616,12 +1045,18 @@ if __name__ == '__main__':
   else:
     verbose(3);
     pt = ParmTab(sys.argv[1]);
+    kw = dict(newtab=True,dry_run='-dry-run' in sys.argv);
+    if '-j' in sys.argv:
+      kw['ncpu'] = int(sys.argv[sys.argv.index('-j')+1]);
     if '-average' in sys.argv:
-      pt.apply(FunkOps.average,"time",newtab=True);
+      pt.apply(FunkOps.average,"time",**kw);
     if '-interpol' in sys.argv:
-      pt.apply(FunkOps.linear_interpol,"time",newtab=True);
+      pt.apply(FunkOps.linear_interpol,"time",**kw);
     if '-rank0' in sys.argv:
-      pt.apply(FunkOps.force_rank0,["time","freq"],newtab=True);
+      pt.apply(FunkOps.force_rank0,["time","freq"],**kw);
     if '-infdom' in sys.argv:
-      pt.apply(FunkOps.make_infinite_domain,["time","freq"],newtab=True);
-
+      pt.apply(FunkOps.make_infinite_domain,["time","freq"],**kw);
+    if '-smooth' in sys.argv:
+      pt.apply(FunkOps.gaussian_smooth,"time",**kw);
+    if '-decimate' in sys.argv:
+      pt.apply(FunkOps.array_op(FunkOps.decimate_arrays,factor=int(sys.argv[sys.argv.index('-decimate')+1])),"time",**kw);
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Tests for the array-native reductions in FunkOps, and the funklets they produce via
+ParmTables.FunkletArrays. Run with: python -m unittest discover Cattery/Calico/test
+""";
+
+import os.path
+import sys
+import resource
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."));
+
+import FunkOps
+import ParmTables
+
+class _Funklet (object):
+  """Stand-in for a meq.polc: FunkletArrays only needs coeff, domain and attribute access""";
+  def __init__ (self,coeff,domain,**kw):
+    self.coeff = coeff;
+    self.domain = domain;
+    self.__dict__.update(kw);
+
+def make_slice (coeffs,t0=0.,dt=10.,**kw):
+  """Makes a rank-1 time slice of funklets with the given coefficients, on consecutive domains of size dt""";
+  funklets = [ _Funklet(numpy.array(c,float),dict(time=(t0+i*dt,t0+(i+1)*dt),freq=(1e+8,2e+8)),**kw)
+               for i,c in enumerate(coeffs) ];
+  return ParmTables.FunkSlice(None,"G:1:xx",funklets,[None,0],[0],axes=["time"]);
+
+class FunkOpsTest (unittest.TestCase):
+
+  def test_average_keeps_attributes (self):
+    sl = make_slice([[1.,2.],[3.,4.],[5.,6.]],offset=7.,scale=3.);
+    out = list(FunkOps.average(sl));
+    self.assertEqual(len(out),1);
+    self.assertTrue(numpy.allclose(out[0].coeff,[3.,4.]));
+    self.assertEqual(out[0].domain['time'],(0.,30.));
+    self.assertEqual(out[0].domain['freq'],(1e+8,2e+8));
+    self.assertEqual((out[0].offset,out[0].scale),(7.,3.));
+    # input funklets are not modified
+    self.assertEqual(sl[0].domain['time'],(0.,10.));
+    self.assertTrue(numpy.allclose(sl[0].coeff,[1.,2.]));
+
+  def test_force_rank0_keeps_attributes (self):
+    sl = make_slice([[[1.,2.],[3.,4.]],[[5.,6.],[7.,8.]]],offset=2.,scale=5.);
+    out = list(FunkOps.force_rank0(sl));
+    self.assertEqual([ f.coeff for f in out ],[1.,5.]);
+    self.assertEqual([ (f.offset,f.scale) for f in out ],[(2.,5.)]*2);
+    self.assertEqual([ f.domain['time'] for f in out ],[(0.,10.),(10.,20.)]);
+
+  def test_linear_interpol (self):
+    c = [1.,3.,2.,5.];
+    sl = make_slice([ [x] for x in c ],weight=0.5);
+    out = list(FunkOps.linear_interpol(sl));
+    self.assertEqual(len(out),3);
+    x = [5.,15.,25.,35.];
+    for i,f in enumerate(out):
+      self.assertTrue(numpy.allclose(f.coeff,[c[i],c[i+1]-c[i]]));
+      self.assertEqual((f.offset,f.scale,f.axis_index),(x[i],x[i+1]-x[i],0));
+      self.assertEqual(f.weight,0.5);
+    self.assertEqual([ f.domain['time'] for f in out ],[(0.,15.),(15.,25.),(25.,40.)]);
+
+  def test_median_smooth (self):
+    coeff = numpy.array([1.,9.,2.,3.,8.,4.])[:,numpy.newaxis];
+    domains = make_slice(coeff).domain_array();
+    out,dom = FunkOps.median_smooth_arrays(coeff,domains,size=3);
+    self.assertTrue(numpy.allclose(out.ravel(),[1.,2.,3.,3.,4.,4.]));
+    self.assertTrue((dom == domains).all());
+    # even sizes are rounded up
+    out4 = FunkOps.median_smooth_arrays(coeff,domains,size=4)[0];
+    out5 = FunkOps.median_smooth_arrays(coeff,domains,size=5)[0];
+    self.assertTrue((out4 == out5).all());
+
+  def test_gaussian_smooth_preserves_constant (self):
+    sl = make_slice([[2.]]*7);
+    out = list(FunkOps.gaussian_smooth(sl,sigma=15.));
+    self.assertTrue(numpy.allclose([ f.coeff for f in out ],2.));
+
+  def test_gaussian_smooth_window (self):
+    # irregularly spaced domains, with a gap
+    t0 = numpy.sort(numpy.random.RandomState(1).uniform(0,1000,50));
+    t0[25:] += 500;
+    domains = numpy.array([t0,t0+1]).T[:,numpy.newaxis,:];
+    coeff = numpy.random.RandomState(2).normal(size=(50,2));
+    sigma = 40.;
+    # dense kernel for reference
+    x = t0+.5;
+    weights = numpy.exp(-0.5*((x[:,numpy.newaxis]-x[numpy.newaxis,:])/sigma)**2);
+    ref = numpy.dot(weights/weights.sum(1)[:,numpy.newaxis],coeff);
+    # a window wider than the slice gives the full kernel, the default cutoff is within the kernel tails
+    out,dom = FunkOps.gaussian_smooth_arrays(coeff,domains,sigma,cutoff=100);
+    self.assertTrue(numpy.allclose(out,ref,rtol=0,atol=1e-12));
+    self.assertTrue((dom == domains).all());
+    out = FunkOps.gaussian_smooth_arrays(coeff,domains,sigma)[0];
+    self.assertTrue(numpy.allclose(out,ref,rtol=0,atol=1e-4));
+    # unsorted input gives the same result in the same order
+    perm = numpy.random.RandomState(3).permutation(50);
+    out = FunkOps.gaussian_smooth_arrays(coeff[perm],domains[perm],sigma,cutoff=100)[0];
+    self.assertTrue(numpy.allclose(out,ref[perm],rtol=0,atol=1e-12));
+
+  def test_gaussian_smooth_large (self):
+    # 30000 time slots: a dense kernel would need 30000^2 doubles (about 7 GB)
+    nfunk = 30000;
+    t0 = numpy.arange(nfunk)*10.;
+    domains = numpy.array([t0,t0+10]).T[:,numpy.newaxis,:];
+    coeff = numpy.where(numpy.arange(nfunk)%2,1.,3.)[:,numpy.newaxis];
+    maxrss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss;
+    out = FunkOps.gaussian_smooth_arrays(coeff,domains,30.)[0];
+    # peak memory use (in kB) grows by well under the size of a dense kernel
+    self.assertTrue(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-maxrss0 < 200000);
+    self.assertEqual(out.shape,coeff.shape);
+    self.assertTrue(numpy.allclose(out[100:-100],2.,atol=1e-6));
+
+  def test_decimate (self):
+    sl = make_slice([[1.],[3.],[5.],[7.],[9.]],offset=1.);
+    out = list(FunkOps.decimate(sl,factor=2));
+    self.assertTrue(numpy.allclose(numpy.ravel([ f.coeff for f in out ]),[2.,6.,9.]));
+    self.assertEqual([ f.domain['time'] for f in out ],[(0.,20.),(20.,40.),(40.,50.)]);
+    self.assertEqual([ f.offset for f in out ],[1.]*3);
+
+  def test_spline_resample_linear (self):
+    sl = make_slice([ [2*x+1] for x in range(6) ]);
+    out = list(FunkOps.array_op(FunkOps.spline_resample_arrays,num=3,k=1)(sl));
+    # centres of the output domains are at 10,30,50, i.e. x=0.5,2.5,4.5 in funklet units
+    self.assertTrue(numpy.allclose(numpy.ravel([ f.coeff for f in out ]),[2.,6.,10.]));
+    self.assertEqual([ f.domain['time'] for f in out ],[(0.,20.),(20.,40.),(40.,60.)]);
+
+if __name__ == "__main__":
+  unittest.main();
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Tests for ParmTab.apply() writing back to its own table. Run with: python -m unittest discover Cattery/Calico/test
+""";
+
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."));
+
+from Timba.Meq import meq
+import FunkOps
+import ParmTables
+
+class ParmTabApplyTest (unittest.TestCase):
+
+  def setUp (self):
+    self.tmpdir = tempfile.mkdtemp();
+    self.filename = os.path.join(self.tmpdir,"test.fmep");
+
+  def tearDown (self):
+    shutil.rmtree(self.tmpdir,ignore_errors=True);
+
+  def make_table (self,name,coeffs,dt=10.):
+    """Makes a table with a rank-0 funklet per time domain""";
+    pt = ParmTables.ParmTab(self.filename,write=True,new=True);
+    fpt = pt.parmtable(True);
+    for i,c in enumerate(coeffs):
+      fpt.put_funklet(name,meq.polc(c,domain=meq.gen_domain(time=(i*dt,(i+1)*dt),freq=(1e+8,2e+8))));
+    fpt = None;
+    return ParmTables.ParmTab(self.filename);
+
+  def test_inplace_smoothing_with_remove (self):
+    name = "G:1:xx";
+    pt = self.make_table(name,[1.,9.,2.,3.,8.,4.]);
+    pt.apply(FunkOps.array_op(FunkOps.median_smooth_arrays,size=3),"time",outtab=pt,remove=True);
+    # the smoothed funklets replace the input ones on the same domains
+    pt = ParmTables.ParmTab(self.filename);
+    self.assertEqual(pt.funklet_names(),[name]);
+    funklets = pt.funkset(name).get_slice();
+    self.assertEqual(len(funklets),6);
+    self.assertTrue(numpy.allclose(numpy.ravel([ f.coeff for f in funklets ]),[1.,2.,3.,3.,4.,4.]));
+    self.assertEqual([ tuple(f.domain['time']) for f in funklets ],[ (i*10.,(i+1)*10.) for i in range(6) ]);
+
+if __name__ == "__main__":
+  unittest.main();
@@ -34,14 +34,19 @@
 
 import sys,time
 import math,struct
+import numpy
 import pickle # for serialization and file io
 # from Dummy import *
 
 from common_utils import *
 from LSM_inner import *
+from LSM_columns import *
 from Timba.Meq import meq
 from Timba.TDL import *
 import LSM_Sixpack
+import LSM_binary
+import LSM_readers
+import LSM_spatial
 from Timba.Meq import meq
 
 from Timba.Apps import app_nogui
@@ -260,6 +265,8 @@ class PUnit:
    # change static values
    self.sp.set_staticRA(new_ra)
    self.sp.set_staticDec(new_dec)
+   if self.lsm!=None:
+    self.lsm._update_row(self.name,ra=new_ra,dec=new_dec)
 
 ###############################################
 class LSM:
@@ -269,21 +276,36 @@ class LSM:
   m_table: MeqParm table
   tmpl_table: Template tree table
   p_table: p-Unit table
+  columns: columnar source table (a SourceColumns), or None. See below.
 
   helper attributes:
-  __barr: array of p-Units sorted by brightness - private attribute
+  __barr: index of p-Units sorted by brightness (a BrightnessIndex) - private attribute
   __mqs: meqserver proxy
   __root: root of all subtrees of the LSM
   __file: currently opend file or recently saved file name
           If not using a file, this will be Empty
  """
  # Constructor
- # Does pretty much nothing so far
- def __init__(self):
+ # If columnar=True, sources are stored as rows of a SourceColumns table,
+ # and s_table/p_table are LazyTables, which only create the Source and
+ # PUnit objects of a row when these are asked for. This takes a lot less
+ # memory for big sky models, and bounds/brightness queries are vectorized.
+ def __init__(self,columnar=False):
   self.s_table={}
   self.m_table='thislsm.mep'
   self.tmpl_table={}
   self.p_table={}
+  self.columns=None
+  # node names of sixpacks made of nodes, for a columnar LSM (see load())
+  self._node_sixpacks={}
+  # spatial index, made when needed (see getSpatialIndex()), or
+  # the LSMFile it can be read from
+  self._spatial_index=None
+  self._spatial_index_file=None
+  if columnar:
+   self.columns=SourceColumns()
+   self.s_table=LazyTable(self.columns,self._make_source,types=(POINT_TYPE,GAUSS_TYPE))
+   self.p_table=LazyTable(self.columns,self._make_punit)
 
   # number of sources to display
   self.display_punits=-1 # if -1, display all
@@ -295,7 +317,7 @@ class LSM:
   # counter to give unique names to patches
   self.__patch_count=0
  
-  self.__barr=[] 
+  self.__barr=BrightnessIndex()
   # root of all subtrees
   self.__root=None
   # name of the root node
@@ -345,6 +367,8 @@ class LSM:
    # dont stop, just issue a warning
    print "WARNING: Source "+s.name+' is already present'
    return
+  # a columnar LSM keeps the objects made here (and the sixpack given,
+  # which may be made of nodes), insertPUnit() adds the row
   self.s_table[s.name]=s
   """ After inserting the source to source table,
       search the  MeqParm table if it has any parms of the source.
@@ -392,6 +416,55 @@ class LSM:
   # finally, insert p-Unit to p-Unit table
   self.insertPUnit(p)
 
+ # Inserts sources in bulk, e.g. from a catalog (see LSM_readers).
+ # names is a list, the other arguments are arrays (or scalars) of the
+ # same length: ra,dec in radians, Stokes I,Q,U,V at frequency f0,
+ # spectral index, rotation measure and extent (major,minor,position
+ # angle). Brightness defaults to I. If given, l,m become the lm= of
+ # add_source() (i.e. PUnit._lm).
+ # A columnar LSM gets the rows in one go, otherwise each source is
+ # inserted as by add_source(), with sixpacks in the current NodeScope.
+ def add_sources(self,names,ra,dec,I,Q=0,U=0,V=0,spi=0,RM=0,f0=1e6,eX=0,eY=0,eP=0,brightness=None,l=numpy.nan,m=numpy.nan):
+  n=len(names)
+  if brightness is None:
+   brightness=I
+  cols=dict(ra=ra,dec=dec,I=I,Q=Q,U=U,V=V,spi=spi,RM=RM,f0=f0,
+    eX=eX,eY=eY,eP=eP,brightness=brightness,l=l,m=m)
+  for key,value in cols.items():
+   cols[key]=numpy.resize(numpy.asarray(value,float),n)
+  # source names have to be unique
+  keep=numpy.ones(n,bool)
+  seen={}
+  for i,name in enumerate(names):
+   if self.s_table.has_key(name) or seen.has_key(name):
+    print "WARNING: Source "+name+' is already present'
+    keep[i]=False
+   seen[name]=None
+  if not keep.all():
+   names=[ name for name,ok in zip(names,keep) if ok ]
+   for key,value in cols.items():
+    cols[key]=value[keep]
+  cols['type']=numpy.where((cols['eX']!=0)|(cols['eY']!=0)|(cols['eP']!=0),
+    GAUSS_TYPE,POINT_TYPE)
+  if self.columns is not None:
+   self.columns.extend(names,**cols)
+   for name,br in zip(names,cols['brightness']):
+    self.__barr.add(name,br)
+   self._drop_spatial_index()
+   return
+  cols=dict([ (key,value.tolist()) for key,value in cols.iteritems() ])
+  for i,name in enumerate(names):
+   lm=None
+   if not math.isnan(cols['l'][i]):
+    lm=(cols['l'][i],cols['m'][i])
+   s=Source(name,major=cols['eX'][i],minor=cols['eY'][i],pangle=cols['eP'][i])
+   my_sixpack=LSM_Sixpack.newstar_source(self.__ns,punit=name,I0=cols['I'][i],
+     stokesQ=cols['Q'][i],stokesU=cols['U'][i],stokesV=cols['V'][i],
+     SI=cols['spi'][i],RM=cols['RM'][i],f0=cols['f0'][i],
+     RA=cols['ra'][i],Dec=cols['dec'][i],trace=0)
+   self.add_source(s,brightness=cols['brightness'][i],
+     sixpack=my_sixpack,ra=cols['ra'][i],dec=cols['dec'][i],lm=lm)
+
  # Helper method 
  # inserts a p-unit into the p-Unit table, and 
  # orders according to the brightness
@@ -401,29 +474,91 @@ class LSM:
    print "WARNING: PUnit '"+p.name+"' is already present. Ignoring insertion"
   else:
    self.p_table[p.name]=p
-  # now do the sorting of the brightness array
-  tmp_brightness=p.getBrightness() 
-  if (len(self.__barr)==0):
-   self.__barr.insert(0,p.name)
-  else: # list is not empty
-   for i in range(len(self.__barr)):
-    if self.p_table[self.__barr[i]].getBrightness() < tmp_brightness:
-     break
-
-
-   # special check for end of list
-   if i==0: 
-    if self.p_table[self.__barr[i]].getBrightness() < tmp_brightness:
-      self.__barr.insert(0,p.name)
-    else:
-      self.__barr.append(p.name)
-   elif i==len(self.__barr)-1:
-    if self.p_table[self.__barr[i]].getBrightness() < tmp_brightness:
-     self.__barr.insert(i,p.name)
-    else:
-     self.__barr.append(p.name)
+   if self.columns is not None:
+    self.columns.append(p.name,**punit_row(p))
+   # the brightness index sorts itself on the next lookup
+   self.__barr.add(p.name,p.getBrightness())
+   self._drop_spatial_index()
+
+ # Helper methods for a columnar LSM: make the Source and PUnit
+ # objects of a row on demand
+ def _make_source(self,name):
+  row=self.columns.row(name)
+  return Source(name,major=float(row['eX']),minor=float(row['eY']),pangle=float(row['eP']))
+
+ def _make_punit(self,name):
+  row=self.columns.row(name)
+  p=PUnit(name,self)
+  p.setType(int(row['type']))
+  p.setCat(int(row['cat']))
+  p.setBrightness(float(row['brightness']))
+  names=self._node_sixpacks.get(name,None)
+  if row['type']==PATCH_TYPE:
+   for sname in self.columns.names(self.columns.data()['patch']==self.columns.index(name)):
+    p.addSource(sname)
+   if names is not None:
+    patch_root=self.__ns[names['patchroot']]
+    p.sp.setRoot(patch_root)
+    p.setSP(LSM_Sixpack.Sixpack(root=patch_root,label=patch_root.name))
+  else:
+   p.addSource(name)
+   if names is not None:
+    # sixpack made of nodes, reconstructed by load()
+    stubs={}
+    for key,value in names.iteritems():
+     if isinstance(value,str):
+      value=cname_node_stub(self.__ns,value)
+     stubs[key]=value
+    my_sixpack=LSM_Sixpack.Sixpack(label=name,RA=stubs['ra'],Dec=stubs['dec'],\
+      I0=stubs['I'],stokesQ=stubs['Q'],stokesU=stubs['U'],stokesV=stubs['V'],\
+      SI=float(row['spi']),f0=float(row['f0']),RM=float(row['RM']))
    else:
-    self.__barr.insert(i,p.name)
+    my_sixpack=LSM_Sixpack.newstar_source(self.__ns,punit=name,I0=float(row['I']),\
+      stokesQ=float(row['Q']),stokesU=float(row['U']),stokesV=float(row['V']),\
+      SI=float(row['spi']),f0=float(row['f0']),RM=float(row['RM']),\
+      RA=float(row['ra']),Dec=float(row['dec']),trace=0)
+   p.setSP(my_sixpack)
+   p.sp.setRoot(my_sixpack.sixpack())
+  p.sp.set_staticRA(float(row['ra']))
+  p.sp.set_staticDec(float(row['dec']))
+  if not numpy.isnan(row['l']):
+   p._lm=(float(row['l']),float(row['m']))
+  if row['patch']>=0:
+   p._patch_name=self.columns.name(row['patch'])
+  return p
+
+ # update the row of a PUnit, if this is a columnar LSM
+ def _update_row(self,name,**values):
+  self._drop_spatial_index()
+  if self.columns is not None and name in self.columns:
+   self.columns.set(name,**values)
+
+ # return the spatial index (an LSM_spatial.SpatialIndex) of the
+ # top-level PUnits, making it if needed
+ def getSpatialIndex(self):
+  if self._spatial_index==None and self._spatial_index_file!=None:
+   self._spatial_index=self._spatial_index_file.index()
+   self._spatial_index_file=None
+  if self._spatial_index==None:
+   names=list(self.__barr)
+   if self.columns is not None:
+    data=self.columns.data()
+    rows=numpy.array([ self.columns.index(pname) for pname in names ],int)
+    ra=data['ra'][rows]
+    dec=data['dec'][rows]
+    brightness=data['brightness'][rows]
+   else:
+    punits=[ self.p_table[pname] for pname in names ]
+    ra=[ p.sp.getRA() for p in punits ]
+    dec=[ p.sp.getDec() for p in punits ]
+    brightness=[ p.getBrightness() for p in punits ]
+   self._spatial_index=LSM_spatial.SpatialIndex(names,ra,dec,brightness)
+  return self._spatial_index
+
+ # forget the spatial index, when PUnits change
+ def _drop_spatial_index(self):
+  self._spatial_index=None
+  self._spatial_index_file=None
 
  # method for printing to screen
  def dump(self):
@@ -506,6 +641,8 @@ class LSM:
  # return number of p-Units in the p-Unit table 
  def getPUnits(self):
   # do not count points that belong to a PUnit
+  if self.columns is not None:
+   return int(self.columns.punit_mask().sum())
   count=0
   for pname in self.p_table.keys():
    pu=self.p_table[pname]
@@ -514,6 +651,25 @@ class LSM:
     count+=1
   return count 
 
+ # returns names and l,m coordinates (arrays) of the top-level PUnits
+ # w.r.t. the phase centre ra0,dec0, in one of the PROJECTIONS
+ # ('SIN','TAN' or 'NCP')
+ def getLM(self,ra0,dec0,projection='SIN'):
+  radec_to_lm_func=PROJECTIONS[projection][0]
+  if self.columns is not None:
+   top=self.columns.punit_mask()
+   data=self.columns.data()
+   names=self.columns.names(top)
+   ra,dec=data['ra'][top],data['dec'][top]
+  else:
+   punits=[ pu for pu in self.p_table.itervalues()
+     if pu._patch_name==None or pu.getType()==PATCH_TYPE ]
+   names=[ pu.name for pu in punits ]
+   ra=numpy.array([ pu.sp.getRA() for pu in punits ])
+   dec=numpy.array([ pu.sp.getDec() for pu in punits ])
+  (l,m)=radec_to_lm_func(ra0,dec0,ra,dec)
+  return names,l,m
+
  # return no of columes in p-Unit table
  def getPUnitColumns(self):
   return 12
@@ -528,6 +684,13 @@ class LSM:
     result['max_Dec']=math.pi/2
     return result
 
+  if self.columns is not None:
+   bounds=self.columns.bounds()
+   if bounds is not None:
+    result={}
+    (result['min_RA'],result['max_RA'],result['min_Dec'],result['max_Dec'])=bounds
+    return result
+
   max_RA=-100
   min_RA=100
   max_Dec=-100
@@ -572,7 +735,7 @@ class LSM:
   if type=='A':
    if len(self.__barr)==0:
     return 0
-   pname=self.__barr[0]
+   pname=self.__barr.first(1)[0]
    return self.p_table[pname].getBrightness()
   else:
    # select the max value
@@ -602,6 +765,9 @@ class LSM:
    # are removed from the __barr. Hence we need to do a 
    # scan of all punits
    tmp_min=1e6 # FIXME: a very large value
+   if self.columns is not None:
+    br=self.columns.data()['brightness'][self.columns.source_mask()]
+    return min(br.min(),tmp_min) if len(br) else tmp_min
    for pname in self.p_table.keys():
     mytype=self.p_table[pname].getType()
     if mytype==POINT_TYPE or mytype==GAUSS_TYPE:
@@ -630,6 +796,13 @@ class LSM:
    tmp_min=1e6 # FIXME: a very large value
    tmp_max=-1e6
    tmp_abs_min=1e6
+   if self.columns is not None:
+    br=self.columns.data()['brightness'][self.columns.source_mask()]
+    if len(br):
+     tmp_max=max(br.max(),tmp_max)
+     tmp_min=min(br.min(),tmp_min)
+     tmp_abs_min=min(abs(br).min(),tmp_abs_min)
+    return (tmp_max,tmp_min,tmp_abs_min)
    for pname in self.p_table.keys():
     mytype=self.p_table[pname].getType()
     if mytype==POINT_TYPE or mytype==GAUSS_TYPE:
@@ -669,10 +842,52 @@ class LSM:
    #if punit.getType()==POINT_TYPE:
    punit.sp.updateValues(sname)
 
- # save to a file
+ # save to a file, in the binary format (see LSM_binary).
+ # The source table is saved as columns, and the nodes of any
+ # sixpacks (e.g. patches) in a separate node section. Raises a
+ # ValueError if a PUnit has values that can't be saved (see
+ # LSM_columns.punit_row()).
+ # Vellsets are discarded, since they can be recalculated.
+ def save(self,filename):
+  # add safeguard: do not save if the filename has 
+  # a 'protected.lsm' term
+  ii=string.find(filename,'protected.lsm')
+  if ii!=-1:
+   print "WARNING: the filename %s is protected. save failed!!!"%filename
+   return
+  subscope=None
+  if self.__ns!=None:
+   subscope=self.__ns._name
+  if self.columns is not None:
+   columns=self.columns
+   # only PUnits made so far can have nodes, or values that differ from
+   # their rows
+   punits=self.p_table.objects()
+   for p in punits:
+    if p.name in columns:
+     columns.set(p.name,**punit_row(p,True))
+  else:
+   # in order of brightness, so that equally bright PUnits keep their order
+   columns=columns_from_tables(self.p_table,self.s_table,self.__barr)
+   punits=self.p_table.values()
+  root_name=self.__root_name
+  if subscope and root_name:
+   root_name=strip_subscope(root_name)
+  attrs=dict(m_table=self.m_table,tmpl_table=self.tmpl_table,\
+    patch_count=self.__patch_count,root_name=root_name,\
+    default_patch_center=self.default_patch_center,\
+    default_patch_method=self.default_patch_method)
+  try:
+   LSM_binary.write_lsm(filename,columns.data(),attrs,\
+     LSM_binary.serialize_nodes(punits,subscope),self.getSpatialIndex())
+   self.__file=filename
+  except IOError:
+   print "file %s cannot be opened, save failed" % filename 
+
+ # save to a file, in the old pickled format
  # while saving, discard any existing vellsets because
  # they can be recalculated. 
- def save(self,filename):
+ def save_pickle(self,filename):
   # add safeguard: do not save if the filename has 
   # a 'protected.lsm' term
   ii=string.find(filename,'protected.lsm')
@@ -685,7 +900,8 @@ class LSM:
    # create a new LSM from this LSM,
    # without reference to MeqServer or the forests
    g=LSM()
-   g.s_table=self.s_table
+   # a LazyTable can't be pickled, so make a plain dict from it
+   g.s_table=dict(self.s_table.items())
    g.m_table=self.m_table
    g.tmpl_table=self.tmpl_table
    g.__barr=self.__barr
@@ -742,13 +958,67 @@ class LSM:
  # Note if the saved LSM was created using a Subscope
  # the new LSM will ignore that subscope, i.e. will change
  # all node names such that the subscope part is not present
- def load(self,filename,ns=None):
+ # Files in the binary format are loaded into a columnar LSM, i.e.
+ # PUnits are only made when asked for. The load can be limited to
+ # PUnits with brightness>=min_brightness, and/or in a region
+ # given as (min_RA,max_RA,min_Dec,max_Dec). Files in the old pickled
+ # format are always loaded in full.
+ def load(self,filename,ns=None,min_brightness=None,region=None):
+  try:
+   binary=LSM_binary.is_binary_lsm(filename)
+  except IOError:
+   print "file %s cannot be opened, load failed" % filename 
+   return
+  if not binary:
+   return self.load_pickle(filename,ns)
+  lsmfile=LSM_binary.LSMFile(filename)
+  data=lsmfile.read(lsmfile.select(min_brightness,region))
+  self._drop_spatial_index()
+  # the saved spatial index is only good for a full load
+  if min_brightness==None and region==None:
+   self._spatial_index_file=lsmfile
+  self.columns=SourceColumns.from_data(data)
+  self.s_table=LazyTable(self.columns,self._make_source,types=(POINT_TYPE,GAUSS_TYPE))
+  self.p_table=LazyTable(self.columns,self._make_punit)
+  attrs=lsmfile.attrs
+  self.m_table=attrs['m_table']
+  self.tmpl_table=attrs['tmpl_table']
+  self.__patch_count=attrs['patch_count']
+  self.default_patch_center=attrs['default_patch_center']
+  self.default_patch_method=attrs['default_patch_method']
+  self.__root_name=attrs['root_name']
+  self.__root=None
+  # rows are saved in order of brightness, so this sorts quickly
+  self.__barr=BrightnessIndex()
+  top=self.columns.punit_mask()
+  for pname,brightness in zip(self.columns.names(top),data['brightness'][top].tolist()):
+   self.__barr.add(pname,brightness)
+  # recreate the nodes of the sixpacks of the PUnits loaded
+  if ns!=None:
+   self.__ns=ns
+  self._node_sixpacks={}
+  nodes=lsmfile.nodes()
+  if nodes:
+   if self.__ns==None:
+    self.__ns=NodeScope()
+   self._node_sixpacks=dict([ (pname,names) for pname,names in nodes['sixpacks'].iteritems()\
+     if pname in self.columns ])
+   roots=[]
+   for names in self._node_sixpacks.itervalues():
+    roots+=[ value for key,value in names.iteritems() if isinstance(value,str) ]
+   reconstruct(LSM_binary.node_subset(nodes['nodes'],roots),self.__ns)
+  self.setFileName(filename)
+
+ # load from a file in the old pickled format, see load()
+ def load_pickle(self,filename,ns=None):
+  self._drop_spatial_index()
   try:
    f=open(filename,'rb') 
    p=pickle.Unpickler(f)
    tmpl=LSM()
    tmpl=p.load()
    self.s_table=tmpl.s_table
+   self.columns=None
    self.m_table=tmpl.m_table
    self.tmpl_table=tmpl.tmpl_table
    self.__barr=tmpl.__barr
@@ -789,6 +1059,10 @@ class LSM:
 
    
    self.p_table=tmpl.p_table
+   # LSMs saved by older versions have a plain list, already sorted
+   if isinstance(self.__barr,list):
+    self.__barr=BrightnessIndex.from_list(self.__barr,\
+      lambda pname:self.p_table[pname].getBrightness())
    # reconstruct PUnits and Sixpacks if possible
    for sname in self.p_table.keys(): 
     punit=self.p_table[sname]
@@ -836,10 +1110,24 @@ class LSM:
  # names='list of names': gives a list of p units matching the names in the  'name_list'
  # name='name': gives the p unit matching the name 'name'
  # cat=1,2,.. : gives p units of given category
+ # cone=(ra,dec,radius): gives p units within radius of ra,dec
+ # box=(min_RA,max_RA,min_Dec,max_Dec): gives p units in the box
+ # nearest=(ra,dec,k): gives the k p units nearest to ra,dec
+ # the last three use the spatial index, give p units in order of
+ # brightness (nearest first for nearest=), and also take a
+ # min_brightness=x keyword to give only p units at least that bright
  def queryLSM(self,**kw):
   
   outlist=[]
+  for key in 'cone','box','nearest':
+   if kw.has_key(key):
+    query=getattr(self.getSpatialIndex(),key)
+    names=query(min_brightness=kw.get('min_brightness',None),*kw[key])
+    return [ self.p_table[pname] for pname in names ]
+
   if kw.has_key('all') and kw['all']==1:
+   if self.columns is not None:
+    return [ self.p_table[pname] for pname in self.columns.names(self.columns.punit_mask()) ]
    for pname in self.p_table.keys():
      pu=self.p_table[pname]
      if (((pu.getType()==POINT_TYPE or pu.getType()==GAUSS_TYPE ) and pu._patch_name==None) or\
@@ -858,8 +1146,8 @@ class LSM:
    return outlist
  
   if kw.has_key('count'):
-   for i in range(min(kw['count'],len(self.__barr))): 
-    outlist.append(self.p_table[self.__barr[i]])
+   for pname in self.__barr.first(kw['count']):
+    outlist.append(self.p_table[pname])
    return outlist
 
   if kw.has_key('cat'):
@@ -874,65 +1162,92 @@ class LSM:
 
  # from the given list of (point) source  names (slist),
  # create a patch, and add it to the PUnit table
- # if calling this in a batchwise manner, call this with
- # resolve_forst=False and sync_kernel=False
- # in all calls but the last one, to speed things up
+ # if calling this in a batchwise manner, use createPatches(),
+ # or call this with resolve_forst=False and sync_kernel=False
+ # in all calls but the last one
  def createPatch(self,slist,resolve_forest=True,sync_kernel=True):
-  # first browse the slist and 
-  # remove any sources already in a patch,
-  # also calculate min,max of (RA,Dec) to find the 
-  # phase center of the patch.
-  x_min=1e6
-  x_max=-1e6
-  y_min=1e6
-  y_max=-1e6
-  correct_slist=[]
-  sum_brightness=0
-  # calculate moments in fulx (app_brightness) to
-  # determine the phase center
-  sum_x_phi=0
-  sum_y_phi=0
-  for sname in slist:
-    # select only sources without a patch 
-    if (self.p_table.has_key(sname) and\
-       self.p_table[sname]._patch_name ==None):
-      correct_slist.append(sname)
-      # remove this source from sorted patch list
-      self.__barr.remove(sname)
-      # get min,max coords
-      ra=self.p_table[sname].sp.getRA() 
-      dec=self.p_table[sname].sp.getDec() 
-      if ra>x_max:
-       x_max=ra
-      if ra<x_min:
-       x_min=ra
-      if dec>y_max:
-       y_max=dec
-      if dec<y_min:
-       y_min=dec
-      # get apparent brightness of this source
-      br=self.p_table[sname].getBrightness()
-      sum_brightness+=br
-      # calculate moments
-      sum_x_phi+=ra*br
-      sum_y_phi+=dec*br
-
-  #print "Patch: [%f,%f]--[%f,%f]"%(x_min,y_min,x_max,y_max)
-  #print correct_slist
-  #print self.__ns
-
-  # calculate RA,Dec of phase center
+  return self.createPatches([slist],resolve_forest,sync_kernel)[0]
+
+ # create a patch from each of the given lists of (point) source names,
+ # and add them to the PUnit table. Sources already in a patch, or given
+ # in an earlier list, are skipped. The phase centres of all patches are
+ # found in one pass over the sources, and the kernel is synced once.
+ # Returns a list of [patch name,x_min,y_min,x_max,y_max] for
+ # each list, or None where no patch was made.
+ def createPatches(self,slists,resolve_forest=True,sync_kernel=True):
+  # select only sources without a patch, and not given before
+  names=[]
+  ipatch=[]
+  seen={}
+  for i,slist in enumerate(slists):
+   for sname in slist:
+    if seen.has_key(sname):
+     continue
+    if self.columns is not None:
+     ok=sname in self.columns and self.columns.row(sname)['patch']<0
+    else:
+     ok=self.p_table.has_key(sname) and self.p_table[sname]._patch_name==None
+    if ok:
+     seen[sname]=True
+     names.append(sname)
+     ipatch.append(i)
+  ipatch=numpy.array(ipatch,int)
+  npatch=len(slists)
+
+  # coordinates and apparent brightness of the sources
+  if self.columns is not None:
+   rows=numpy.array([ self.columns.index(sname) for sname in names ],int)
+   data=self.columns.data()
+   ra=data['ra'][rows]
+   dec=data['dec'][rows]
+   br=data['brightness'][rows]
+  else:
+   punits=[ self.p_table[sname] for sname in names ]
+   ra=numpy.array([ p.sp.getRA() for p in punits ],float)
+   dec=numpy.array([ p.sp.getDec() for p in punits ],float)
+   br=numpy.array([ p.getBrightness() for p in punits ],float)
+
+  # min,max of (RA,Dec), and moments in flux (app_brightness), per patch
+  x_min=numpy.empty(npatch)
+  x_min.fill(1e6)
+  y_min=x_min.copy()
+  x_max=-x_min
+  y_max=-x_min
+  numpy.minimum.at(x_min,ipatch,ra)
+  numpy.maximum.at(x_max,ipatch,ra)
+  numpy.minimum.at(y_min,ipatch,dec)
+  numpy.maximum.at(y_max,ipatch,dec)
+  sum_brightness=numpy.bincount(ipatch,br,minlength=npatch)
+  sum_x_phi=numpy.bincount(ipatch,ra*br,minlength=npatch)
+  sum_y_phi=numpy.bincount(ipatch,dec*br,minlength=npatch)
+
+  # calculate RA,Dec of phase centers
   if self.default_patch_center=='G':
-   ra_0=(x_min+x_max)*0.5
-   dec_0=(y_min+y_max)*0.5
+   ra_c=(x_min+x_max)*0.5
+   dec_c=(y_min+y_max)*0.5
   else: # 'C'
    # using moments
-   ra_0=sum_x_phi/sum_brightness
-   dec_0=sum_y_phi/sum_brightness
-  #print sum_x_phi,sum_x_phi/sum_brightness
-  #print sum_y_phi,sum_y_phi/sum_brightness
-  #print ra_0,dec_0
-  if self.__ns!=None and (len(correct_slist)> 0):
+   norm=numpy.where(sum_brightness!=0,sum_brightness,1)
+   ra_c=sum_x_phi/norm
+   dec_c=sum_y_phi/norm
+
+  # source names of each patch
+  members=[ [] for i in range(npatch) ]
+  for sname,i in zip(names,ipatch.tolist()):
+   members[i].append(sname)
+
+  retval_arr=[None]*npatch
+  if self.__ns==None:
+   return retval_arr
+  for i in range(npatch):
+   correct_slist=members[i]
+   if not correct_slist:
+    continue
+   ra_0=float(ra_c[i])
+   dec_0=float(dec_c[i])
+   # remove the sources from sorted patch list
+   for sname in correct_slist:
+    self.__barr.remove(sname)
    patch_name='patch'+str(self.__patch_count)
    self.__patch_count=self.__patch_count+1
    stringRA='ra0:q='+patch_name
@@ -949,13 +1264,16 @@ class LSM:
    # get the sixpack root of each source in slist
    # and add it to patch composer
    for sname in correct_slist:
+     # in a columnar LSM, PUnits not made yet get their patch from the columns
+     if self.columns is not None and not self.p_table.is_materialized(sname):
+      child_list.append('sixpack:q='+sname)
+      continue
      punit=self.getPUnit(sname)
      psixpack=punit.getSP()
-     my_name=''
-     if psixpack!=None:
+     if psixpack!=None and hasattr(psixpack.sixpack(),'name'):
       my_name=psixpack.sixpack().name
-     elif punit.sp!=None:
-      my_name='sixpack:q='+pname
+     else:
+      my_name='sixpack:q='+sname
 
      child_list.append(my_name)
      self.p_table[sname]._patch_name=patch_name
@@ -969,22 +1287,6 @@ class LSM:
    #select_root=self.__ns['Select['+patch_name+']']<<Meq.Selector(children=patch_root,multi=True,index=[2,3,4,5])
    #stokes_root=self.__ns['Stokes['+patch_name+']']<<Meq.Stokes(children=select_root)
    #fft_root=self.__ns['FFT['+patch_name+']']<<Meq.FFTBrick(children=stokes_root)
-   if self.__ns != None and resolve_forest==True:
-    pass
-    #self.__ns.Resolve()
-    #print "Current forest has %d root nodes, of a total of %d nodes"% (len(self.__ns.RootNodes()),len(self.__ns.AllNodes()))
-
-   #Timba.TDL._dbg.set_verbose(5);
-   # try to run stuff
-   if self.mqs != None and resolve_forest==True and\
-      sync_kernel==True:
-     self.__ns.Resolve()
-     self.mqs.meq('Clear.Forest')
-     self.mqs.meq('Create.Node.Batch',record(batch=map(lambda nr:nr.initrec(),self.__ns.AllNodes().itervalues())));
-     #self.mqs.meq('Resolve.Batch',record(name=list(self.__ns.RootNodes().iterkeys())))
-     # is a forest state defined?
-     fst = getattr(Timba.TDL.Settings,'forest_state',record());
-     self.mqs.meq('Set.Forest.State',record(state=fst));
 
    # create a new PUnit
    newp=PUnit(patch_name,self)
@@ -992,7 +1294,7 @@ class LSM:
    newp.sp.setRoot(patch_root)
    newp.sp.set_staticRA(ra_0)
    newp.sp.set_staticDec(dec_0)
-   newp.setBrightness(sum_brightness)
+   newp.setBrightness(float(sum_brightness[i]))
 
 
    # update vellsets
@@ -1013,22 +1315,25 @@ class LSM:
 
    # add new PUnit to table
    self.insertPUnit(newp)
-   #print self.__barr
-   #self.p_table[patch_name]=newp
+   if self.columns is not None:
+    irow=self.columns.index(patch_name)
+    for sname in correct_slist:
+     self.columns.set(sname,patch=irow)
 
-   if resolve_forest==True and sync_kernel==True:
-    pass
-    #newp.sp.updateValues(patch_name)
-
-   #Timba.TDL._dbg.set_verbose(0);
-   # save the lsm
-   # self.save('lsm_current.lsm')
    # return [patch name, x_min,y_min,x_max,y_max]
    # for the plotting method
-   return [patch_name,x_min,y_min,x_max,y_max]
-
-  # if we get here, an error
-   return None
+   retval_arr[i]=[patch_name,float(x_min[i]),float(y_min[i]),float(x_max[i]),float(y_max[i])]
+
+  # now resolve forest and sync kernel, once for all patches
+  if self.mqs != None and resolve_forest==True and\
+     sync_kernel==True:
+    self.__ns.Resolve()
+    self.mqs.meq('Clear.Forest')
+    self.mqs.meq('Create.Node.Batch',record(batch=map(lambda nr:nr.initrec(),self.__ns.AllNodes().itervalues())));
+    # is a forest state defined?
+    fst = getattr(Timba.TDL.Settings,'forest_state',record());
+    self.mqs.meq('Set.Forest.State',record(state=fst));
+  return retval_arr
 
 
  # create patches from the grid, given by
@@ -1036,133 +1341,61 @@ class LSM:
  # note: x_array and y_array should be sorted in ascending order
  def createPatchesFromGrid(self,x_array,y_array,min_bright=0.0,max_bright=10.0,\
            min_sources=10):
-  #from Timba.utils import verbosity
-  #_dbg = verbosity(0,name='LSM')
-  #_dprint = _dbg.dprint
-  #_dprint(3,"Creating patches for",x_array,y_array)
-
   # add a margin to last elements to include points on the boundary
-  x_array[len(x_array)-1]+=0.00001
-  y_array[len(y_array)-1]+=0.00001
-
-  # encapsulate arrays with large bounds
-  # so we do not miss any points
-  x_array.insert(0,x_array[0]-1e6)
-  x_array.append(x_array[len(x_array)-1]+1e6)
-  y_array.insert(0,y_array[0]-1e6)
-  y_array.append(y_array[len(y_array)-1]+1e6)
-
-  #print x_array
-  #print y_array
-
-  # now for each point source in p-unit list
-  # if they are not already included in a patch
-  # and also if they satisfy the criteria for including
-  # in a patch, do a binary search and find correct grid position
-  
-  # set up bins to collect sorted sources
-  xbins={}
-  for ii in range(len(x_array)-1):
-   xbins[ii]=[]
-  ybins={}
-  for ii in range(len(y_array)-1):
-   ybins[ii]=[]
-
-  #print xbins
-  #print ybins
-
-
-  for sname in self.p_table.keys(): 
-    punit=self.p_table[sname]
+  x_grid=numpy.array(x_array,float)
+  y_grid=numpy.array(y_array,float)
+  x_grid[-1]+=0.00001
+  y_grid[-1]+=0.00001
+
+  # point sources not already included in a patch, that also
+  # satisfy the criteria for including in a patch
+  if self.columns is not None:
+   data=self.columns.data()
+   mask=(data['type']==POINT_TYPE)&(data['patch']<0)&\
+     (data['brightness']<=max_bright)&(data['brightness']>=min_bright)
+   names=self.columns.names(mask)
+   xx=data['ra'][mask]
+   yy=data['dec'][mask]
+  else:
+   names=[]
+   xx=[]
+   yy=[]
+   for sname,punit in self.p_table.iteritems():
     pb=punit.getBrightness('A')
     if  punit.getType()==POINT_TYPE and\
        punit._patch_name==None and\
        (pb<=max_bright) and (pb>=min_bright):
-      # get RA and Dec
-      xx=punit.sp.getRA()
-      yy=punit.sp.getDec()
-      k=bin_search(x_array,xx,0,len(x_array)-1)
-      xbins[k].append(sname)
-      k=bin_search(y_array,yy,0,len(y_array)-1)
-      ybins[k].append(sname)
-
-  #print xbins
-  #print ybins
-  # now create a reverse mapping hash table
-  # indexed by source name, such that the pair
-  # of indices [x_,y_] for each source (patch index)
-  # is given
-  p_id_x={}
-  p_id_y={}
-  # ignore bin indices 0 and the last_index
-  # bacause these fall out of the range
-  if len(xbins)>2:
-   for ii in range(len(xbins)-2):
-    ll=xbins[ii+1]
-    # traverse list
-    for sname in ll:
-      p_id_x[sname]=ii+1
-  if len(ybins)>2:
-   for ii in range(len(ybins)-2):
-    ll=ybins[ii+1]
-    # traverse list
-    for sname in ll:
-      p_id_y[sname]=ii+1
+     names.append(sname)
+     xx.append(punit.sp.getRA())
+     yy.append(punit.sp.getDec())
+   xx=numpy.array(xx,float)
+   yy=numpy.array(yy,float)
+
+  # find grid cell of each source: cell i has x_grid[i-1]<=x<x_grid[i],
+  # so cells 1..len(x_grid)-1 are within the grid
+  ix=numpy.searchsorted(x_grid,xx,side='right')
+  iy=numpy.searchsorted(y_grid,yy,side='right')
+  inside=numpy.nonzero((ix>0)&(ix<len(x_grid))&(iy>0)&(iy<len(y_grid)))[0]
+  # sort sources by cell id, and split into one list per cell
+  cell=ix[inside]*len(y_grid)+iy[inside]
+  order=numpy.argsort(cell,kind='mergesort')
+  cell=cell[order]
+  inside=inside[order]
+  edges=numpy.nonzero(numpy.diff(cell))[0]+1
+  starts=numpy.concatenate(([0],edges))
+  ends=numpy.concatenate((edges,[len(cell)]))
+  # note: create patches with at least two sources in it
+  nmin=max(min_sources,2)
+  patch_bins=[ [ names[k] for k in inside[i0:i1] ]\
+    for i0,i1 in zip(starts.tolist(),ends.tolist()) if i1-i0>=nmin ]
 
   # now create the patches
-  patch_bins={}
-  for ii in range(len(xbins)-2):
-   for jj in range(len(ybins)-2):
-    patch_name="Patch#"+str(ii+1)+":"+str(jj+1)
-    patch_bins[patch_name]=[]
- 
-  for sname in p_id_x.keys():
-    ii=p_id_x[sname]
-    if p_id_y.has_key(sname):
-     jj=p_id_y[sname]
-     patch_name="Patch#"+str(ii)+":"+str(jj)
-     patch_bins[patch_name].append(sname)
-
-  # create progree dialog
-  if isinstance(qApp,QApplication):
-    lpb = QProgressDialog("Creating Patches", "Close", len(patch_bins), self.__win, "progress", 1)
-    lpb.setCaption("Please Wait")
-    lpb.setMinimumDuration(0)
-    lpb.show()
-    i=0
-
-
-  #print patch_bins
-  # now call single patch creation function
-  # remember return values from single patch creation
-  retval_arr=[]
-  new_punit_names=[]
-  for pname in patch_bins.keys():
-   # note: we do not send anything to the kernel
-   # when we recreate the forest, that will be done later
-   # note: create patches with at least two sources in it
-   if len(patch_bins[pname]) >= min_sources and\
-      len(patch_bins[pname]) >= 2: 
-    retval=self.createPatch(patch_bins[pname],True,False)
-   else:
-    retval=None
-
-   if retval !=None:
-    retval_arr.append(retval)
-    # remember PUnit name to update its value
-    new_punit_names.append(retval[0])
-
-   # update progress bar
-   if isinstance(qApp,QApplication):
-     lpb.setProgress(i)
-     qApp.processEvents()
-     i=i+1
-
+  # note: we do not send anything to the kernel
+  # when we recreate the forest, that will be done later
+  retval_arr=[ retval for retval in self.createPatches(patch_bins,True,False)\
+    if retval!=None ]
 
   # now resolve forest and sync kernel
-  #self.__ns.Resolve()
-  #print "Resolved local NodeScope"
-  #print "Current forest has %d root nodes, of a total of %d nodes"% (len(self.__ns.RootNodes()),len(self.__ns.AllNodes()))
   if self.mqs != None:
      #print "Sending request to kernel"
      self.__ns.Resolve()
@@ -1172,17 +1405,7 @@ class LSM:
      # is a forest state defined?
      fst = getattr(Timba.TDL.Settings,'forest_state',record());
      self.mqs.meq('Set.Forest.State',record(state=fst));
-     # update vellset values for all newly created PUnits
-     for pname in new_punit_names:
-      print "Updating Punit ",pname
-      punit=self.getPUnit(pname)
-      #punit.sp.updateValues(pname)
-
 
-  if isinstance(qApp,QApplication):
-     lpb.cancel()
-     del lpb
- 
   return retval_arr
 
 
@@ -1261,6 +1484,17 @@ class LSM:
    print "WARNING: add_sixpack() called without giving a sixpack. Ignored!"
    pass
 
+ #****************************************************************************************
+ # The build_from_*() methods for text catalogs below read the catalog
+ # in blocks (see LSM_readers), so catalogs may be big, and may be gzipped.
+ # Sources with brightness<min_flux, or outside a region given as
+ # (min_RA,max_RA,min_Dec,max_Dec) in radians, are not loaded.
+ def _build_from_text(self,infile_name,ns,parser,min_flux=None,region=None,**kw):
+  self.setNodeScope(ns)
+  for cols in LSM_readers.read_catalog(infile_name,parser,min_flux,region,**kw):
+   self.add_sources(**cols)
+  self.setFileName(infile_name)
+
  #****************************************************************************************
  # read in a text file to build the LSM
  # infile_name: file name, absolute path
@@ -1271,66 +1505,8 @@ class LSM:
  #---------------------------------------------------------------------------------------------
  #NVSS  J163411+624953   16 34 11.868   0.73   62 49 53.72   8.3     1400    0.0030    .0005 J
  #
- def build_from_catalog(self,infile_name,ns):
-
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^(?P<col1>\S+)  # column 1 'NVSS'
-   \s*             # skip white space
-   (?P<col2>[A-Za-z]\w+\+\w+)  # source name i.e. 'J163002+631308'
-   \s*             # skip white space
-   (?P<col3>\d+)   # RA angle - hr 
-   \s*             # skip white space
-   (?P<col4>\d+)   # RA angle - min 
-   \s*             # skip white space
-   (?P<col5>\d+(\.\d+)?)   # RA angle - sec
-   \s*             # skip white space
-   (?P<col6>[^ ]+) # eRA angle - sec or 'n'
-   \s*             # skip white space
-   (?P<col7>\d+)   # Dec angle - hr 
-   \s*             # skip white space
-   (?P<col8>\d+)   # Dec angle - min 
-   \s*             # skip white space
-   (?P<col9>\d+(\.\d+)?)   # Dec angle - sec
-   \s*             # skip white space
-   (?P<col10>[^ ]+)   # eDec angle - sec
-   \s*             # skip white space
-   (?P<col11>\d+)   # freq
-   \s*             # skip white space
-   (?P<col12>\d+(\.\d+)?)   # brightness - Flux
-   \s*             # skip white space
-   (?P<col13>\d*\.\d+)   # brightness - eFlux
-   \s*""",re.VERBOSE)
-## OMS 10/02/2007: removed this, as some NVSS extracts have extra fields 
-## after eFlux. Also, I've seen "n" for eRA/eDec, so I changed the
-## regex above
-#   \S+
-#   \s*$""",re.VERBOSE)
- 
-  # read each source and insert to LSM
-  for eachline in all:
-   v=pp.search(eachline)
-   if v!=None:
-    s=Source(v.group('col2'))
-    source_RA=float(v.group('col3'))+(float(v.group('col5'))/60.0+float(v.group('col4')))/60.0
-    source_RA*=math.pi/12.0
-    source_Dec=float(v.group('col7'))+(float(v.group('col9'))/60.0+float(v.group('col8')))/60.0
-    source_Dec*=math.pi/180.0
-
-    my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=eval(v.group('col12')), f0=1e6,RA=source_RA, Dec=source_Dec,trace=0)
-   # first compose the sixpack before giving it to the LSM
-    SourceRoot=my_sixpack.sixpack(ns)
-    my_sixpack.display()
-    self.add_source(s,brightness=eval(v.group('col12')),
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_catalog(self,infile_name,ns,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_nvss,min_flux,region)
 
  #****************************************************************************************
  # read in a OR_GSM file from Niruj to create sky components
@@ -1342,52 +1518,8 @@ class LSM:
  #                (deg)     (deg)       (deg)      (deg)      (Jy)       (Jy)  
  #    3    0   35.6500     0.33160     86.3200     3.798     35.33E     0.4084
  #
- def build_from_orgsm(self,infile_name,ns):
-
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^(?P<col1>\d+)  # column 1: source number (integer)
-   \s*             # skip white space
-   (?P<col2>\d+)   # source flag (integer)
-   \s*             # skip white space
-   (?P<col3>\d+(\.\d+)?)   # RA angle - decimal degrees 
-   \s*                     # skip white space
-   (?P<col4>\d+(\.\d+)?)   # RA error - decimal degrees
-   \s*                     # skip white space
-   (?P<col5>\d+(\.\d+)?)   # DEC angle - decimal degrees
-   \s*                     # skip white space
-   (?P<col6>\d+(\.\d+)?)   # DEC error - decimal degrees
-   \s*                     # skip white space
-   (?P<col7>\d+(\.\d+)?)   # Flux - Jansky
-   \s*                     # skip white space
-   (?P<col8>\d+(\.\d+)?)   # Flux error - Jansky
-   \s*""",re.VERBOSE)
- 
-  # read each source and insert to LSM
-  # give source a name and convert coordinates to radians
-  for eachline in all:
-   v=pp.search(eachline)
-   if v!=None:
-    s=Source(v.group('col1'))
-    source_RA=float(v.group('col3'))
-    source_RA*=math.pi/180.0
-    source_Dec=float(v.group('col5'))
-    source_Dec*=math.pi/180.0
-
-    my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=eval(v.group('col7')), f0=1e6,RA=source_RA, Dec=source_Dec,trace=0)
-   # first compose the sixpack before giving it to the LSM
-    SourceRoot=my_sixpack.sixpack(ns)
-    my_sixpack.display()
-    self.add_source(s,brightness=eval(v.group('col7')),
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_orgsm(self,infile_name,ns,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_orgsm,min_flux,region)
 
  #****************************************************************************************
  # read in a sky model from Matt Jarvis to create sky components
@@ -1399,46 +1531,8 @@ class LSM:
  #                (deg)     (deg)       (deg)      (deg)      (Jy)       (Jy)  
  #    3    0   35.6500     0.33160     86.3200     3.798     35.33E     0.4084
  #
- def build_from_ska(self,infile_name,ns):
-
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^(?P<col1>\d+)  # column 1: source number (integer)
-   \s*             # skip white space
-   (?P<col2>[-]*\d+(\.\d+)?)   # RA angle - decimal degrees 
-   \s*                     # skip white space
-   (?P<col3>\d+(\.\d+)?)   # DEC angle - decimal degrees
-   \s*                     # skip white space
-   (?P<col4>\d+(\.\d+)?)   # Flux - Jansky
-   \s*
-   (?P<col5>\d+(\.\d+)?)   # Source ID (1=RQAGN, 2 = FRI, 3=FRII)
-   \s*""",re.VERBOSE)
- 
-  # read each source and insert to LSM
-  # give source a name and convert coordinates to radians
-  for eachline in all:
-   v=pp.search(eachline)
-   if v!=None:
-    s=Source(v.group('col1'))
-    source_RA=float(v.group('col2'))
-    source_RA*=math.pi/180.0
-    source_Dec=float(v.group('col3'))
-    source_Dec*=math.pi/180.0
-
-    my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=eval(v.group('col4')), f0=1e6,RA=source_RA, Dec=source_Dec,trace=0)
-   # first compose the sixpack before giving it to the LSM
-    SourceRoot=my_sixpack.sixpack(ns)
-    my_sixpack.display()
-    self.add_source(s,brightness=eval(v.group('col4')),
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_ska(self,infile_name,ns,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_ska,min_flux,region)
 
   #****************************************************************************************
 
@@ -1469,31 +1563,34 @@ class LSM:
     print "WARNING: need nodescope to perform transform:",A,b
     return
    self.__undo=None # cannot undo this
-   # try to create a progress window if under GUI mode
-   if isinstance(qApp,QApplication):
-    lpb = QProgressDialog("Updating MeqParms", "Close", len(self.p_table), self.__win, "progress", 1)
-    lpb.setCaption("Please Wait")
-    lpb.setMinimumDuration(0)
-    lpb.show()
-    i=0
+   A=numpy.asarray(A,float)
+   b=numpy.asarray(b,float)
+   if self.columns is not None:
+    # rows with no PUnit object and no nodes are moved in place
+    data=self.columns.data()
+    names=self.columns.names()
+    inplace=numpy.array([ not self.p_table.is_materialized(pname) and
+      not self._node_sixpacks.has_key(pname) for pname in names ],bool)
+    if inplace.any():
+     ra=data['ra'][inplace]
+     dec=data['dec'][inplace]
+     data['ra'][inplace]=A[0][0]*ra+A[0][1]*dec+b[0]
+     data['dec'][inplace]=A[1][0]*ra+A[1][1]*dec+b[1]
+     self._drop_spatial_index()
+    pnames=[ pname for pname,ok in zip(names,inplace) if not ok ]
+   else:
+    pnames=self.p_table.keys()
+   if not pnames:
+    return
 
-   for pname in self.p_table.keys():
-    pu=self.p_table[pname]
-    old_ra=pu.sp.getRA()
-    old_dec=pu.sp.getDec()
-    # calculate new coords
-    new_ra=A[0][0]*old_ra+A[0][1]*old_dec+b[0]
-    new_dec=A[1][0]*old_ra+A[1][1]*old_dec+b[1]
-    pu.change_location(new_ra,new_dec,ns)
-    # update progress bar
-    if isinstance(qApp,QApplication):
-     lpb.setProgress(i)
-     qApp.processEvents()
-     i=i+1
-
-   if isinstance(qApp,QApplication):
-     lpb.cancel()
-     del lpb
+   punits=[ self.p_table[pname] for pname in pnames ]
+   old_ra=numpy.array([ pu.sp.getRA() for pu in punits ])
+   old_dec=numpy.array([ pu.sp.getDec() for pu in punits ])
+   # calculate new coords
+   new_ra=(A[0][0]*old_ra+A[0][1]*old_dec+b[0]).tolist()
+   new_dec=(A[1][0]*old_ra+A[1][1]*old_dec+b[1]).tolist()
+   for pu,ra,dec in zip(punits,new_ra,new_dec):
+    pu.change_location(ra,dec,ns)
  
 
 
@@ -1566,329 +1663,20 @@ class LSM:
  # if no_cleancomp=True, no clean components are used to build the LSM
  # dont use the above two together!
  def build_from_newstar(self,infile_name,ns,verbose=1,ignore_pol=False, only_cleancomp=False, no_cleancomp=False):
+  header,model,cols=LSM_readers.read_newstar(infile_name,ignore_pol,only_cleancomp,no_cleancomp)
+  self.setNodeScope(ns)
+  self.add_sources(**cols)
+  self.setFileName(infile_name+'.lsm')
 
-    # read mdl.dsc and "MDL_O_DEF" on how I did this
-    ff=open(infile_name,mode="rb")
-    #### read header -- 512 bytes
-    gfh=Timba.array.fromfile(ff,dtype=Timba.array.uint8,count=512)
-    ## type
-    ftype=gfh[0:4].tostring()
-    ## length
-    fhlen=struct.unpack('i',gfh[4:8])
-    fhlen=fhlen[0]
-    ### version
-    fver=struct.unpack('i',gfh[5:9])
-    fver=fver[0]
-    ### creation date
-    crdate=gfh[12:23].tostring()
-    ### creation time
-    crtime=gfh[23:28].tostring()
-    ### revision date
-    rrdate=gfh[28:39].tostring()
-    ### revision time
-    rrtime=gfh[39:44].tostring()
-    ### revision count
-    rcount=struct.unpack('i',gfh[44:48])
-    rcount=rcount[0]
-    #### node name
-    nname=gfh[48:128].tostring()
-
-    ### the remaining info is not needed
-
-#    print "%s: read header type=%s, length=%d, version=%d, created=%s@%s, updated=%s@%s x %d, node  name=%s"%(infile_name,ftype,fhlen,fver,crdate,crtime,rrdate,rrtime,rcount,nname)
-
-    ####### Model Header -- 64 bytes 
-    mdh=Timba.array.fromfile(ff,dtype=Timba.array.uint8,count=64)
-
-    ### Max. # of lines in model or disk version
-    maxlin=struct.unpack('i',mdh[12:16])
-    maxlin=maxlin[0]
-
-    ### pointer to model ???
-    modptr=struct.unpack('i',mdh[16:20])
-    modptr=modptr[0]
-
-    #### no of sources in model
-    nsources=struct.unpack('i',mdh[20:24])
-    nsources=nsources[0]
-
-    ### model type(0: no ra,dec, 1=app, 2=epoch)
-    mtype=struct.unpack('i',mdh[24:28])
-    mtype=mtype[0]
-
-    ### Epoch (e.g. 1950) if TYP=2 (float) : 4 bytes
-    mepoch=struct.unpack('f',mdh[28:32])
-    mepoch=mepoch[0]
-
-    ###  Model centre RA (circles) : double
-    ra0=struct.unpack('d',mdh[32:40])
-    ra0=ra0[0]*math.pi*2
-
-    ### Model centre DEC (circles)
-    dec0=struct.unpack('d',mdh[40:48])
-    dec0=dec0[0]*math.pi*2
-
-    ### Model centre FRQ (MHz)
-    freq0=struct.unpack('d',mdh[48:56])
-    freq0=freq0[0]*1e6
-
-    ###### the remaining is not needed
-
-
-#    print "%s: read model header lines=%d, pointer=%d, sources=%d, type=%d, epoch=%f RA=%f, DEC=%f (rad) Freq=%f Hz"%(infile_name,maxlin,modptr,nsources,mtype,mepoch,ra0,dec0,freq0)
-
-#    log = file('lsm.log','wt');
-#    print 'ra0=%.14f dec0=%.14f'%(ra0,dec0);
-#    log.write('ra0=%.14f dec0=%.14f\n'%(ra0,dec0));
-    
-
-    # temp dict to hold unique nodenames
-    unamedict={}
-
-    ########## Models -- 56 bytes
-    for ii in range(0,nsources):
-    #for ii in range(0,4):
-       mdl=Timba.array.fromfile(ff,dtype=Timba.array.uint8,count=56)
-
-       ### Amplitude (Stokes I)
-       sI=struct.unpack('f',mdl[0:4])
-       sI=sI[0]*0.005 # convert from WU to Jy (1WU=5mJy)
-
-       ### L offset (mult by 60*60*180/pi to get arcsecs)
-       ll=struct.unpack('f',mdl[4:8])
-       ll=ll[0]
-
-       ### M offset 
-       mm=struct.unpack('f',mdl[8:12])
-       mm=mm[0]
-       
-       ### Identification
-       id=struct.unpack('i',mdl[12:16])
-       id=id[0]
-       
-       # log.write('%d: l=%.14f m=%.14f r=%.14f\n'%(id,ll,mm,math.sqrt(ll*ll+mm*mm)));
-
-       ### Q fraction
-       ## OMS 25/01/2010: is this a boo-boo? This used to divide by 100, as if the number was a percentage.
-       ## But MDL.DSC says only "Q (fraction of I)".
-       sQ=struct.unpack('f',mdl[16:20]) 
-       sQ=sQ[0]*sI; #/100
-       ### U fraction
-       sU=struct.unpack('f',mdl[20:24])
-       sU=sU[0]*sI; #/100
-       ### V fraction
-       sV=struct.unpack('f',mdl[24:28])
-       sV=sV[0]*sI; #/100
-
-       ### extended source params: in arcsec, so multiply by ???
-       eX=struct.unpack('f',mdl[28:32])
-       eX=eX[0]
-       eY=struct.unpack('f',mdl[32:36])
-       eY=eY[0]
-       eP=struct.unpack('f',mdl[36:40])
-       eP=eP[0]
-
-       ## the procedure is NMOEXT in nscan/nmoext.for
-       if eP==0 and eX==eY:
-         r0=0
-       else:
-         r0=0.5*(360/math.pi)*math.atan2(-eP,eY-eX)
-       r1=math.sqrt(eP*eP+(eX-eY)*(eX-eY))
-       r2=eX+eY
-       
-       # the real stuff
-       # ex,eY (arcsec) (major,minor axes),  eP (deg) position angle
-       #eX=math.sqrt(abs(0.5*(r2+r1)))*3600*360/math.pi
-       #eY=math.sqrt(abs(0.5*(r2-r1)))*3600*360/math.pi
-       #eP=r0/2
-       # use radians directly
-       eX=math.sqrt(abs(0.5*(r2+r1)))
-       eY=math.sqrt(abs(0.5*(r2-r1)))
-       eP=r0/(2*360)*math.pi
-
-       #print id,r0,r1,r2,eX,eY,eP
-
-       ### spectral index
-       SI=struct.unpack('f',mdl[40:44])
-       SI=SI[0]
-       ### rotation measure
-       RM=struct.unpack('f',mdl[44:48])
-       RM=RM[0]
-
-       ### bits
-       ## Bits: bit 0= extended; bit 1= Q|U|V <>0
-       bit1=struct.unpack('B',mdl[52:53])
-       ### Type: bit 0= clean component; bit 3= beamed
-       bit2=struct.unpack('B',mdl[53:54])
-
-       bit1=bit1[0]
-       bit2=bit2[0]
-
-       #print ii,id,ll,mm,sI,sQ,sU,sV,eX,eY,eP,SI,RM
-       ###### the remaining is not needed
-
-       if only_cleancomp==True:
-          # only include extendend source with clean component
-          if bit1==0 and bit2==1:
-            # NEWSTAR MDL lists might have same source twice if they are 
-            # clean components, so make a unique name for them
-            bname='NEWS'+str(id);
-            if unamedict.has_key(bname):
-              uniqname=bname+'_'+str(unamedict[bname])
-              unamedict[bname]=unamedict[bname]+1
-            else:
-              uniqname=bname
-              unamedict[bname]=1
-
-            s=Source(uniqname, major=eX, minor=eY, pangle=eP)
-            (source_RA,source_Dec)=lm_to_radec(ra0,dec0,ll,mm)
-
-            #print ii,id,ll,mm,source_RA,source_Dec
-            if ignore_pol:
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI, trace=0)
-            elif SI==0 and sQ==0 and sU==0 and sV==0 and RM==0:
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,trace=0)
-            elif (RM==0):
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI,stokesQ=sQ, stokesU=sU, stokesV=sV, trace=0)
-            else:
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI,stokesQ=sQ, stokesU=sU, stokesV=sV, RM=RM,trace=0)
-
-            # first compose the sixpack before giving it to the LSM
-            my_sixpack.sixpack(ns)
-            self.add_source(s,brightness=sI,
-                     sixpack=my_sixpack,
-                     ra=source_RA, dec=source_Dec,lm=(ll,mm))
-          else:
-           pass
- 
-       elif no_cleancomp==True:
-          # exclude extendend source with clean component
-          if bit1==0 and bit2==1:
-            pass
-          else:
-            # NEWSTAR MDL lists might have same source twice if they are 
-            # clean components, so make a unique name for them
-            bname='NEWS'+str(id);
-            if unamedict.has_key(bname):
-              uniqname=bname+'_'+str(unamedict[bname])
-              unamedict[bname]=unamedict[bname]+1
-            else:
-              uniqname=bname
-              unamedict[bname]=1
-
-            s=Source(uniqname, major=eX, minor=eY, pangle=eP)
-            (source_RA,source_Dec)=lm_to_radec(ra0,dec0,ll,mm)
-
-            #print ii,id,ll,mm,source_RA,source_Dec
-            if ignore_pol:
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI, trace=0)
-            elif SI==0 and sQ==0 and sU==0 and sV==0 and RM==0:
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,trace=0)
-            elif (RM==0):
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI,stokesQ=sQ, stokesU=sU, stokesV=sV, trace=0)
-            else:
-             my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI,stokesQ=sQ, stokesU=sU, stokesV=sV, RM=RM,trace=0)
-
-            # first compose the sixpack before giving it to the LSM
-            my_sixpack.sixpack(ns)
-            self.add_source(s,brightness=sI,
-                     sixpack=my_sixpack,
-                     ra=source_RA, dec=source_Dec,lm=(ll,mm))
-
- 
-       else:
-          # add all sources
-          # NEWSTAR MDL lists might have same source twice if they are 
-          # clean components, so make a unique name for them
-          bname = ('NEWS' if bit2 else 'NEWS')+str(id);
-          if unamedict.has_key(bname):
-            uniqname=bname+'_'+str(unamedict[bname])
-            unamedict[bname]=unamedict[bname]+1
-          else:
-            uniqname=bname
-            unamedict[bname]=1
-
-          s=Source(uniqname, major=eX, minor=eY, pangle=eP)
-          (source_RA,source_Dec)=lm_to_radec(ra0,dec0,ll,mm)
-
-          #print ii,id,ll,mm,source_RA,source_Dec
-          if ignore_pol:
-           my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI, trace=0)
-          elif SI==0 and sQ==0 and sU==0 and sV==0 and RM==0:
-           my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,trace=0)
-          elif (RM==0):
-           my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI,stokesQ=sQ, stokesU=sU, stokesV=sV, trace=0)
-          else:
-           my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,SI=SI,stokesQ=sQ, stokesU=sU, stokesV=sV, RM=RM,trace=0)
-
-          # first compose the sixpack before giving it to the LSM
-          my_sixpack.sixpack(ns)
-          self.add_source(s,brightness=sI,
-                   sixpack=my_sixpack,
-                   ra=source_RA, dec=source_Dec,lm=(ll,mm))
- 
-
-    ff.close()
-    self.setNodeScope(ns)
-    self.setFileName(infile_name+'.lsm')
-    
-    if verbose==1:
-      print "Read %d sources from NewStar file %s created %s:%s"%(nsources,infile_name,crdate,crtime)
+  if verbose==1:
+   print "Read %d sources from NewStar file %s created %s:%s"%(model['nsources'],infile_name,header['crdate'],header['crtime'])
 
 
  ## build from a text file of clean components
  ## format:
  ## RA(deg) DEC(deg) sI sQ sU sV
- def build_from_complist(self,infile_name,ns):
-
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^(?P<col1>\d+(\.\d+)?)   # RA angle - degrees 
-   \s*             # skip white space
-   (?P<col2>\d+(\.\d+)?)   # Dec angle - degrees 
-   \s*             # skip white space
-   (?P<col3>(-)?\d+(\.\d+)?)   # Stokes I - Flux
-   \s*             # skip white space
-   (?P<col4>(-)?\d+(\.\d+)?)   # Stokes Q - Flux
-   \s*             # skip white space
-   (?P<col5>(-)?\d+(\.\d+)?)   # Stokes U - Flux
-   \s*             # skip white space
-   (?P<col6>(-)?\d+(\.\d+)?)   # Stokes V - Flux
-   [\S\s]+
-   \s*$""",re.VERBOSE)
- 
-  # read each source and insert to LSM
-  kk=0
-  for eachline in all:
-   v=pp.search(eachline)
-   if v!=None:
-    s=Source("Comp_"+str(kk))
-    kk=kk+1
-    source_RA=float(v.group('col1'))*math.pi/180.0
-    source_Dec=float(v.group('col2'))*math.pi/180.0
-    sI=eval(v.group('col3'))
-    sQ=eval(v.group('col4'))
-    sU=eval(v.group('col5'))
-    sV=eval(v.group('col6'))
-
-    #print sI,sQ,sU,sV
-    freq0=1e6
-    if (sQ==0 and sU==0 and sV==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=1e6, RA=source_RA, Dec=source_Dec,trace=0)
-    else:
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV,trace=0)
-   # first compose the sixpack before giving it to the LSM
-    SourceRoot=my_sixpack.sixpack(ns)
-    self.add_source(s,brightness=eval(v.group('col3')),
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_complist(self,infile_name,ns,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_complist,min_flux,region)
 
 
 
@@ -1896,234 +1684,21 @@ class LSM:
  ## build from a text file with extended sources
  ## format:
  ## NAME RA(radians) DEC(radians) sI sQ sU sV SI eX eY eP
- def build_from_extlist_rad(self,infile_name,ns):
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  kk=0
-  for eachline in all:
-   ff = re.split('\s+',eachline);
-   if len(ff) >= 11:
-    name = ff[0];
-    try:
-      cols = map(float,ff[1:11]);
-    except:
-      continue;	
-    
-    source_RA,source_Dec,sI,sQ,sU,sV,SI,eX,eY,eP = cols;
-
-    s=Source(name, major=eX, minor=eY, pangle=eP)
-
-    kk=kk+1
-
-    #print sI,sQ,sU,sV
-    freq0=1e6
-    if (SI==0 and sQ==0 and sU==0 and sV==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=1e6, RA=source_RA, Dec=source_Dec,trace=0)
-    elif (SI==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV,trace=0)
-    else :
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV, SI=SI,trace=0)
- 
-   # first compose the sixpack before giving it to the LSM
-    SourceRoot=my_sixpack.sixpack(ns)
-    self.add_source(s,brightness=sI,
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_extlist_rad(self,infile_name,ns,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_extlist_rad,min_flux,region)
   
 
  ## build from a text file with extended sources
  ## format:
  ## NAME RA(hours, min, sec) DEC(degrees, min, sec) sI sQ sU sV SI RM eX eY eP f0(optional)
- def build_from_extlist_orig(self,infile_name,ns,ignore_pol=False,f0=None):
-#def build_from_extlist(self,infile_name,ns,ignore_pol=False,f0=None):
-  print 'should be reading ',infile_name
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^(?P<col1>[A-Za-z0-9_.]+)  # column 1 name: must start with a character
-   \s+             # skip white space
-   (?P<col2>[-+]?\d+(\.\d+)?)   # RA angle - hours 
-   \s+             # skip white space
-   (?P<col3>[-+]?\d+(\.\d+)?)   # RA angle - min 
-   \s+             # skip white space
-   (?P<col4>[-+]?\d+(\.\d+)?)   # RA angle - sec 
-   \s+             # skip white space
-   (?P<col5>[-+]?\d+(\.\d+)?)   # Dec angle - degrees
-   \s+             # skip white space
-   (?P<col6>[-+]?\d+(\.\d+)?)   # Dec angle - min
-   \s+             # skip white space
-   (?P<col7>[-+]?\d+(\.\d+)?)   # Dec angle - sec 
-   \s+             # skip white space
-   (?P<col8>[-+]?\d+(\.\d+)?)   # Stokes I - Flux
-   \s+             # skip white space
-   (?P<col9>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)  # Stokes Q - Flux 
-   \s+             # skip white space
-   (?P<col10>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)  # Stokes U - Flux 
-   \s+             # skip white space
-   (?P<col11>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)  # Stokes V - Flux 
-   \s+             # skip white space
-   (?P<col12>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)  # Spectral index
-   \s+             # skip white space
-   (?P<col13>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)  # Rotation measure
-   \s+             # skip white space
-   (?P<col14>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)   # ext source major axis: rad
-   \s+             # skip white space
-   (?P<col15>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)   # ext source minor axis: rad
-   \s+             # skip white space
-   (?P<col16>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)   # ext source position angle : rad
-   \s+             # skip white space
-   (?P<col17>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)?   # reference frequency
-   [\S\s]*""",re.VERBOSE)
-
-
-  kk=0
-  for eachline in all:
-   print 'eachline is ', eachline
-   v=pp.search(eachline)
-   print '** v is ', v
-   if v!=None:
-    #### if we have negative RA, we have to subtract min,sec!!
-    source_RA=float(v.group('col2'))
-    if source_RA<0:
-      source_RA=float(v.group('col2'))-(float(v.group('col4'))/60.0+float(v.group('col3')))/60.0
-    else:
-      source_RA=float(v.group('col2'))+(float(v.group('col4'))/60.0+float(v.group('col3')))/60.0
-    source_RA*=math.pi/12.0
-    #### if we have negative dec, we have to subtract min,sec!!
-    source_Dec=float(v.group('col5'))
-    if source_Dec<0:
-      source_Dec=float(v.group('col5'))-(float(v.group('col7'))/60.0+float(v.group('col6')))/60.0
-    else:
-      source_Dec=float(v.group('col5'))+(float(v.group('col7'))/60.0+float(v.group('col6')))/60.0
-    source_Dec*=math.pi/180.0
-    print 'source pos ', source_RA, source_Dec
-
-    sI=float(v.group('col8'))
-    #convert to percentages
-    if (sI > 0):
-     sQ=float(v.group('col9'))
-     sU=float(v.group('col10'))
-     sV=float(v.group('col11'))
-    else:
-     sQ=sU=sV=0
-
-    SI=eval(v.group('col12'))
-    RM=eval(v.group('col13'))
-    eX=eval(v.group('col14'))
-    eY=eval(v.group('col15'))
-    eP=eval(v.group('col16'))
-
-    if (eX==0 and eY==0 and eP==0):
-     s=Source(v.group('col1'))
-    else:
-     s=Source(v.group('col1'), major=eX, minor=eY, pangle=eP)
-
-    kk=kk+1
-
-    print 'extlist parms ', sI,sQ,sU,sV,SI,RM;
-    freq0 = v.group('col17');
-    freq0 = (freq0 and eval(freq0)) or f0 or 1e6; 
-    print 'sI, sQ, sU, sV, RM, ref freq', sI, sQ, sU, sV, RM, freq0
-    if (ignore_pol==True or (sQ==0 and sU==0 and sV==0 and RM==0)):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, SI=SI, f0=freq0, RA=source_RA, Dec=source_Dec,trace=0)
-    elif (SI==0 and RM==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV,trace=0)
-    elif (SI==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV, RM=RM, trace=0)
-    else :
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV, SI=SI, RM=RM, trace=0)
- 
-   # first compose the sixpack before giving it to the LSM
-    self.add_source(s,brightness=eval(v.group('col8')),
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_extlist_orig(self,infile_name,ns,ignore_pol=False,f0=None,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_extlist,min_flux,region,ignore_pol=ignore_pol,f0=f0)
 
  ## build from a text file with extended sources
  ## format:
  ## NAME RA(hours, min, sec) DEC(degrees, min, sec) sI sQ sU sV SI RM eX eY eP f0(optional)
- def build_from_extlist(self,infile_name,ns,ignore_pol=False,f0=None):
-  
-
-  from string import split, strip
-  print 'should be reading ',infile_name
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  kk=0
-  for eachline in all:
-   if True:
-    info = split(strip(eachline))
-    print 'info is ', info
-    #### if we have negative RA, we have to subtract min,sec!!
-    source_RA=float(info[1])
-    if source_RA<0:
-      source_RA=float(info[1])-(float(info[3])/60.0+float(info[2]))/60.0
-    else:
-      source_RA=float(info[1])+(float(info[3])/60.0+float(info[2]))/60.0
-    source_RA*=math.pi/12.0
-    #### if we have negative dec, we have to subtract min,sec!!
-    source_Dec=float(info[4])
-    if source_Dec<0:
-      source_Dec=float(info[4])-(float(info[6])/60.0+float(info[5]))/60.0
-    else:
-      source_Dec=float(info[4])+(float(info[6])/60.0+float(info[5]))/60.0
-    source_Dec*=math.pi/180.0
-    print 'source pos ', source_RA, source_Dec
-
-    sI=float(info[7])
-    #convert to percentages
-    if (sI > 0):
-     sQ=float(info[8])
-     sU=float(info[9])
-     sV=float(info[10])
-    else:
-     sQ=sU=sV=0
-
-    SI=eval(info[11])
-    RM=eval(info[12])
-    eX=eval(info[13])
-    eY=eval(info[14])
-    eP=eval(info[15])
-
-    if (eX==0 and eY==0 and eP==0):
-     s=Source(info[0])
-    else:
-     s=Source(info[0], major=eX, minor=eY, pangle=eP)
-
-    kk=kk+1
-
-    print 'extlist parms ', sI,sQ,sU,sV,SI,RM;
-    freq0 = info[16];
-    freq0 = (freq0 and eval(freq0)) or f0 or 1e6; 
-    print 'sI, sQ, sU, sV, RM, ref freq', sI, sQ, sU, sV, RM, freq0
-    if (ignore_pol==True or (sQ==0 and sU==0 and sV==0 and RM==0)):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, SI=SI, f0=freq0, RA=source_RA, Dec=source_Dec,trace=0)
-    elif (SI==0 and RM==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV,trace=0)
-    elif (SI==0):
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV, RM=RM, trace=0)
-    else :
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, f0=freq0,RA=source_RA, Dec=source_Dec,stokesQ=sQ, stokesU=sU, stokesV=sV, SI=SI, RM=RM, trace=0)
- 
-   # first compose the sixpack before giving it to the LSM
-    self.add_source(s,brightness=eval(info[7]),
-     sixpack=my_sixpack,
-     ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_extlist(self,infile_name,ns,ignore_pol=False,f0=None,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_extlist,min_flux,region,ignore_pol=ignore_pol,f0=f0)
 
 
  # save sources as a text file with intrinsic fluxes
@@ -2132,36 +1707,7 @@ class LSM:
  ## count: select the first brightest 'count' sources only 
  ### f0: reference freq for beam calculation
  def save_as_intrinsic(self,outfile_name,ns,ra0,dec0,count=0,f0=None):
-  # get all PUnits (assume all sources)
-  if count==0:
-   plist=self.queryLSM(all=1)
-  else:
-   plist=self.queryLSM(count=count)
-
-  f=open(outfile_name, 'w')
-  # gaussian params
-  # exp( -(l^2+m^2)/a^2)
-  # a = c/ (25.0 * f)
-  if f0==None:
-   f0=323875000.0;
-  a=3e8/(25.0*f0) 
-  for pu in plist:
-     (ra,dec,sI,sQ,sU,sV,SIn,f0,RM)=pu.getEssentialParms(ns)
-     (l,m)=common_utils.radec_to_lm(ra0,dec0,ra,dec)
-     invscal=math.exp((l*l+m*m)/(a*a))
-     sI=sI*invscal
-     sQ=sQ*invscal
-     sU=sU*invscal
-     sV=sV*invscal
-     (eX,eY,eP)=pu.getExtParms()
-     # get degrees
-     [r_hr,r_min,r_sec]=common_utils.radToRA(ra)
-     [d_hr,d_min,d_sec]=common_utils.radToDec(dec)
-     strline ='C'+str(pu.name)+' '+str(r_hr)+' '+str(r_min)+' '+str(r_sec)+' '+str(d_hr)+' '+str(d_min)+' '+str(d_sec)+' '+str(sI)+' '+str(sQ)+' '+str(sU)+' '+str(sV)+' '+str(SIn)+' '+str(RM)+' '+str(eX)+' '+str(eY)+' '+str(eP)+'\n';
-     f.write(strline)
- 
-  f.close()
-     
+  self._save_beam_scaled(outfile_name,ns,ra0,dec0,count,f0,1)
 
  # save sources as a text file with apparent fluxes (assume we have intrinsic flux)
  ## NAME RA(hours, min, sec) DEC(degrees, min, sec) sI sQ sU sV SI RM eX eY eP
@@ -2169,31 +1715,35 @@ class LSM:
  ## count: select the first brightest 'count' sources only 
  ### f0: reference freq for beam calculation
  def save_as_apparent(self,outfile_name,ns,ra0,dec0,count=0,f0=None):
+  self._save_beam_scaled(outfile_name,ns,ra0,dec0,count,f0,-1)
+
+ # helper for the above: fluxes are scaled by exp(sign*(l^2+m^2)/a^2)
+ # a = c/ (25.0 * f)
+ def _save_beam_scaled(self,outfile_name,ns,ra0,dec0,count,f0,sign):
   # get all PUnits (assume all sources)
   if count==0:
    plist=self.queryLSM(all=1)
   else:
    plist=self.queryLSM(count=count)
-
-  f=open(outfile_name, 'w')
-  # gaussian params
-  # exp( -(l^2+m^2)/a^2)
-  # a = c/ (25.0 * f)
   if f0==None:
    f0=323875000.0;
   a=3e8/(25.0*f0) 
-  for pu in plist:
-     (ra,dec,sI,sQ,sU,sV,SIn,f0,RM)=pu.getEssentialParms(ns)
-     (l,m)=common_utils.radec_to_lm(ra0,dec0,ra,dec)
-     invscal=math.exp(-(l*l+m*m)/(a*a))
-     sI=sI*invscal
-     sQ=sQ*invscal
-     sU=sU*invscal
-     sV=sV*invscal
+  parms=[ pu.getEssentialParms(ns) for pu in plist ]
+  if parms:
+   ra,dec=numpy.array(parms)[:,:2].T
+   (l,m)=radec_to_lm(ra0,dec0,ra,dec)
+   scale=numpy.exp(sign*(l*l+m*m)/(a*a)).tolist()
+  f=open(outfile_name, 'w')
+  for i,pu in enumerate(plist):
+     (ra,dec,sI,sQ,sU,sV,SIn,f0,RM)=parms[i]
+     sI=sI*scale[i]
+     sQ=sQ*scale[i]
+     sU=sU*scale[i]
+     sV=sV*scale[i]
      (eX,eY,eP)=pu.getExtParms()
      # get degrees
-     [r_hr,r_min,r_sec]=common_utils.radToRA(ra)
-     [d_hr,d_min,d_sec]=common_utils.radToDec(dec)
+     [r_hr,r_min,r_sec]=radToRA(ra)
+     [d_hr,d_min,d_sec]=radToDec(dec)
      strline ='C'+str(pu.name)+' '+str(r_hr)+' '+str(r_min)+' '+str(r_sec)+' '+str(d_hr)+' '+str(d_min)+' '+str(d_sec)+' '+str(sI)+' '+str(sQ)+' '+str(sU)+' '+str(sV)+' '+str(SIn)+' '+str(RM)+' '+str(eX)+' '+str(eY)+' '+str(eP)+'\n';
      f.write(strline)
  
@@ -2224,8 +1774,8 @@ class LSM:
      (ra,dec,sI,sQ,sU,sV,SIn,f0,RM)=pu.getEssentialParms(ns)
      (eX,eY,eP)=pu.getExtParms()
      # get degrees
-     [r_hr,r_min,r_sec]=common_utils.radToRA(ra)
-     [d_hr,d_min,d_sec]=common_utils.radToDec(dec)
+     [r_hr,r_min,r_sec]=radToRA(ra)
+     [d_hr,d_min,d_sec]=radToDec(dec)
      strline =prefix+str(pu.name)+' '+str(r_hr)+' '+str(r_min)+' '+str(r_sec)+' '+str(d_hr)+' '+str(d_min)+' '+str(d_sec)+' '+str(sI)+' '+str(sQ)+' '+str(sU)+' '+str(sV)+' '+str(SIn)+' '+str(RM)+' '+str(eX)+' '+str(eY)+' '+str(eP)+' '+str(f0)+'\n';
      f.write(strline)
  
@@ -2273,137 +1823,15 @@ class LSM:
  ## build from a VizieR text file 
  ## format:
  ## 3CR RA1950 (h min sec)   e_RAs DE1950 (d min sec)  e_DEm S178MHz n_S178MHz l_Diam  Diam  x_Diam
- def build_from_vizier(self,infile_name,ns,f0=None):
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^\s*(?P<col1>[A-Za-z0-9]*(.)?[A-Za-z0-9]+)  # column 1 name: a string or number
-   \s+             # skip white space
-   (?P<col2>(-)?\d+(\.\d+)?)   # RA angle - hours 
-   \s+             # skip white space
-   (?P<col3>(-)?\d+(\.\d+)?)   # RA angle - min 
-   \s*             # skip white space
-   (?P<col4>(-)?\d+(\.\d+)?)   # RA angle - sec 
-   \s*             # skip white space
-   (?P<col5>(-)?\d+(\.\d+)?)   # eRA arcmin
-   \s*             # skip white space
-   (?P<col6>[+|-]?\d+(\.\d+)?)   # Dec angle - degrees
-   \s*             # skip white space
-   (?P<col7>(-)?\d+(\.\d+)?)   # Dec angle - min
-   \s*             # skip white space
-   (?P<col8>(-)?\d+(\.\d+)?)   # Dec angle - sec 
-   \s*             # skip white space
-   (?P<col9>(-)?\d+(\.\d+)?)   # eDec arcmin
-   \s*             # skip white space
-   (?P<col10>(-)?\d+(\.\d+)?)   # Stokes I - Flux (Jy)
-   \s*             # skip white space
-   (?P<col11>[-+]?(\d+(\.\d*)?|\d*\.\d+)([eE][-+]?\d+)?)  # Spectral index
-   \s*.\s*""",re.VERBOSE) # ignore the rest
-
-
-  kk=0
-  for eachline in all:
-   v=pp.search(eachline)
-   if v!=None:
-     s=Source(v.group('col1'))
-     source_RA=float(v.group('col2'))+(float(v.group('col4'))/60.0+float(v.group('col3')))/60.0
-     source_RA*=math.pi/12.0
-     source_Dec=float(v.group('col6'))+(float(v.group('col8'))/60.0+float(v.group('col7')))/60.0
-     source_Dec*=math.pi/180.0
-
-     sI=eval(v.group('col10'))
-
-     SI=eval(v.group('col11'))
-
-     s=Source(v.group('col1'))
-
-     kk=kk+1
-
-     #print sI,sQ,sU,sV
-     if f0==None:
-      freq0=1e6
-     else:
-      freq0=f0
-     my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, SI=SI, f0=freq0, RA=source_RA, Dec=source_Dec,trace=0)
- 
-     # first compose the sixpack before giving it to the LSM
-     SourceRoot=my_sixpack.sixpack(ns)
-     self.add_source(s,brightness=eval(v.group('col9')),
-       sixpack=my_sixpack,
-       ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_vizier(self,infile_name,ns,f0=None,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_vizier,min_flux,region,f0=f0)
 
 
  ## build from Duchamp source extractor output
  ## format:
  ##  Obj#  Name X  Y  Z RA(h:min:sec.00) DEC(+deg:min:sec.00)    VEL     w_RA    w_DEC  w_VEL     F_int     F_tot    F_peak  and other fields, which are ignored
- def build_from_duchamp(self,infile_name,ns,f0=None):
-  infile=open(infile_name,'r')
-  all=infile.readlines()
-  infile.close()
-
-  # regexp pattern
-  pp=re.compile(r"""
-   ^\s*(?P<col1>\d+)  # column 1 object number: integer
-   \s+             # skip white space
-   (?P<col2>[A-Za-z0-9]*(\+)?[A-Za-z0-9]+)  # column 2 name: a string
-   \s+             # skip white space
-   (?P<col3>\d+(\.\d+)?)   # X pixel, ignored
-   \s+             # skip white space
-   (?P<col4>\d+(\.\d+)?)   # Y pixel, ignored
-   \s+             # skip white space
-   (?P<col5>\d+(\.\d+)?)   # Z pixel, ignored
-   \s+             # skip white space
-   (?P<col6>\d+\:\d+\:\d+(\.\d+)?)   # RA angle 
-   \s+             # skip white space
-   (?P<col7>(\+)?\d+\:\d+\:\d+(\.\d+)?)   # Dec angle 
-   \s+             # skip white space
-   (?P<col8>\d+(\.\d+)?)   # Vel, ignored
-   \s+             # skip white space
-   (?P<col9>\d+(\.\d+)?)   # w_RA, ignored
-   \s+             # skip white space
-   (?P<col10>\d+(\.\d+)?)   # w_Dec, ignored
-   \s+             # skip white space
-   (?P<col11>\d+(\.\d+)?)   # w_Vel, ignored
-   \s+             # skip white space
-   (?P<col12>\d+(\.\d+)?)   # F_int, ignored
-   \s+             # skip white space
-   (?P<col13>\d+(\.\d+)?)   # F_tot, ignored
-   \s+             # skip white space
-   (?P<col14>\d+(\.\d+)?)   # F_peak
-   \s*.\s*""",re.VERBOSE) # ignore the rest
-  for eachline in all:
-   v=pp.search(eachline)
-   if v!=None:
-      s=Source(v.group('col2'))
-      # get RA,Dec
-      sl=string.split(v.group('col6'),':')
-      source_RA=float(sl[0])+(float(sl[2])/60.0+float(sl[1]))/60.0
-      source_RA*=math.pi/12.0
-      sl=string.split(v.group('col7'),':')
-      source_Dec=float(sl[0])+(float(sl[2])/60.0+float(sl[1]))/60.0
-      source_Dec*=math.pi/180.0
-
-      # use peak flux
-      sI=float(v.group('col14'))
-      SI=0;
-      if f0==None:
-        freq0=1e6
-      else:
-        freq0=f0
-
-      my_sixpack=LSM_Sixpack.newstar_source(ns,punit=s.name,I0=sI, SI=SI, f0=freq0, RA=source_RA, Dec=source_Dec,trace=0)
-      self.add_source(s,brightness=sI,
-       sixpack=my_sixpack,
-       ra=source_RA, dec=source_Dec)
- 
-  self.setNodeScope(ns)
-  self.setFileName(infile_name)
+ def build_from_duchamp(self,infile_name,ns,f0=None,min_flux=None,region=None):
+  self._build_from_text(infile_name,ns,LSM_readers.parse_duchamp,min_flux,region,f0=f0)
 
 
 
@@ -0,0 +1,291 @@
+#!/usr/bin/python
+#
+# The Local Sky Model (LSM)
+#
+# This code includes the binary file format used by LSM.save() and
+# LSM.load(). A file has
+#  - MAGIC, followed by the length of the header as a little-endian uint64
+#  - the header: a pickled dict with the table size, the offset and type
+#    of each column, bounds and brightness range of the table, the
+#    location of the node section, and the remaining LSM attributes
+#  - the source table, one column after another (see LSM_columns.COLUMNS),
+#    with rows in order of decreasing brightness
+#  - the node section: a pickled dict with the serialized node trees
+#    (as made by common_utils.traverse()), and the node names of the
+#    sixpacks that have nodes instead of values
+#  - the index section: the pickled state of the spatial index, i.e.
+#    names and positions, the tree itself is rebuilt on loading
+#    (see LSM_spatial)
+# Columns are memory-mapped on loading, so that a flux- or region-limited
+# load only reads the columns used for the selection, and the rows selected.
+#
+
+
+#% $Id$
+
+#
+# Copyright (C) 2002-2007
+# ASTRON (Netherlands Foundation for Research in Astronomy)
+# and The MeqTree Foundation
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands, seg@astron.nl
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import struct
+import cPickle
+import numpy
+
+from common_utils import *
+from LSM_columns import *
+import LSM_spatial
+
+MAGIC="MEQLSM\x01\n"
+VERSION=1
+
+# columns are aligned to this many bytes
+ALIGN=8
+
+# True if filename is an LSM file in the binary format
+def is_binary_lsm(filename):
+ f=open(filename,'rb')
+ try:
+  return f.read(len(MAGIC))==MAGIC
+ finally:
+  f.close()
+
+# returns dict of the node stubs of the sixpack of PUnit p, keyed as in
+# the node section ('patchroot' for a patch, 'ra','dec','I','Q','U','V'
+# otherwise, where these may also be values), or None if p has no nodes
+def sixpack_nodes(p):
+ if p.getType()==PATCH_TYPE:
+  if hasattr(p.sp.root,'name'):
+   return dict(patchroot=p.sp.root)
+  return None
+ sp=p.getSP()
+ if sp is None:
+  return None
+ stubs=dict(ra=sp.ra(),dec=sp.dec(),I=sp.stokesI(),Q=sp.stokesQ(),
+  U=sp.stokesU(),V=sp.stokesV())
+ if not [ 1 for x in stubs.itervalues() if hasattr(x,'name') ]:
+  return None
+ return stubs
+
+# returns the contents of the node section for a list of PUnits: the
+# serialized node trees of their sixpacks, and the node names of each
+# sixpack. Returns None if none of the PUnits have nodes.
+def serialize_nodes(punits,subscope=None):
+ nodes={}
+ sixpacks={}
+ for p in punits:
+  stubs=sixpack_nodes(p)
+  if stubs is None:
+   continue
+  names={}
+  for key,stub in stubs.iteritems():
+   if hasattr(stub,'name'):
+    traverse(stub,nodes,subscope)
+    if subscope:
+     names[key]=strip_subscope(stub.name)
+    else:
+     names[key]=stub.name
+   else:
+    names[key]=stub
+  sixpacks[p.name]=names
+ if not sixpacks:
+  return None
+ return dict(nodes=nodes,sixpacks=sixpacks)
+
+# returns the part of a dict of serialized nodes (see traverse())
+# that is needed to make the given nodes
+def node_subset(nodes,names):
+ subset={}
+ stack=[ name for name in names if nodes.has_key(name) ]
+ while stack:
+  name=stack.pop()
+  if not subset.has_key(name):
+   subset[name]=nodes[name]
+   stack+=[ ch for ch in nodes[name]['children'] if nodes.has_key(ch) ]
+ return subset
+
+# writes an LSM file. data is a structured array as given by
+# SourceColumns.data(), attrs a dict of LSM attributes, nodes
+# the contents of the node section and index the spatial index,
+# or None
+def write_lsm(filename,data,attrs,nodes=None,index=None):
+ # sort by brightness, patches refer to rows by number so renumber these
+ order=numpy.argsort(-data['brightness'],kind='mergesort')
+ data=data[order]
+ newrow=numpy.empty(len(order),int)
+ newrow[order]=numpy.arange(len(order))
+ patch=data['patch']
+ data['patch']=numpy.where(patch>=0,newrow[numpy.maximum(patch,0)],-1)
+
+ header=dict(version=VERSION,nrows=len(data),attrs=attrs,columns=[],nodes=None,index=None)
+ if len(data):
+  src=data[(data['type']==POINT_TYPE)|(data['type']==GAUSS_TYPE)]
+  if len(src):
+   header['bounds']=(src['ra'].min(),src['ra'].max(),src['dec'].min(),src['dec'].max())
+  header['brightness']=(data['brightness'].min(),data['brightness'].max())
+ # sections after the columns
+ sections=[]
+ if nodes:
+  sections.append(('nodes',cPickle.dumps(nodes,cPickle.HIGHEST_PROTOCOL)))
+ if index is not None:
+  sections.append(('index',cPickle.dumps(index.state(),cPickle.HIGHEST_PROTOCOL)))
+
+ # the header holds the offsets, which depend on the size of the header,
+ # so repeat until the header size settles (it can only grow)
+ header_len=0
+ while True:
+  offset=len(MAGIC)+8+header_len
+  header['columns']=[]
+  for field in data.dtype.names:
+   offset=(offset+ALIGN-1)//ALIGN*ALIGN
+   header['columns'].append((field,data.dtype[field].str,offset))
+   offset+=data.dtype[field].itemsize*len(data)
+  for key,section in sections:
+   header[key]=(offset,len(section))
+   offset+=len(section)
+  header_str=cPickle.dumps(header,cPickle.HIGHEST_PROTOCOL)
+  if len(header_str)==header_len:
+   break
+  header_len=len(header_str)
+
+ f=open(filename,'wb')
+ try:
+  f.write(MAGIC)
+  f.write(struct.pack('<Q',len(header_str)))
+  f.write(header_str)
+  for field,dt,offset in header['columns']:
+   f.write('\0'*(offset-f.tell()))
+   data[field].astype(dt).tofile(f)
+  for key,section in sections:
+   f.write(section)
+ finally:
+  f.close()
+
+###############################################
+class LSMFile:
+ """An LSM file in the binary format, opened for reading. The source
+ table columns are memory-mapped, and the node section is only read
+ when asked for.
+ """
+ def __init__(self,filename):
+  self.filename=filename
+  f=open(filename,'rb')
+  try:
+   if f.read(len(MAGIC))!=MAGIC:
+    raise TypeError,"%s is not a binary LSM file"%filename
+   (header_len,)=struct.unpack('<Q',f.read(8))
+   self.header=cPickle.loads(f.read(header_len))
+  finally:
+   f.close()
+  if self.header['version']>VERSION:
+   raise TypeError,"%s has an unsupported LSM file version %d"%(filename,self.header['version'])
+  self.nrows=self.header['nrows']
+  self.attrs=self.header['attrs']
+  self._columns={}
+
+ # returns a column, as a read-only memmap
+ def column(self,field):
+  col=self._columns.get(field,None)
+  if col is None:
+   for name,dt,offset in self.header['columns']:
+    if name==field:
+     break
+   else:
+    raise KeyError,field
+   if self.nrows:
+    col=numpy.memmap(self.filename,dtype=dt,mode='r',offset=offset,shape=(self.nrows,))
+   else:
+    col=numpy.zeros(0,dtype=dt)
+   self._columns[field]=col
+  return col
+
+ # returns the contents of the node section, or None
+ def nodes(self):
+  return self._section('nodes')
+
+ # returns the spatial index, or None
+ def index(self):
+  state=self._section('index')
+  if state is None:
+   return None
+  # files written by earlier versions include the tree
+  state.pop('tree',None)
+  return LSM_spatial.SpatialIndex(**state)
+
+ def _section(self,key):
+  if not self.header.get(key,None):
+   return None
+  offset,length=self.header[key]
+  f=open(self.filename,'rb')
+  try:
+   f.seek(offset)
+   return cPickle.loads(f.read(length))
+  finally:
+   f.close()
+
+ # returns row numbers of the rows selected by a brightness limit and
+ # a region (min_RA,max_RA,min_Dec,max_Dec), which may wrap around RA=0
+ # (see common_utils.ra_in_range()). Both apply to the top-level
+ # PUnits, the sources of a selected patch are always included.
+ def select(self,min_brightness=None,region=None):
+  if min_brightness is None and region is None:
+   return numpy.arange(self.nrows)
+  # rows are sorted by brightness, so the brightness limit gives a
+  # range of rows, and only that range of the other columns is read
+  nsel=self.nrows
+  if min_brightness is not None:
+   nsel=numpy.searchsorted(-self.column('brightness'),-min_brightness,side='right')
+  ptype=self.column('type')
+  patch=self.column('patch')
+  top=(patch[:nsel]<0)|(ptype[:nsel]==PATCH_TYPE)
+  if region is not None:
+   min_RA,max_RA,min_Dec,max_Dec=region
+   ra=self.column('ra')[:nsel]
+   dec=self.column('dec')[:nsel]
+   top&=ra_in_range(ra,min_RA,max_RA)&(dec>=min_Dec)&(dec<=max_Dec)
+  rows=numpy.nonzero(top)[0]
+  patches=rows[ptype[rows]==PATCH_TYPE]
+  if len(patches):
+   members=numpy.nonzero(numpy.in1d(patch,patches))[0]
+   rows=numpy.union1d(rows,members)
+  return rows
+
+ # returns the given rows of the table, as a structured array for
+ # SourceColumns, with patch numbers referring to the rows returned
+ def read(self,rows=None):
+  if rows is None:
+   rows=numpy.arange(self.nrows)
+  names=self.column('name')
+  data=numpy.zeros(len(rows),dtype=table_dtype(max(names.dtype.itemsize,1)))
+  saved=[ name for name,dt,offset in self.header['columns'] ]
+  for field in data.dtype.names:
+   # columns added since the file was written get their defaults
+   if field not in saved:
+    data[field]=DEFAULTS[field]
+   elif len(rows)==self.nrows:
+    data[field]=self.column(field)
+   else:
+    data[field]=self.column(field)[rows]
+  newrow=numpy.empty(self.nrows,int)
+  newrow.fill(-1)
+  newrow[rows]=numpy.arange(len(rows))
+  patch=data['patch']
+  data['patch']=numpy.where(patch>=0,newrow[numpy.maximum(patch,0)],-1)
+  return data
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+#
+# The Local Sky Model (LSM)
+#
+# This code includes the columnar source table used by the LSM when it
+# is created with columnar=True. Instead of a Source, PUnit and Sixpack
+# object per component, the LSM then keeps one row per PUnit in a numpy
+# structured array, and only creates the objects when they are asked for.
+# 
+
+
+#% $Id$ 
+
+#
+# Copyright (C) 2002-2007
+# ASTRON (Netherlands Foundation for Research in Astronomy)
+# and The MeqTree Foundation
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands, seg@astron.nl
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import numpy
+import UserDict
+
+from common_utils import *
+
+# per-row columns of the source table (the name column is added by
+# table_dtype(), since its width grows as needed)
+#  type: POINT_TYPE, GAUSS_TYPE or PATCH_TYPE
+#  ra,dec: position (rad)
+#  I,Q,U,V: Stokes parameters at reference frequency f0
+#  spi,RM: spectral index and rotation measure
+#  eX,eY,eP: extent (major,minor,position angle) of extended sources
+#  l,m: direction cosines the source was given at (PUnit._lm), NaN if none
+#  brightness: apparent brightness, used for sorting
+#  cat: category
+#  patch: row number of the patch the source belongs to, -1 if none
+COLUMNS=[('type',numpy.int8),('ra',float),('dec',float),
+  ('I',float),('Q',float),('U',float),('V',float),
+  ('spi',float),('f0',float),('RM',float),
+  ('eX',float),('eY',float),('eP',float),('l',float),('m',float),
+  ('brightness',float),('cat',numpy.int16),('patch',numpy.int32)]
+
+# default column values
+DEFAULTS=dict(type=POINT_TYPE,ra=0,dec=0,I=0,Q=0,U=0,V=0,
+  spi=0,f0=1e6,RM=0,eX=0,eY=0,eP=0,l=numpy.nan,m=numpy.nan,brightness=0,cat=1,patch=-1)
+
+def table_dtype(namelen):
+ return numpy.dtype([('name','S%d'%namelen)]+COLUMNS)
+
+###############################################
+class SourceColumns:
+ """Source table with one row per PUnit, in a numpy structured
+ array (see COLUMNS). Rows are appended to a buffer that grows by
+ doubling, so building a table of N rows costs O(N). data() returns
+ the filled rows, for vectorized queries.
+ """
+ def __init__(self):
+  self._namelen=16
+  self._data=numpy.zeros(0,dtype=table_dtype(self._namelen))
+  self.nrows=0
+  # row number of each name
+  self._rows={}
+
+ # make a table from a structured array of table_dtype()
+ def from_data(data):
+  columns=SourceColumns()
+  columns._namelen=data.dtype['name'].itemsize
+  columns._data=data
+  columns.nrows=len(data)
+  columns._rows=dict(zip(data['name'].tolist(),xrange(len(data))))
+  return columns
+ from_data=staticmethod(from_data)
+
+ def __len__(self):
+  return self.nrows
+
+ def __contains__(self,name):
+  return name in self._rows
+
+ # make room for n more rows, and for names of up to namelen characters
+ def _reserve(self,n,namelen=0):
+  grow=self.nrows+n>len(self._data)
+  if not grow and namelen<=self._namelen:
+   return
+  capacity=len(self._data)
+  if grow:
+   capacity=max(self.nrows+n,2*capacity,64)
+  self._namelen=max(namelen,self._namelen)
+  data=numpy.zeros(capacity,dtype=table_dtype(self._namelen))
+  for field in data.dtype.names:
+   data[field][:self.nrows]=self._data[field][:self.nrows]
+  self._data=data
+
+ # add a row, unspecified columns get their DEFAULTS. Returns row number
+ def append(self,name,**values):
+  if name in self._rows:
+   raise ValueError,"row '%s' is already present"%name
+  self._reserve(1,len(name))
+  irow=self.nrows
+  row=self._data[irow]
+  row['name']=name
+  for field,default in DEFAULTS.iteritems():
+   row[field]=values.get(field,default)
+  self._rows[name]=irow
+  self.nrows+=1
+  return irow
+
+ # add rows in bulk: names is a list, columns are arrays (or scalars)
+ # of the same length. Returns row number of the first new row
+ def extend(self,names,**columns):
+  for name in names:
+   if name in self._rows:
+    raise ValueError,"row '%s' is already present"%name
+  n=len(names)
+  self._reserve(n,max([len(name) for name in names] or [0]))
+  irow=self.nrows
+  rows=self._data[irow:irow+n]
+  rows['name']=names
+  for field,default in DEFAULTS.iteritems():
+   rows[field]=columns.get(field,default)
+  for i,name in enumerate(names):
+   self._rows[name]=irow+i
+  self.nrows+=n
+  return irow
+
+ # filled rows of the table (a view, so it can be modified in place)
+ def data(self):
+  return self._data[:self.nrows]
+
+ def index(self,name):
+  return self._rows[name]
+
+ def row(self,name):
+  return self._data[self._rows[name]]
+
+ def name(self,irow):
+  return self._data['name'][irow]
+
+ def set(self,name,**values):
+  row=self._data[self._rows[name]]
+  for field,value in values.iteritems():
+   row[field]=value
+
+ # list of names, optionally for the rows given by a mask
+ def names(self,mask=None):
+  names=self.data()['name']
+  if mask is not None:
+   names=names[mask]
+  return names.tolist()
+
+ # mask of point and extended sources (i.e. not patches)
+ def source_mask(self):
+  t=self.data()['type']
+  return (t==POINT_TYPE)|(t==GAUSS_TYPE)
+
+ # mask of top-level PUnits: patches, and sources not in a patch
+ def punit_mask(self):
+  data=self.data()
+  return (self.source_mask()&(data['patch']<0))|(data['type']==PATCH_TYPE)
+
+ # returns min_RA,max_RA,min_Dec,max_Dec over all sources, as
+ # LSM.getBounds(), or None if there are no sources
+ def bounds(self):
+  data=self.data()
+  data=data[self.source_mask()]
+  if not len(data):
+   return None
+  # extended sources count with their extent (see PUnit.getLimits())
+  ext=numpy.where(data['type']==GAUSS_TYPE,data['eX']/2,0)
+  return ((data['ra']-ext).min(),(data['ra']+ext).max(),
+   (data['dec']-ext).min(),(data['dec']+ext).max())
+
+
+# returns dict of column values for a PUnit. Node-valued I,Q,U,V go in
+# the node section of a saved LSM (see LSM_binary). Other values that
+# are not scalars are left at their defaults, or if strict (as when
+# saving), raise a ValueError, since the columns can't hold them.
+def punit_row(p,strict=False):
+ row=dict(type=p.getType(),ra=p.sp.getRA(),dec=p.sp.getDec(),
+  brightness=p.getBrightness(),cat=p.getCat())
+ if p._lm is not None:
+  row['l'],row['m']=p._lm
+ sp=p.getSP()
+ if p.getType()!=PATCH_TYPE:
+  try:
+   row['eX'],row['eY'],row['eP']=[ float(x) for x in p.getExtParms() ]
+  except (TypeError,ValueError,KeyError,IndexError):
+   pass
+ if p.getType()!=PATCH_TYPE and sp is not None:
+  values=dict(I=sp.stokesI(),Q=sp.stokesQ(),U=sp.stokesU(),V=sp.stokesV(),
+   spi=sp.SI(),f0=sp.f0(),RM=sp.rm())
+  for key,value in values.iteritems():
+   if key in ('I','Q','U','V') and hasattr(value,'name'):
+    continue
+   try:
+    row[key]=float(value)
+   except (TypeError,ValueError):
+    if strict:
+     raise ValueError,"PUnit %s: %s=%r is not a scalar, can't be saved"%(p.name,key,value)
+ return row
+
+# makes a SourceColumns from the p_table and s_table of an LSM that
+# keeps objects (i.e. not a columnar one), for LSM.save(). Raises a
+# ValueError if a value can't be held by the columns (see punit_row()).
+# PUnits named in 'order' come first, in that order.
+def columns_from_tables(p_table,s_table,order=()):
+ columns=SourceColumns()
+ for pname in order:
+  columns.append(pname,**punit_row(p_table[pname],True))
+ for pname,p in p_table.iteritems():
+  if pname not in columns:
+   columns.append(pname,**punit_row(p,True))
+ for pname,p in p_table.iteritems():
+  if p._patch_name is not None and p._patch_name in columns:
+   columns.set(pname,patch=columns.index(p._patch_name))
+ for sname,s in s_table.iteritems():
+  try:
+   eX,eY,eP=[ float(x) for x in s.extParms() ]
+  except (TypeError,ValueError):
+   raise ValueError,"source %s: extent %r is not scalar, can't be saved"%(sname,s.extParms())
+  if sname in columns:
+   columns.set(sname,eX=eX,eY=eY,eP=eP)
+  else:
+   columns.append(sname,type=s.getType(),eX=eX,eY=eY,eP=eP)
+ return columns
+
+
+###############################################
+class LazyTable(UserDict.DictMixin):
+ """Dict-like view of a SourceColumns table, used for the s_table and
+ p_table of a columnar LSM. Maps names to objects, which are made by
+ factory(name) on first access, and kept. Objects may also be stored
+ directly. If 'types' is given, only rows of these types are included.
+ """
+ def __init__(self,columns,factory,types=None):
+  self._columns=columns
+  self._factory=factory
+  self._types=types
+  self._objects={}
+
+ def _has_row(self,name):
+  if name not in self._columns:
+   return False
+  return self._types is None or self._columns.row(name)['type'] in self._types
+
+ def __getitem__(self,name):
+  obj=self._objects.get(name,None)
+  if obj is None:
+   if not self._has_row(name):
+    raise KeyError,name
+   obj=self._objects[name]=self._factory(name)
+  return obj
+
+ def __setitem__(self,name,obj):
+  self._objects[name]=obj
+
+ def __delitem__(self,name):
+  raise TypeError,"can't delete from a columnar LSM"
+
+ def has_key(self,name):
+  return name in self._objects or self._has_row(name)
+ __contains__=has_key
+
+ def keys(self):
+  if self._types is None:
+   names=self._columns.names()
+  else:
+   types=self._columns.data()['type']
+   mask=numpy.zeros(len(types),bool)
+   for t in self._types:
+    mask|=(types==t)
+   names=self._columns.names(mask)
+  # objects stored before their row was added
+  names+=[ name for name in self._objects if name not in self._columns ]
+  return names
+
+ def __iter__(self):
+  return iter(self.keys())
+
+ def __len__(self):
+  return len(self.keys())
+
+ # True if the object has been made already
+ def is_materialized(self,name):
+  return name in self._objects
+
+ # list of the objects made (or stored) so far
+ def objects(self):
+  return self._objects.values()
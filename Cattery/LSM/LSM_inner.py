@@ -408,6 +408,84 @@ class SpH:
 
 
  
+###############################################
+class BrightnessIndex:
+ """Index of PUnit names, sorted by decreasing brightness (PUnits of equal
+ brightness are kept in order of insertion).
+ Insertions just append, and the index is sorted on the next lookup. Since
+ the sort is stable and mostly sorted input is sorted in linear time, a bulk
+ load costs one sort at the end, not one search per PUnit.
+ Removal is lazy: the name is dropped from the live set, and its entry is
+ skipped by lookups until the next compaction. So first(k) is O(k) once
+ sorted, and remove() is O(1).
+ """
+ def __init__(self):
+  # entries are (-brightness,sequence number,name)
+  self._entries=[]
+  self._sorted=True
+  self._seq=0
+  # live names, mapped to the sequence number of their entry
+  self._live={}
+
+ # build an index from a list of names already sorted by brightness
+ # (e.g. the __barr of an old saved LSM), brightness(name) gives the brightness
+ def from_list(names,brightness):
+  index=BrightnessIndex()
+  for name in names:
+   index.add(name,brightness(name))
+  return index
+ from_list=staticmethod(from_list)
+
+ def add(self,name,brightness):
+  if name in self._live:
+   self.remove(name)
+  if self._entries and (-brightness,self._seq)<self._entries[-1][:2]:
+   self._sorted=False
+  self._entries.append((-brightness,self._seq,name))
+  self._live[name]=self._seq
+  self._seq+=1
+
+ def remove(self,name):
+  if name not in self._live:
+   raise ValueError,"BrightnessIndex.remove(x): x not in index"
+  del self._live[name]
+
+ def _update(self):
+  # drop removed entries once they make up half the list, then sort if needed
+  if len(self._entries)>2*len(self._live)+16:
+   live=self._live
+   self._entries=[ e for e in self._entries if live.get(e[2])==e[1] ]
+  if not self._sorted:
+   self._entries.sort()
+   self._sorted=True
+
+ # returns list of names of the (up to) k brightest PUnits
+ def first(self,k):
+  self._update()
+  result=[]
+  if k<=0:
+   return result
+  live=self._live
+  for e in self._entries:
+   if live.get(e[2])==e[1]:
+    result.append(e[2])
+    if len(result)>=k:
+     break
+  return result
+
+ def __iter__(self):
+  self._update()
+  live=self._live
+  return iter([ e[2] for e in self._entries if live.get(e[2])==e[1] ])
+
+ def __len__(self):
+  return len(self._live)
+
+ def __contains__(self,name):
+  return name in self._live
+
+
+ 
 ###############################################
 class TemTree:
  """Template tree object"""
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+#
+# The Local Sky Model (LSM)
+#
+# This code includes the catalog readers used by the LSM.build_from_*()
+# methods for text formats. A catalog is read in blocks of lines (so
+# that a big catalog is never held in memory as a whole), each block is
+# split into fields and converted to numpy columns by a format parser,
+# and flux/region cuts are applied to the columns before the sources
+# are added to the LSM (see LSM.add_sources()). Catalogs may be
+# gzip-compressed. NEWSTAR .MDL models are binary, and are read by
+# memory-mapping the component records (see read_newstar()).
+#
+
+
+#% $Id$
+
+#
+# Copyright (C) 2002-2007
+# ASTRON (Netherlands Foundation for Research in Astronomy)
+# and The MeqTree Foundation
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands, seg@astron.nl
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import math
+import gzip
+import numpy
+
+from common_utils import lm_to_radec,ra_in_range
+
+# size of blocks read, in bytes
+BLOCK_SIZE=1<<22
+
+GZIP_MAGIC='\x1f\x8b'
+
+# opens a catalog for reading, uncompressing it if it is gzipped
+def open_catalog(filename):
+ f=open(filename,'rb')
+ magic=f.read(len(GZIP_MAGIC))
+ f.seek(0)
+ if magic==GZIP_MAGIC:
+  f.close()
+  return gzip.open(filename,'rb')
+ return f
+
+# yields the lines of a catalog in blocks, as lists of lists of
+# whitespace-separated fields. Blank lines and comments are skipped.
+def read_blocks(filename,blocksize=BLOCK_SIZE):
+ f=open_catalog(filename)
+ try:
+  while True:
+   lines=f.readlines(blocksize)
+   if not lines:
+    break
+   yield [ fields for fields in [ line.split() for line in lines ]\
+     if fields and not fields[0].startswith('#') ]
+ finally:
+  f.close()
+
+###############################################
+class Columns:
+ """Fields of a block of rows, as numpy columns. Rows with fewer than
+ 'nfields' fields are dropped, and so are rows where any of the
+ 'numeric' fields is not a number (e.g. headers).
+ """
+ def __init__(self,rows,nfields,numeric=()):
+  self.rows=[ row for row in rows if len(row)>=nfields ]
+  self._floats={}
+  try:
+   self._convert(numeric)
+  except ValueError:
+   self.rows=[ row for row in self.rows if _is_numeric(row,numeric) ]
+   self._convert(numeric)
+
+ def _convert(self,numeric):
+  for i in numeric:
+   self._floats[i]=numpy.array([ row[i] for row in self.rows ]).astype(float)
+
+ def __len__(self):
+  return len(self.rows)
+
+ # column of strings
+ def strings(self,i):
+  return [ row[i] for row in self.rows ]
+
+ # column of floats, i must be one of the numeric fields
+ def floats(self,i):
+  return self._floats[i]
+
+ # column of floats from an optional field, 'default' where it is missing
+ def optional(self,i,default):
+  col=numpy.empty(len(self.rows))
+  col.fill(default)
+  for k,row in enumerate(self.rows):
+   if len(row)>i:
+    try:
+     col[k]=float(row[i])
+    except ValueError:
+     pass
+  return col
+
+ # sexagesimal (h/d,m,s) in fields i,i+1,i+2, in units of h/d. The sign
+ # is taken from field i, so that e.g. "-00 30 00" is negative
+ def sexagesimal(self,i):
+  x=abs(self._floats[i])+(self._floats[i+1]+self._floats[i+2]/60.0)/60.0
+  negative=numpy.array([ row[i].startswith('-') for row in self.rows ],bool)
+  return numpy.where(negative,-x,x)
+
+ names=strings
+
+# True if the given fields of row are all numbers
+def _is_numeric(row,fields):
+ try:
+  for i in fields:
+   float(row[i])
+ except ValueError:
+  return False
+ return True
+
+# splits "h:m:s" fields of a row into three fields each (so that
+# Columns.sexagesimal() can be used), or returns None if they are bad
+def _split_colons(row,fields):
+ out=[]
+ for i,x in enumerate(row):
+  if i in fields:
+   x=x.split(':')
+   if len(x)!=3:
+    return None
+   out+=x
+  else:
+   out.append(x)
+ return out
+
+#****************************************************************************************
+# Format parsers. Each takes a list of rows (lists of fields), and the number
+# of sources parsed before, and returns a dict of columns as taken by
+# LSM.add_sources(): 'names', 'ra', 'dec' (radians), 'I', and optionally
+# 'Q','U','V','spi','RM','f0','eX','eY','eP','brightness'.
+
+DEG=math.pi/180.0
+HOUR=math.pi/12.0
+
+# NVSS catalog
+# cat     name            RA          eRA      Dec        eDec     freq   Flux(Jy)   eFl equi.
+#NVSS  J163411+624953   16 34 11.868   0.73   62 49 53.72   8.3     1400    0.0030    .0005 J
+def parse_nvss(rows,nparsed=0):
+ c=Columns(rows,13,(2,3,4,6,7,8,11))
+ return dict(names=c.names(1),ra=c.sexagesimal(2)*HOUR,dec=c.sexagesimal(6)*DEG,
+  I=c.floats(11),f0=1e6)
+
+# OR_GSM file
+#  assoc flag     RA        eRA         Dec       eDec       Flux      eFlux
+#                (deg)     (deg)       (deg)      (deg)      (Jy)       (Jy)
+def parse_orgsm(rows,nparsed=0):
+ c=Columns(rows,8,(2,4,6))
+ return dict(names=c.names(0),ra=c.floats(2)*DEG,dec=c.floats(4)*DEG,
+  I=c.floats(6),f0=1e6)
+
+# SKA model catalog
+#  number  RA(deg)  Dec(deg)  Flux(Jy)  source ID
+def parse_ska(rows,nparsed=0):
+ c=Columns(rows,5,(1,2,3))
+ return dict(names=c.names(0),ra=c.floats(1)*DEG,dec=c.floats(2)*DEG,
+  I=c.floats(3),f0=1e6)
+
+# clean components: RA(deg) Dec(deg) I Q U V, named Comp_0, Comp_1, ...
+def parse_complist(rows,nparsed=0):
+ c=Columns(rows,6,range(6))
+ ra,dec,I,Q,U,V=[ c.floats(i) for i in range(6) ]
+ names=[ "Comp_"+str(k) for k in range(nparsed,nparsed+len(c)) ]
+ return dict(names=names,ra=ra*DEG,dec=dec*DEG,I=I,Q=Q,U=U,V=V,f0=1e6)
+
+# NAME RA(radians) DEC(radians) sI sQ sU sV SI eX eY eP
+def parse_extlist_rad(rows,nparsed=0):
+ c=Columns(rows,11,range(1,11))
+ ra,dec,I,Q,U,V,spi,eX,eY,eP=[ c.floats(i) for i in range(1,11) ]
+ return dict(names=c.names(0),ra=ra,dec=dec,I=I,Q=Q,U=U,V=V,spi=spi,
+  f0=1e6,eX=eX,eY=eY,eP=eP)
+
+# NAME RA(hours, min, sec) DEC(degrees, min, sec) sI sQ sU sV SI RM eX eY eP f0(optional)
+# Q,U,V are only used for positive I. If ignore_pol, Q,U,V and RM are ignored.
+# f0 is used where the reference frequency is not given (or 0).
+def parse_extlist(rows,nparsed=0,ignore_pol=False,f0=None):
+ c=Columns(rows,16,range(1,16))
+ I,Q,U,V,spi,RM,eX,eY,eP=[ c.floats(i) for i in range(7,16) ]
+ freq0=c.optional(16,0)
+ freq0[freq0==0]=f0 or 1e6
+ if ignore_pol:
+  Q=U=V=RM=0
+ else:
+  pos=I>0
+  Q,U,V=Q*pos,U*pos,V*pos
+ return dict(names=c.names(0),ra=c.sexagesimal(1)*HOUR,dec=c.sexagesimal(4)*DEG,
+  I=I,Q=Q,U=U,V=V,spi=spi,RM=RM,f0=freq0,eX=eX,eY=eY,eP=eP)
+
+# VizieR file
+# 3CR RA1950 (h min sec)   e_RAs DE1950 (d min sec)  e_DEm S178MHz n_S178MHz l_Diam  Diam  x_Diam
+def parse_vizier(rows,nparsed=0,f0=None):
+ c=Columns(rows,11,(1,2,3,5,6,7,9,10))
+ return dict(names=c.names(0),ra=c.sexagesimal(1)*HOUR,dec=c.sexagesimal(5)*DEG,
+  I=c.floats(9),spi=c.floats(10),f0=f0 or 1e6)
+
+# Duchamp source extractor output
+#  Obj#  Name X  Y  Z RA(h:min:sec.00) DEC(+deg:min:sec.00)    VEL     w_RA    w_DEC  w_VEL     F_int     F_tot    F_peak ...
+# the peak flux is used
+def parse_duchamp(rows,nparsed=0,f0=None):
+ # split RA and Dec into h,m,s and d,m,s, which moves F_peak to field 17
+ rows=[ _split_colons(row,(5,6)) for row in rows if len(row)>=14 ]
+ c=Columns([ row for row in rows if row ],18,(0,5,6,7,8,9,10,17))
+ return dict(names=c.names(1),ra=c.sexagesimal(5)*HOUR,dec=c.sexagesimal(8)*DEG,
+  I=c.floats(17),f0=f0 or 1e6)
+
+#****************************************************************************************
+
+# reads a catalog with the given parser (other keyword arguments are
+# passed to it), and yields dicts of columns as taken by LSM.add_sources(),
+# one per block. Sources with brightness<min_flux, or outside a region
+# given as (min_RA,max_RA,min_Dec,max_Dec), are left out. The region may
+# wrap around RA=0 (see common_utils.ra_in_range()).
+def read_catalog(filename,parser,min_flux=None,region=None,blocksize=BLOCK_SIZE,**kw):
+ nparsed=0
+ for rows in read_blocks(filename,blocksize):
+  cols=parser(rows,nparsed,**kw)
+  n=len(cols['names'])
+  nparsed+=n
+  if not n:
+   continue
+  cols.setdefault('brightness',cols['I'])
+  # expand scalars, so that the cuts can be applied to all columns
+  for key,value in cols.items():
+   if key!='names':
+    cols[key]=numpy.resize(numpy.asarray(value,float),n)
+  mask=None
+  if min_flux is not None:
+   mask=cols['brightness']>=min_flux
+  if region is not None:
+   min_RA,max_RA,min_Dec,max_Dec=region
+   ra,dec=cols['ra'],cols['dec']
+   inside=ra_in_range(ra,min_RA,max_RA)&(dec>=min_Dec)&(dec<=max_Dec)
+   if mask is None:
+    mask=inside
+   else:
+    mask&=inside
+  if mask is not None:
+   for key,value in cols.items():
+    if key=='names':
+     cols[key]=[ name for name,ok in zip(value,mask) if ok ]
+    else:
+     cols[key]=value[mask]
+  if cols['names']:
+   yield cols
+
+#****************************************************************************************
+# NEWSTAR .MDL model files (see mdl.dsc and MDL_O_DEF): a 512-byte file
+# header, a 64-byte model header, and a 56-byte record per component.
+# Only the fields used are described.
+
+NEWSTAR_FILE_HEADER=numpy.dtype(dict(
+  names=['type','length','crdate','crtime','rrdate','rrtime','rcount','node'],
+  formats=['S4','i4','S11','S5','S11','S5','i4','S80'],
+  offsets=[0,4,12,23,28,39,44,48],itemsize=512))
+
+#  nsources: number of components
+#  ra,dec: model centre (circles), freq: model frequency (MHz)
+NEWSTAR_MODEL_HEADER=numpy.dtype(dict(
+  names=['maxlin','modptr','nsources','mtype','epoch','ra','dec','freq'],
+  formats=['i4','i4','i4','i4','f4','f8','f8','f8'],
+  offsets=[12,16,20,24,28,32,40,48],itemsize=64))
+
+#  I: amplitude (WU), l,m: offsets from the model centre (radians)
+#  Q,U,V: fractions of I, eX,eY,eP: extent (NMOEXT parameters)
+#  SI: spectral index, RM: rotation measure
+#  bits: bit 0=extended, bit 1=Q|U|V<>0; ctype: bit 0=clean component, bit 3=beamed
+NEWSTAR_RECORD=numpy.dtype(dict(
+  names=['I','l','m','id','Q','U','V','eX','eY','eP','SI','RM','bits','ctype'],
+  formats=['f4','f4','f4','i4','f4','f4','f4','f4','f4','f4','f4','f4','u1','u1'],
+  offsets=[0,4,8,12,16,20,24,28,32,36,40,44,52,53],itemsize=56))
+
+# 1 WU = 5 mJy
+WU=0.005
+
+# names of components with the given ids: 'NEWS'+id, and 'NEWS'+id+'_'+k
+# for the k-th repeat of an id (clean components often repeat)
+def newstar_names(ids):
+ ids=numpy.asarray(ids)
+ order=numpy.argsort(ids,kind='mergesort')
+ sorted_ids=ids[order]
+ # position of each component among those with the same id
+ start=numpy.ones(len(ids),bool)
+ start[1:]=sorted_ids[1:]!=sorted_ids[:-1]
+ first=numpy.maximum.accumulate(numpy.where(start,numpy.arange(len(ids)),0))
+ repeat=numpy.empty(len(ids),int)
+ repeat[order]=numpy.arange(len(ids))-first
+ return [ k and 'NEWS%d_%d'%(i,k) or 'NEWS%d'%i
+  for i,k in zip(ids.tolist(),repeat.tolist()) ]
+
+# reads a NEWSTAR .MDL file. Returns the file header, the model header,
+# and a dict of columns as taken by LSM.add_sources(), including the
+# l,m offsets of the components from the model centre. The component
+# records are memory-mapped, and only the fields used are read.
+# If ignore_pol, Q,U,V and RM are ignored. If only_cleancomp, only clean
+# components are read, if no_cleancomp, no clean components are read.
+def read_newstar(filename,ignore_pol=False,only_cleancomp=False,no_cleancomp=False):
+ f=open(filename,'rb')
+ try:
+  header=numpy.fromfile(f,NEWSTAR_FILE_HEADER,1)
+  model=numpy.fromfile(f,NEWSTAR_MODEL_HEADER,1)
+ finally:
+  f.close()
+ if not len(model):
+  raise TypeError,"%s is not a NEWSTAR model file"%filename
+ header,model=header[0],model[0]
+ nsources=int(model['nsources'])
+ offset=NEWSTAR_FILE_HEADER.itemsize+NEWSTAR_MODEL_HEADER.itemsize
+ if nsources:
+  rec=numpy.memmap(filename,NEWSTAR_RECORD,'r',offset=offset,shape=(nsources,))
+ else:
+  rec=numpy.zeros(0,NEWSTAR_RECORD)
+
+ # clean components are not extended
+ cleancomp=(rec['bits']==0)&(rec['ctype']==1)
+ if only_cleancomp:
+  rec=rec[cleancomp]
+ elif no_cleancomp:
+  rec=rec[~cleancomp]
+
+ I=rec['I'].astype(float)*WU
+ if ignore_pol:
+  Q=U=V=RM=0
+ else:
+  Q=rec['Q'].astype(float)*I
+  U=rec['U'].astype(float)*I
+  V=rec['V'].astype(float)*I
+  RM=rec['RM'].astype(float)
+
+ # extent to major,minor axes and position angle (radians),
+ # as NMOEXT in nscan/nmoext.for
+ eX=rec['eX'].astype(float)
+ eY=rec['eY'].astype(float)
+ eP=rec['eP'].astype(float)
+ r0=numpy.where((eP==0)&(eX==eY),0,0.5*(360/math.pi)*numpy.arctan2(-eP,eY-eX))
+ r1=numpy.sqrt(eP*eP+(eX-eY)*(eX-eY))
+ r2=eX+eY
+
+ ra0=model['ra']*math.pi*2
+ dec0=model['dec']*math.pi*2
+ l=rec['l'].astype(float)
+ m=rec['m'].astype(float)
+ (ra,dec)=lm_to_radec(ra0,dec0,l,m)
+
+ cols=dict(names=newstar_names(rec['id']),ra=ra,dec=dec,l=l,m=m,
+  I=I,Q=Q,U=U,V=V,spi=rec['SI'].astype(float),RM=RM,f0=model['freq']*1e6,
+  eX=numpy.sqrt(abs(0.5*(r2+r1))),eY=numpy.sqrt(abs(0.5*(r2-r1))),eP=r0/(2*360)*math.pi)
+ return header,model,cols
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+# The Local Sky Model (LSM)
+#
+# This code includes the spatial index of an LSM, used for cone, box
+# and nearest-neighbour queries (see LSM.getSpatialIndex() and the
+# cone/box/nearest forms of LSM.queryLSM()). PUnit positions are kept
+# as unit vectors in a k-d tree, so that queries do not depend on the
+# position on the sky.
+#
+
+
+#% $Id$
+
+#
+# Copyright (C) 2002-2007
+# ASTRON (Netherlands Foundation for Research in Astronomy)
+# and The MeqTree Foundation
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands, seg@astron.nl
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import math
+import numpy
+from scipy.spatial import cKDTree
+
+from common_utils import ra_in_range
+
+# unit vector(s) of ra,dec (scalars or arrays), as an array of shape (...,3)
+def radec_to_xyz(ra,dec):
+ ra=numpy.asarray(ra,float)
+ dec=numpy.asarray(dec,float)
+ cosdec=numpy.cos(dec)
+ return numpy.array([cosdec*numpy.cos(ra),cosdec*numpy.sin(ra),numpy.sin(dec)]).T
+
+# chord length between two points on the unit sphere, for an angular distance
+def angle_to_chord(angle):
+ return 2*math.sin(min(angle,math.pi)/2)
+
+###############################################
+class SpatialIndex:
+ """Spatial index of the PUnits of an LSM. Names are given in order
+ of decreasing brightness, and queries return names in the same order
+ (except nearest(), which returns nearest first). All angles are in
+ radians. An index is a snapshot: the LSM makes a new one when PUnits
+ are added or moved.
+ """
+ def __init__(self,names,ra,dec,brightness=None):
+  self.names=list(names)
+  self.ra=numpy.asarray(ra,float)
+  self.dec=numpy.asarray(dec,float)
+  if brightness is None:
+   brightness=numpy.zeros(len(self.names))
+  self.brightness=numpy.asarray(brightness,float)
+  self.tree=None
+  if self.names:
+   self.tree=cKDTree(radec_to_xyz(self.ra,self.dec))
+  # order by Dec, for box queries
+  self._dec_order=numpy.argsort(self.dec,kind='mergesort')
+  self._dec_sorted=self.dec[self._dec_order]
+
+ def __len__(self):
+  return len(self.names)
+
+ # dict of constructor arguments that will remake this index,
+ # e.g. for saving it. The tree is not included (its pickled form
+ # depends on the scipy version), it is rebuilt from ra,dec.
+ def state(self):
+  return dict(names=self.names,ra=self.ra,dec=self.dec,
+   brightness=self.brightness)
+
+ # names of the given entries (in brightness order),
+ # optionally only those with brightness>=min_brightness
+ def _names(self,idx,min_brightness=None):
+  idx=numpy.sort(numpy.asarray(idx,int))
+  if min_brightness is not None:
+   idx=idx[self.brightness[idx]>=min_brightness]
+  names=self.names
+  return [ names[i] for i in idx ]
+
+ # PUnits within 'radius' of ra,dec
+ def cone(self,ra,dec,radius,min_brightness=None):
+  if self.tree is None:
+   return []
+  idx=self.tree.query_ball_point(radec_to_xyz(ra,dec),angle_to_chord(radius))
+  return self._names(idx,min_brightness)
+
+ # PUnits with min_RA<=RA<=max_RA and min_Dec<=Dec<=max_Dec. RA is
+ # taken modulo 2*pi, and the box may wrap around RA=0 (see
+ # common_utils.ra_in_range()).
+ def box(self,min_RA,max_RA,min_Dec,max_Dec,min_brightness=None):
+  i0=numpy.searchsorted(self._dec_sorted,min_Dec,side='left')
+  i1=numpy.searchsorted(self._dec_sorted,max_Dec,side='right')
+  idx=self._dec_order[i0:i1]
+  idx=idx[ra_in_range(self.ra[idx],min_RA,max_RA)]
+  return self._names(idx,min_brightness)
+
+ # the k PUnits nearest to ra,dec, nearest first. With min_brightness,
+ # only PUnits at least that bright are counted.
+ def nearest(self,ra,dec,k=1,min_brightness=None):
+  n=len(self.names)
+  if self.tree is None or k<1:
+   return []
+  xyz=radec_to_xyz(ra,dec)
+  # fainter PUnits are dropped, so ask for more until we have enough
+  nq=min(k,n)
+  while True:
+   dist,idx=self.tree.query(xyz,nq)
+   idx=numpy.atleast_1d(idx)
+   if min_brightness is not None:
+    idx=idx[self.brightness[idx]>=min_brightness]
+   if len(idx)>=k or nq>=n:
+    break
+   nq=min(nq*4,n)
+  return [ self.names[i] for i in idx[:k] ]
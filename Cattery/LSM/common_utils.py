@@ -25,6 +25,7 @@
 #
 
 import math
+import numpy
 from Timba.Meq import meq
 from Timba.TDL import *
 import Timba.array
@@ -709,9 +710,14 @@ def change_parm(ns,node,new_value):
  #ns.Resolve()
 
 # change MeqParm of TDL_Sixpack_Point RA,Dec 
+# (or the values, if the sixpack has values instead of nodes)
 def change_radec(sixpack,new_ra,new_dec,ns):
  myname=sixpack.label()
  ra=sixpack.ra()
+ if not hasattr(ra,'initrec'):
+  sixpack.ra(new_ra)
+  sixpack.dec(new_dec)
+  return
  change_parm(ns,ra,new_ra)
  dec=sixpack.dec()
  change_parm(ns,dec,new_dec)
@@ -727,47 +733,24 @@ def change_radec_patch(patch_name,new_ra,new_dec,ns):
 
 
 ################################################################
-## convert l,m coordinates to RA,Dec coordinates
-## see wng/wnmccv.for WNMCLM for more detail
-def lm_to_radec(ra0,dec0,l,m):
-    sind0=math.sin(dec0)
-    cosd0=math.cos(dec0)
-    dl=l
-    dm=m
-    d0=dm*dm*sind0*sind0+dl*dl-2*dm*cosd0*sind0
-    sind=math.sqrt(abs(sind0*sind0-d0))
-    cosd=math.sqrt(abs(cosd0*cosd0+d0))
-    if (sind0>0):
-     sind=abs(sind)
-    else:
-     sind=-abs(sind)
-
-    dec=math.atan2(sind,cosd)
-
-    if l!=0:
-     ra=math.atan2(-dl,(cosd0-dm*sind0))+ra0
-    else:
-     ra=math.atan2((1e-10),(cosd0-dm*sind0))+ra0
-
-
-    return (ra,dec)
-
-
-## convert ra,dec to lm (NCP)
-def radec_to_lm(ra0,dec0,ra,dec):
-    l=-math.sin(ra-ra0)*math.cos(dec)
-    sind0=math.sin(dec0)
-    if sind0 != 0:
-     m=-(math.cos(ra-ra0)*math.cos(dec)-math.cos(dec0))/math.sin(dec0)
-    else:
-     m=0
-    return (l,m)
-
-## convert ra,dec to lm (SIN)
-def radec_to_lm_SIN(ra0,dec0,ra,dec):
-    l=-math.sin(ra-ra0)*math.cos(dec)
-    m=-(math.cos(ra-ra0)*math.cos(dec)*math.sin(dec0)-math.cos(dec0)*math.sin(dec))
-    return (l,m)
+## returns mask of the RAs (array or scalar, radians) within min_RA..max_RA.
+## RAs and the limits are taken modulo 2*pi, and if min_RA>max_RA after
+## that, the range wraps around RA=0, e.g. (-0.1,0.1) or (6.2,0.1).
+def ra_in_range(ra,min_RA,max_RA):
+    ra=numpy.asarray(ra,float)
+    if max_RA-min_RA>=2*math.pi:
+     return numpy.ones(ra.shape,bool)
+    ra=numpy.mod(ra,2*math.pi)
+    min_RA=min_RA%(2*math.pi)
+    max_RA=max_RA%(2*math.pi)
+    if min_RA<=max_RA:
+     return (ra>=min_RA)&(ra<=max_RA)
+    return (ra>=min_RA)|(ra<=max_RA)
+
+## Projections between RA,Dec and l,m (these live in transform.py,
+## which does not need Timba)
+from transform import lm_to_radec,radec_to_lm,radec_to_lm_SIN,lm_to_radec_SIN,\
+  radec_to_lm_TAN,lm_to_radec_TAN,PROJECTIONS
 
 #################################################################
 if __name__ == '__main__':
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# Tests for the NEWSTAR model reader (LSM_readers.read_newstar() and
+# LSM.build_from_newstar()). A synthetic .MDL file is read both by the
+# reader and by a record-by-record reference reader, written as the
+# original build_from_newstar() was, and the PUnits made are compared.
+# Run with: python -m unittest discover Cattery/LSM/test
+#
+
+import os
+import os.path
+import sys
+import math
+import struct
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from Timba.TDL import *
+from common_utils import *
+import LSM
+
+RA0=1.2
+DEC0=0.8
+FREQ0=1400.
+
+# components: id,I (WU),l,m,Q,U,V (fractions of I),eX,eY,eP,SI,RM,bits,ctype
+COMPONENTS=[
+ (1,2000.,0.,0.,0.,0.,0.,0.,0.,0.,0.,0.,0,0),
+ (2,500.,0.01,-0.02,0.1,-0.05,0.01,0.,0.,0.,-0.7,0.,2,0),
+ (3,300.,-0.03,0.005,0.2,0.1,0.,0.,0.,0.,-0.5,12.,2,0),
+ (4,100.,0.02,0.02,0.,0.,0.,1e-6,4e-7,2e-7,0.,0.,1,0),
+ # clean components, which repeat ids
+ (5,40.,0.001,0.002,0.,0.,0.,0.,0.,0.,0.,0.,0,1),
+ (5,30.,0.0012,0.0021,0.,0.,0.,0.,0.,0.,0.,0.,0,1),
+ (5,20.,0.0011,0.0019,0.,0.,0.,0.,0.,0.,0.,0.,0,1),
+ (6,10.,-0.004,-0.001,0.,0.,0.,0.,0.,0.,0.,0.,0,1),
+]
+
+# writes a NEWSTAR .MDL file with the given components
+def write_mdl(filename,components):
+ f=open(filename,'wb')
+ header='.MDL'+struct.pack('i',512)+'\0'*4+'01-Jan-2000'+'12:00'
+ f.write(header+'\0'*(512-len(header)))
+ model='\0'*12+struct.pack('iiiif',len(components),0,len(components),1,2000.)+\
+   struct.pack('ddd',RA0/(2*math.pi),DEC0/(2*math.pi),FREQ0)
+ f.write(model+'\0'*(64-len(model)))
+ for (id,I,l,m,Q,U,V,eX,eY,eP,SI,RM,bits,ctype) in components:
+  rec=struct.pack('fffifffffffff',I,l,m,id,Q,U,V,eX,eY,eP,SI,RM,0)+struct.pack('BB',bits,ctype)
+  f.write(rec+'\0'*(56-len(rec)))
+ f.close()
+
+# reads a NEWSTAR .MDL file record by record, as the original
+# build_from_newstar() did. Returns a list of dicts of the values
+# that the PUnits of these components should have.
+def reference_newstar(filename,ignore_pol=False,only_cleancomp=False,no_cleancomp=False):
+ ff=open(filename,'rb')
+ ff.read(512)
+ mdh=ff.read(64)
+ nsources=struct.unpack('i',mdh[20:24])[0]
+ ra0=struct.unpack('d',mdh[32:40])[0]*math.pi*2
+ dec0=struct.unpack('d',mdh[40:48])[0]*math.pi*2
+ freq0=struct.unpack('d',mdh[48:56])[0]*1e6
+ unamedict={}
+ sources=[]
+ for ii in range(nsources):
+  mdl=ff.read(56)
+  sI=struct.unpack('f',mdl[0:4])[0]*0.005
+  ll=struct.unpack('f',mdl[4:8])[0]
+  mm=struct.unpack('f',mdl[8:12])[0]
+  id=struct.unpack('i',mdl[12:16])[0]
+  sQ=struct.unpack('f',mdl[16:20])[0]*sI
+  sU=struct.unpack('f',mdl[20:24])[0]*sI
+  sV=struct.unpack('f',mdl[24:28])[0]*sI
+  eX=struct.unpack('f',mdl[28:32])[0]
+  eY=struct.unpack('f',mdl[32:36])[0]
+  eP=struct.unpack('f',mdl[36:40])[0]
+  if eP==0 and eX==eY:
+   r0=0
+  else:
+   r0=0.5*(360/math.pi)*math.atan2(-eP,eY-eX)
+  r1=math.sqrt(eP*eP+(eX-eY)*(eX-eY))
+  r2=eX+eY
+  eX=math.sqrt(abs(0.5*(r2+r1)))
+  eY=math.sqrt(abs(0.5*(r2-r1)))
+  eP=r0/(2*360)*math.pi
+  SI=struct.unpack('f',mdl[40:44])[0]
+  RM=struct.unpack('f',mdl[44:48])[0]
+  bit1=struct.unpack('B',mdl[52:53])[0]
+  bit2=struct.unpack('B',mdl[53:54])[0]
+  cleancomp=(bit1==0 and bit2==1)
+  if (only_cleancomp and not cleancomp) or (no_cleancomp and cleancomp):
+   continue
+  bname='NEWS'+str(id)
+  if unamedict.has_key(bname):
+   uniqname=bname+'_'+str(unamedict[bname])
+   unamedict[bname]=unamedict[bname]+1
+  else:
+   uniqname=bname
+   unamedict[bname]=1
+  (source_RA,source_Dec)=lm_to_radec(ra0,dec0,ll,mm)
+  if ignore_pol:
+   sQ=sU=sV=RM=0
+  sources.append(dict(name=uniqname,ra=source_RA,dec=source_Dec,
+    I=sI,Q=sQ,U=sU,V=sV,SI=SI,RM=RM,f0=freq0,ext=(eX,eY,eP),
+    brightness=sI,lm=(ll,mm)))
+ ff.close()
+ return sources
+
+###############################################
+class NewstarTest(unittest.TestCase):
+
+ def setUp(self):
+  fd,self.filename=tempfile.mkstemp(suffix='.MDL')
+  os.close(fd)
+  write_mdl(self.filename,COMPONENTS)
+
+ def tearDown(self):
+  os.remove(self.filename)
+
+ def check(self,columnar,**kw):
+  lsm=LSM.LSM(columnar=columnar)
+  lsm.build_from_newstar(self.filename,NodeScope(),verbose=0,**kw)
+  sources=reference_newstar(self.filename,**kw)
+  self.assertEqual(sorted(lsm.p_table.keys()),sorted([ src['name'] for src in sources ]))
+  for src in sources:
+   p=lsm.p_table[src['name']]
+   sp=p.getSP()
+   self.assertEqual(p.getType(),(src['ext']!=(0,0,0)) and GAUSS_TYPE or POINT_TYPE)
+   self.assertAlmostEqual(p.getBrightness(),src['brightness'],12)
+   self.assertAlmostEqual(p.sp.getRA(),src['ra'],12)
+   self.assertAlmostEqual(p.sp.getDec(),src['dec'],12)
+   self.assertEqual(p._lm,src['lm'])
+   for value,key in (sp.stokesI(),'I'),(sp.stokesQ(),'Q'),(sp.stokesU(),'U'),\
+     (sp.stokesV(),'V'),(sp.SI(),'SI'),(sp.rm(),'RM'),(sp.f0(),'f0'),\
+     (sp.ra(),'ra'),(sp.dec(),'dec'):
+    self.assertAlmostEqual(value,src[key],12)
+   for x,x0 in zip(lsm.s_table[src['name']].extParms(),src['ext']):
+    self.assertAlmostEqual(x,x0,12)
+
+ def test_read(self):
+  for columnar in False,True:
+   self.check(columnar)
+
+ def test_filters(self):
+  for columnar in False,True:
+   self.check(columnar,ignore_pol=True)
+   self.check(columnar,only_cleancomp=True)
+   self.check(columnar,no_cleancomp=True)
+
+if __name__=='__main__':
+ unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+#
+# Tests for the projections between RA,Dec and l,m in transform.py
+# (also imported by common_utils). The array versions are checked
+# against scalar reference implementations, which are the scalar
+# versions these replaced, and by round trips.
+# Run with: python -m unittest discover Cattery/LSM/test
+#
+
+import os.path
+import sys
+import math
+import random
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+import transform
+from transform import *
+
+RA0=1.111
+DEC0=0.220
+
+## scalar reference implementations
+def ref_lm_to_radec(ra0,dec0,l,m):
+    sind0=math.sin(dec0)
+    cosd0=math.cos(dec0)
+    d0=m*m*sind0*sind0+l*l-2*m*cosd0*sind0
+    sind=math.sqrt(abs(sind0*sind0-d0))
+    cosd=math.sqrt(abs(cosd0*cosd0+d0))
+    if (sind0>0):
+     sind=abs(sind)
+    else:
+     sind=-abs(sind)
+    dec=math.atan2(sind,cosd)
+    if l!=0:
+     ra=math.atan2(-l,(cosd0-m*sind0))+ra0
+    else:
+     ra=math.atan2((1e-10),(cosd0-m*sind0))+ra0
+    return (ra,dec)
+
+def ref_radec_to_lm(ra0,dec0,ra,dec):
+    l=-math.sin(ra-ra0)*math.cos(dec)
+    sind0=math.sin(dec0)
+    if sind0 != 0:
+     m=-(math.cos(ra-ra0)*math.cos(dec)-math.cos(dec0))/math.sin(dec0)
+    else:
+     m=0
+    return (l,m)
+
+def ref_radec_to_lm_SIN(ra0,dec0,ra,dec):
+    l=-math.sin(ra-ra0)*math.cos(dec)
+    m=-(math.cos(ra-ra0)*math.cos(dec)*math.sin(dec0)-math.cos(dec0)*math.sin(dec))
+    return (l,m)
+
+def ref_sp_to_rt(ra0,dec0,p,ra,dec):
+   del_a=ra-ra0
+   L=math.cos(dec)*math.sin(del_a)
+   M=math.sin(dec)*math.cos(dec0)-math.cos(dec)*math.sin(dec0)*math.cos(del_a)
+   if p==0:
+     return (L,M)
+   return (L*math.cos(p)+M*math.sin(p),-L*math.sin(p)+M*math.cos(p))
+
+def ref_rt_to_sp(ra0,dec0,p,l,m):
+   if p==0:
+     L=l
+     M=m
+   else:
+     L=l*math.cos(p)-m*math.sin(p)
+     M=l*math.sin(p)+m*math.cos(p)
+   try:
+     dec=math.asin(M*math.cos(dec0)+math.sin(dec0)*math.sqrt(1-L*L-M*M))
+     ra=ra0+math.atan(L/(math.cos(dec0)*math.sqrt(1-L*L-M*M)-M*math.sin(dec0)))
+   except ValueError:
+     return(0,0)
+   return (ra,dec)
+
+###############################################
+class ProjectionTest(unittest.TestCase):
+
+ def setUp(self):
+  random.seed(1)
+  n=500
+  self.ra=numpy.array([ RA0+random.uniform(-0.1,0.1) for i in range(n) ])
+  self.dec=numpy.array([ DEC0+random.uniform(-0.1,0.1) for i in range(n) ])
+  # the phase centre itself, which has l=0
+  self.ra[0],self.dec[0]=RA0,DEC0
+
+ # checks a function of arrays against a scalar function, point by point
+ def check_arrays(self,func,ref,x,y):
+  (a,b)=func(RA0,DEC0,x,y)
+  self.assertEqual(a.shape,x.shape)
+  for i in range(len(x)):
+   (a0,b0)=ref(RA0,DEC0,x[i],y[i])
+   self.assertAlmostEqual(a[i],a0,12)
+   self.assertAlmostEqual(b[i],b0,12)
+
+ def test_ncp(self):
+  self.check_arrays(radec_to_lm,ref_radec_to_lm,self.ra,self.dec)
+  (l,m)=radec_to_lm(RA0,DEC0,self.ra,self.dec)
+  self.check_arrays(lm_to_radec,ref_lm_to_radec,l,m)
+
+ def test_sin(self):
+  self.check_arrays(radec_to_lm_SIN,ref_radec_to_lm_SIN,self.ra,self.dec)
+
+ def test_scalars(self):
+  for name,(to_lm,to_radec) in PROJECTIONS.items():
+   for func,x,y in (to_lm,self.ra[1],self.dec[1]),(to_radec,0.01,-0.02):
+    for value in func(RA0,DEC0,x,y):
+     self.assertEqual(type(value),float)
+   # arrays against scalars, for the projections that had no scalar
+   # version before
+   self.check_arrays(to_lm,to_lm,self.ra,self.dec)
+   (l,m)=to_lm(RA0,DEC0,self.ra,self.dec)
+   self.check_arrays(to_radec,to_radec,l,m)
+
+ def test_round_trips(self):
+  for name,(to_lm,to_radec) in PROJECTIONS.items():
+   (l,m)=to_lm(RA0,DEC0,self.ra,self.dec)
+   (ra,dec)=to_radec(RA0,DEC0,l,m)
+   self.assertTrue(abs(ra-self.ra).max()<1e-9,name)
+   self.assertTrue(abs(dec-self.dec).max()<1e-9,name)
+
+ def test_projector(self):
+  for rot in 0,0.3:
+   p=transform.Projector(RA0,DEC0,rot)
+   self.check_arrays(lambda ra0,dec0,x,y:p.sp_to_rt(x,y),
+     lambda ra0,dec0,x,y:ref_sp_to_rt(ra0,dec0,rot,x,y),self.ra,self.dec)
+   (l,m)=p.sp_to_rt(self.ra,self.dec)
+   # include points outside the unit circle, which give (0,0)
+   l[-10:]=numpy.linspace(0.5,1,10)
+   m[-10:]=numpy.linspace(1,0.9,10)
+   self.check_arrays(lambda ra0,dec0,x,y:p.rt_to_sp(x,y),
+     lambda ra0,dec0,x,y:ref_rt_to_sp(ra0,dec0,rot,x,y),l,m)
+   (ra,dec)=p.rt_to_sp(l[:-10],m[:-10])
+   self.assertTrue(abs(ra-self.ra[:-10]).max()<1e-12)
+   self.assertTrue(abs(dec-self.dec[:-10]).max()<1e-12)
+
+ def test_give_limits(self):
+  p=transform.Projector(RA0,DEC0,0.3)
+  box=(RA0-0.1,RA0+0.05,DEC0-0.02,DEC0+0.1)
+  # the limits are taken over 11 points along each edge
+  ra=[ box[0]+i*(box[1]-box[0])/10 for i in range(11) ]
+  dec=[ box[2]+i*(box[3]-box[2])/10 for i in range(11) ]
+  points=[ (r,box[2]) for r in ra ]+[ (r,box[3]) for r in ra ]+\
+    [ (box[0],d) for d in dec ]+[ (box[1],d) for d in dec ]
+  lm=[ ref_sp_to_rt(RA0,DEC0,0.3,r,d) for r,d in points ]
+  limits=p.give_limits(*box)
+  expected=(min([ l for l,m in lm ]),max([ l for l,m in lm ]),
+    min([ m for l,m in lm ]),max([ m for l,m in lm ]))
+  for x,x0 in zip(limits,expected):
+   self.assertAlmostEqual(x,x0,12)
+
+if __name__=='__main__':
+ unittest.main()
@@ -29,6 +29,89 @@
 #
 
 import math
+import numpy
+
+## Projections between RA,Dec and l,m w.r.t. a phase centre ra0,dec0
+## (all in radians). ra,dec and l,m may be scalars, in which case a tuple
+## of floats is returned, or numpy arrays, in which case a tuple of
+## arrays is returned. Note that l increases with decreasing RA.
+
+## returns a tuple of floats if all of args are scalars, else of arrays
+def _coords(*args):
+    if max([ numpy.ndim(x) for x in args ])==0:
+     return tuple([ float(x) for x in args ])
+    return tuple(numpy.broadcast_arrays(*args))
+
+## convert l,m coordinates to RA,Dec coordinates (NCP)
+## see wng/wnmccv.for WNMCLM for more detail
+def lm_to_radec(ra0,dec0,l,m):
+    l=numpy.asarray(l,float)
+    m=numpy.asarray(m,float)
+    sind0=math.sin(dec0)
+    cosd0=math.cos(dec0)
+    d0=m*m*sind0*sind0+l*l-2*m*cosd0*sind0
+    sind=numpy.sqrt(abs(sind0*sind0-d0))
+    cosd=numpy.sqrt(abs(cosd0*cosd0+d0))
+    if not sind0>0:
+     sind=-sind
+    dec=numpy.arctan2(sind,cosd)
+    ra=numpy.arctan2(numpy.where(l!=0,-l,1e-10),cosd0-m*sind0)+ra0
+    return _coords(ra,dec)
+
+
+## convert ra,dec to lm (NCP)
+def radec_to_lm(ra0,dec0,ra,dec):
+    ra=numpy.asarray(ra,float)
+    dec=numpy.asarray(dec,float)
+    l=-numpy.sin(ra-ra0)*numpy.cos(dec)
+    sind0=math.sin(dec0)
+    if sind0 != 0:
+     m=-(numpy.cos(ra-ra0)*numpy.cos(dec)-math.cos(dec0))/sind0
+    else:
+     m=numpy.zeros_like(l)
+    return _coords(l,m)
+
+## convert ra,dec to lm (SIN)
+def radec_to_lm_SIN(ra0,dec0,ra,dec):
+    ra=numpy.asarray(ra,float)
+    dec=numpy.asarray(dec,float)
+    l=-numpy.sin(ra-ra0)*numpy.cos(dec)
+    m=-(numpy.cos(ra-ra0)*numpy.cos(dec)*math.sin(dec0)-math.cos(dec0)*numpy.sin(dec))
+    return _coords(l,m)
+
+## convert lm to ra,dec (SIN)
+def lm_to_radec_SIN(ra0,dec0,l,m):
+    l=numpy.asarray(l,float)
+    m=numpy.asarray(m,float)
+    n=numpy.sqrt(abs(1-l*l-m*m))
+    dec=numpy.arcsin(numpy.clip(m*math.cos(dec0)+n*math.sin(dec0),-1,1))
+    ra=ra0+numpy.arctan2(-l,n*math.cos(dec0)-m*math.sin(dec0))
+    return _coords(ra,dec)
+
+## convert ra,dec to lm (TAN)
+def radec_to_lm_TAN(ra0,dec0,ra,dec):
+    ra=numpy.asarray(ra,float)
+    dec=numpy.asarray(dec,float)
+    cosc=numpy.sin(dec)*math.sin(dec0)+numpy.cos(dec)*math.cos(dec0)*numpy.cos(ra-ra0)
+    l=-numpy.sin(ra-ra0)*numpy.cos(dec)/cosc
+    m=(numpy.sin(dec)*math.cos(dec0)-numpy.cos(dec)*math.sin(dec0)*numpy.cos(ra-ra0))/cosc
+    return _coords(l,m)
+
+## convert lm to ra,dec (TAN)
+def lm_to_radec_TAN(ra0,dec0,l,m):
+    l=numpy.asarray(l,float)
+    m=numpy.asarray(m,float)
+    dec=numpy.arcsin((math.sin(dec0)+m*math.cos(dec0))/numpy.sqrt(1+l*l+m*m))
+    ra=ra0+numpy.arctan2(-l,math.cos(dec0)-m*math.sin(dec0))
+    return _coords(ra,dec)
+
+## projection name: (radec_to_lm,lm_to_radec) functions
+PROJECTIONS={
+  'NCP':(radec_to_lm,lm_to_radec),
+  'SIN':(radec_to_lm_SIN,lm_to_radec_SIN),
+  'TAN':(radec_to_lm_TAN,lm_to_radec_TAN),
+}
+
 ## class to implement projection
 class Projector:
   '''This class will perform spherical to rectangular projections
@@ -43,82 +126,53 @@ class Projector:
     self.__p=rot
     self.__state=1 # on (1),off (0) projection
 
-  # calculation of the bounds in l,m
+  # calculation of the bounds in l,m, from points along the edges
+  # of the RA,Dec box
   def give_limits(self,min_ra,max_ra,min_dec,max_dec):
-   # set to default values 
-   x_min=y_min=1000000
-   x_max=y_max=-1000000
-
-   #print (x_min,x_max,y_min,y_max)
-   # now consider local maxima,minima
    npoints=10
-
-   delta=(max_ra-min_ra)/npoints
-   for i in range(0,npoints+1):
-    pcoord=min_ra+i*delta
-    tmp_val=self.sp_to_rt(pcoord,min_dec)
-    if x_min>tmp_val[0]: x_min=tmp_val[0] 
-    elif x_max<tmp_val[0]: x_max=tmp_val[0] 
-    if y_min>tmp_val[1]: y_min=tmp_val[1] 
-    elif y_max<tmp_val[1]: y_max=tmp_val[1] 
-    tmp_val=self.sp_to_rt(pcoord,max_dec)
-    if x_min>tmp_val[0]: x_min=tmp_val[0] 
-    elif x_max<tmp_val[0]: x_max=tmp_val[0] 
-    if y_min>tmp_val[1]: y_min=tmp_val[1] 
-    elif y_max<tmp_val[1]: y_max=tmp_val[1] 
-
-   delta=(max_dec-min_dec)/npoints
-   for i in range(0,npoints+1):
-    pcoord=min_dec+i*delta
-    tmp_val=self.sp_to_rt(min_ra,pcoord)
-    if x_min>tmp_val[0]: x_min=tmp_val[0] 
-    elif x_max<tmp_val[0]: x_max=tmp_val[0] 
-    if y_min>tmp_val[1]: y_min=tmp_val[1] 
-    elif y_max<tmp_val[1]: y_max=tmp_val[1] 
-    tmp_val=self.sp_to_rt(max_ra,pcoord)
-    if x_min>tmp_val[0]: x_min=tmp_val[0] 
-    elif x_max<tmp_val[0]: x_max=tmp_val[0] 
-    if y_min>tmp_val[1]: y_min=tmp_val[1] 
-    elif y_max<tmp_val[1]: y_max=tmp_val[1] 
-
-
-   return (x_min,x_max,y_min,y_max)
+   ra=numpy.linspace(min_ra,max_ra,npoints+1)
+   dec=numpy.linspace(min_dec,max_dec,npoints+1)
+   (x,y)=self.sp_to_rt(numpy.concatenate((ra,ra,numpy.repeat(min_ra,npoints+1),numpy.repeat(max_ra,npoints+1))),
+       numpy.concatenate((numpy.repeat(min_dec,npoints+1),numpy.repeat(max_dec,npoints+1),dec,dec)))
+   return (float(x.min()),float(x.max()),float(y.min()),float(y.max()))
 
   # spherical to rectangular
-  # SIN projection
+  # SIN projection. ra,dec may be scalars or numpy arrays
   def sp_to_rt(self,ra,dec):
    if self.__state==0: return (ra,dec)
+   ra=numpy.asarray(ra,float)
+   dec=numpy.asarray(dec,float)
    del_a=ra-self.__ra0
-   L=math.cos(dec)*math.sin(del_a)
-   M=math.sin(dec)*math.cos(self.__dec0)-math.cos(dec)*math.sin(self.__dec0)*math.cos(del_a)
-   if self.__p==0:
-     return (L,M)
-   else: # we have an axis rotation 
-     l=L*math.cos(self.__p)+M*math.sin(self.__p)
-     m=-L*math.sin(self.__p)+M*math.cos(self.__p)
-     return (l,m)
+   L=numpy.cos(dec)*numpy.sin(del_a)
+   M=numpy.sin(dec)*math.cos(self.__dec0)-numpy.cos(dec)*math.sin(self.__dec0)*numpy.cos(del_a)
+   if self.__p!=0: # we have an axis rotation 
+     (L,M)=(L*math.cos(self.__p)+M*math.sin(self.__p),
+       -L*math.sin(self.__p)+M*math.cos(self.__p))
+   return _coords(L,M)
 
   # rectangular to spherical
-  # SIN projection
+  # SIN projection. l,m may be scalars or numpy arrays, points
+  # outside the unit circle give (0,0)
   def rt_to_sp(self,l,m):
    if self.__state==0: return (l,m)
-   if self.__p==0:
-     L=l
-     M=m
-   else:
-     L=l*math.cos(self.__p)-m*math.sin(self.__p)
-     M=l*math.sin(self.__p)+m*math.cos(self.__p)
-
+   L=numpy.asarray(l,float)
+   M=numpy.asarray(m,float)
+   if self.__p!=0:
+     (L,M)=(L*math.cos(self.__p)-M*math.sin(self.__p),
+       L*math.sin(self.__p)+M*math.cos(self.__p))
+
+   n2=1-L*L-M*M
+   bad=n2<0
+   n=numpy.sqrt(numpy.where(bad,0,n2))
+   sind=M*math.cos(self.__dec0)+math.sin(self.__dec0)*n
+   bad|=abs(sind)>1
+   err=numpy.seterr(divide='ignore',invalid='ignore')
    try:
-     dec=math.asin(M*math.cos(self.__dec0)\
-        +math.sin(self.__dec0)*math.sqrt(1-L*L-M*M))
-
-     ra=self.__ra0+math.atan(L/(math.cos(self.__dec0)\
-        *math.sqrt(1-L*L-M*M)-M*math.sin(self.__dec0)))
-   except ValueError:
-     return(0,0)
-  
-   return (ra,dec)
+     dec=numpy.arcsin(numpy.where(bad,0,sind))
+     ra=self.__ra0+numpy.arctan(L/(math.cos(self.__dec0)*n-M*math.sin(self.__dec0)))
+   finally:
+     numpy.seterr(**err)
+   return _coords(numpy.where(bad,0,ra),dec)
 
   # turn off projection
   def Off(self):
@@ -29,10 +29,16 @@ from Timba.Meq import meq
 from Parameterization import *
 import Jones
 import Context
+import numpy
 from math import cos,sin,acos,asin,atan2,sqrt,pi
 
 def radec_to_lmn (ra,dec,ra0,dec0):
-  """Returns l,m,n corresponding to direction ra,dec w.r.t. direction ra0,dec0""";
+  """Returns l,m,n corresponding to direction ra,dec w.r.t. direction ra0,dec0.
+  ra,dec may also be numpy arrays, in which case arrays of l,m,n are returned.""";
+  if isinstance(ra,numpy.ndarray) or isinstance(dec,numpy.ndarray):
+    l = numpy.cos(dec)*numpy.sin(ra-ra0);
+    m = numpy.sin(dec)*cos(dec0) - numpy.cos(dec)*sin(dec0)*numpy.cos(ra-ra0);
+    return l,m,numpy.sqrt(1-l*l-m*m);
 ## our old formula, perhaps unjustly suspected by me
 ## See purrlog for 3C147_spw0, entries of Nov 21.
 ## Doesn't this break down at the pole (l always 0)?
@@ -63,6 +69,80 @@ def lm_to_radec (l,m,ra0,dec0):
 
   return ra,dec;
 
+def static_lmn_array (directions,dir0=None):
+  """Computes static LMN for a list of directions w.r.t. a reference direction dir0 (or the global
+  phase center if not supplied). Returns an (N,3) array, or None if any of the directions (or dir0)
+  is not static. Plain Directions are converted in one vectorized pass, and their lmn_static() caches
+  are filled in as well, so subsequent lmn_static() calls are free. Subclasses with their own
+  lmn_static() (e.g. LMDirection) are simply asked for it.
+  """;
+  dir0 = Context.get_dir0(dir0);
+  if not dir0.static or not all([ d.static for d in directions ]):
+    return None;
+  ra0,dec0 = dir0.radec_static();
+  lmn = numpy.zeros((len(directions),3),float);
+  todo = [];
+  for i,d in enumerate(directions):
+    cache = getattr(d,'static_lmn',None);
+    if cache is None:
+      lmn[i,:] = d.lmn_static(dir0);
+    elif (ra0,dec0) in cache:
+      lmn[i,:] = cache[ra0,dec0];
+    else:
+      todo.append(i);
+  if todo:
+    radec = numpy.array([ directions[i].radec_static() for i in todo ],float);
+    lmn[todo,:] = numpy.array(radec_to_lmn(radec[:,0],radec[:,1],ra0,dec0)).T;
+    for i in todo:
+      directions[i].static_lmn[ra0,dec0] = tuple(map(float,lmn[i]));
+  return lmn;
+
+def precompute_static_KJones (ns,directions,array=None,dir0=None,batch=1000):
+  """Precomputes KJones for those of the given directions that are static, w.r.t. a static
+  reference direction dir0 (or the global phase center if not supplied). Rather than making
+  per-direction lmn, lmn-1 and phase shift nodes, the lmn-1 vectors of each batch of directions are
+  put into a single constant (N,3) tensor, and each station gets a single phase tensor per batch.
+  The K(p) nodes of each direction (see Direction.KJones()) then select their element from this tensor.
+  Nodes are created in scope ns. Note that the phase tensors are not suitable for smearing (see
+  Direction.smear_factor()), so directions of smeared sources should not be passed in.
+  Returns the number of directions for which KJones was precomputed.
+  """;
+  if not Context.get_dir0(dir0).static:
+    return 0;
+  array = Context.get_array(array);
+  stations = array.stations();
+  # collect static directions whose K has not been made yet
+  dirs = [];
+  seen = set();
+  for d in directions:
+    if not d.static or d is dir0 or id(d) in seen or d.is_phase_centre():
+      continue;
+    seen.add(id(d));
+    Kj = d.ns.K;
+    if dir0:
+      Kj = Kj.qadd(dir0.radec());
+    if not Kj(stations[0]).initialized() and not Kj('arg')(stations[0]).initialized():
+      dirs.append((d,Kj));
+  if not dirs:
+    return 0;
+  lmn_1 = static_lmn_array([ d for d,Kj in dirs ],dir0);
+  lmn_1[:,2] -= 1;
+  uvw = array.uvw(dir0);
+  for i0 in range(0,len(dirs),batch):
+    # name the tensors after the first direction in the batch, so repeated calls don't clash
+    name = dirs[i0][0].name;
+    lmnT = ns.lmn_minus1_static(name);
+    KT = ns.K_static(name);
+    if dir0:
+      lmnT,KT = lmnT.qadd(dir0.radec()),KT.qadd(dir0.radec());
+    lmnT << Meq.Constant(value=Timba.array.array(lmn_1[i0:i0+batch]));
+    for p in stations:
+      KT(p) << Meq.VisPhaseShift(KT(p,'arg') << Meq.MatrixMultiply(lmnT,uvw(p)));
+    for i,(d,Kj) in enumerate(dirs[i0:i0+batch]):
+      for p in stations:
+        Kj(p) << Meq.Selector(KT(p),index=i);
+  return len(dirs);
+
 class Direction (Parameterization):
   """A Direction represents an absolute direction on the sky, in ra,dec (radians).
   'name' may be None, this usually identifies the phase centre.
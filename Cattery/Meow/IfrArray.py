@@ -35,14 +35,18 @@ _wsrt_list = [ str(i) for i in range(10)] + ['A','B','C','D','E','F'];
 _vla_list = [ str(i) for i in range(1,28) ];
 
 _uvw_from_ms = "from MS";
+_uvw_from_ms_table = "from MS, via cached table";
 _uvw_compute_mirror = "compute (VLA convention)";
 _uvw_compute = "compute (WSRT convention)";
 
 uvw_source_opt = TDLOption('uvw_source',"UVW coordinates",
-      [_uvw_from_ms,_uvw_compute_mirror,_uvw_compute],
+      [_uvw_from_ms,_uvw_from_ms_table,_uvw_compute_mirror,_uvw_compute],
 #      [_uvw_compute,_uvw_compute_mirror],
       doc="""UVW coordinates can be read from the MS, or recomputed on the fly.
-      In the latter case, you have a choice of two opposite sign conventions.""");
+      In the latter case, you have a choice of two opposite sign conventions.
+      Reading them via a cached table extracts the station UVWs from the MS once (the table is then
+      stored inside the MS), and serves them to the whole array from a single node. This is a lot
+      cheaper than per-station spigots for large arrays.""");
 UVW_REFANT_DEFAULT = "default";
 uvw_refant_opt = TDLOption('uvw_refant',"Reference antenna",[UVW_REFANT_DEFAULT],more=str,
       doc="""<P>This is the reference antenna used to compute antenna-based UVWs.
@@ -55,7 +59,7 @@ uvw_refant_opt = TDLOption('uvw_refant',"Reference antenna",[UVW_REFANT_DEFAULT]
       you will need to look for another suitable antenna.</P>""");
 
 _options = [ uvw_source_opt,uvw_refant_opt ];
-uvw_source_opt.when_changed(lambda x:uvw_refant_opt.show(x==_uvw_from_ms));
+uvw_source_opt.when_changed(lambda x:uvw_refant_opt.show(x in (_uvw_from_ms,_uvw_from_ms_table)));
 
 from IfrSet import IfrSet
 
@@ -71,7 +75,7 @@ class IfrArray (object):
   def __init__(self,ns,station_list,station_index=None,uvw_table=None,
                observatory=None,
                ms_uvw=None,mirror_uvw=None,include_uvw_deriv=False,
-               prefer_baseline_uvw=None,
+               prefer_baseline_uvw=None,ms_uvw_table=None,
                resamplers=False,positions=None):
     """Creates an IfrArray object, representing an interferometer array.
     'station_list' is a list of station IDs, not necessarily numeric.
@@ -86,6 +90,9 @@ class IfrArray (object):
     'prefer_baseline_uvw': if True, and ms_uvw is set, 
       creates spigots for reading UWVs of all baselines, rather than just the necessary 
       ones for antenna-based UVWs.
+    'ms_uvw_table': if True, and ms_uvw is set, UVWs are looked up in a cached table of station
+      UVWs (see Meow.MSUtils.get_uvw_table()) by a single node for the whole array, rather than
+      read via spigots. If None, uses the global uvw_source TDLOption (when ms_uvw is None as well).
     'mirror_uvw' only applicable if UVWs are being computed. If True, uses the VLA
       UVW sign definition, if False, uses the WSRT one.
     'resamplers': if True (and ms_uvw=True), Resampler nodes will be put on the UVWs.
@@ -97,7 +104,9 @@ class IfrArray (object):
     self.observatory = observatory;
     # select UVW options
     if ms_uvw is None:
-      ms_uvw = (uvw_source == _uvw_from_ms);
+      ms_uvw = uvw_source in (_uvw_from_ms,_uvw_from_ms_table);
+      if ms_uvw_table is None:
+        ms_uvw_table = (uvw_source == _uvw_from_ms_table);
       if not ms_uvw:
         mirror_uvw = (uvw_source == _uvw_compute_mirror);
     # make list of station pairs: (0,p0),(1,p1),... etc.
@@ -116,6 +125,7 @@ class IfrArray (object):
     self._uvw_table = uvw_table;
     self._ms_uvw = ms_uvw;
     self._prefer_baseline_uvw = prefer_baseline_uvw;
+    self._ms_uvw_table = ms_uvw_table;
     self._mirror_uvw = mirror_uvw;
     self._include_uvw_deriv = include_uvw_deriv;
     self._resamplers = resamplers;
@@ -266,7 +276,18 @@ class IfrArray (object):
     else:
       uvw = self.ns.uvw;
     if not uvw(self.stations()[0]).initialized():
-      if self._ms_uvw:
+      # the UVW table has no derivatives, so fall back to spigots if these are needed
+      if self._ms_uvw and self._ms_uvw_table and not self._include_uvw_deriv:
+        # the spigot path derives station UVWs from the reference antenna's baselines too, so it is no
+        # better for stations that have none: just warn about these
+        missing = self._uvw_table_missing();
+        if missing:
+          print "WARNING: station(s) %s have no baseline to the UVW reference antenna, their UVWs will be 0"%",".join(map(str,missing));
+        uvwT = self._uvw_table_node(self.ns.uvw_table.qadd(radec0) if dir0 is not None else self.ns.uvw_table,
+                                    station_index=[ ip for ip,p in self.station_index() ]);
+        for i,p in enumerate(self.stations()):
+          uvw(p) << Meq.Selector(uvwT,index=range(3*i,3*i+3),multi=True);
+      elif self._ms_uvw:
         # read UVWs from MS
         # if baseline UVWs preferred, create spigots for all of them
         if self._prefer_baseline_uvw:
@@ -275,14 +296,7 @@ class IfrArray (object):
             uvw_ifr(p,q) << Meq.Spigot(station_1_index=ip,station_2_index=iq,
                             input_col='UVW',include_deriv=self._include_uvw_deriv);
         # find the reference station
-        if uvw_refant is UVW_REFANT_DEFAULT:
-          ip0,p0 = self.station_index()[0];
-        else:
-          try:
-            num = self.stations().index(uvw_refant);
-          except:
-            raise ValueError,"reference antenna '%s' not found"%uvw_refant;
-          ip0,p0 = self.station_index()[num];
+        ip0,p0 = self._uvw_refant();
         # reference station gets (0,0,0), the rest is via subtraction
         if self._include_uvw_deriv:
           uvw(p0) << Meq.Constant([0,0,0,0,0,0],dims=[2,3]);
@@ -331,6 +345,38 @@ class IfrArray (object):
             uvw(station) << uvw_def;
     return uvw(*quals);
 
+  def _uvw_refant (self):
+    """Helper method, returns (index,name) of reference station for UVWs read from the MS""";
+    if uvw_refant is UVW_REFANT_DEFAULT:
+      return self.station_index()[0];
+    try:
+      num = self.stations().index(uvw_refant);
+    except:
+      raise ValueError,"reference antenna '%s' not found"%uvw_refant;
+    return self.station_index()[num];
+
+  def _uvw_table_selection (self):
+    """Helper method, returns (msname,refant,ddid,field) for the station UVW table of the currently selected MS""";
+    mssel = Context.mssel;
+    if mssel is None or not mssel.msname:
+      raise RuntimeError,"UVWs can only be read via a cached table when an MS is selected";
+    return mssel.msname,self._uvw_refant()[0],mssel.ddid_index,mssel.field_index;
+
+  def _uvw_table_missing (self):
+    """Helper method, returns list of our stations whose UVWs can't be looked up in the station UVW table,
+    because they never form a baseline with the reference antenna. Makes the table if needed.""";
+    import MSUtils
+    missing = set(MSUtils.get_uvw_table(*self._uvw_table_selection())[2]);
+    return [ p for ip,p in self.station_index() if ip in missing ];
+
+  def _uvw_table_node (self,node,**kw):
+    """Helper method, makes a UVWTableNode (serving UVWs of the currently selected MS) under the given name""";
+    import UVWTableNode
+    msname,refant,ddid,field = self._uvw_table_selection();
+    node << Meq.PyNode(class_name="UVWTableNode",module_name=UVWTableNode.__file__,
+                       ms_name=msname,refant=refant,ddid=ddid,field=field,**kw);
+    return node;
+
   def uvw_ifr (self,dir0=None,*quals):
     """returns interferometer UVW node(s) for a given phase centre direction,
     or using the global phase center if None is given.
@@ -339,7 +385,14 @@ class IfrArray (object):
     radec0 = dir0.radec()
     uvw_ifr = self.ns.uvw_ifr.qadd(radec0)
     if not uvw_ifr(*(self.ifrs()[0])).initialized():
-      if self._ms_uvw:
+      # baseline UVWs can't be derived from the table for stations with no baseline to the reference antenna,
+      # so read them via spigots instead
+      if self._ms_uvw and self._ms_uvw_table and not self._include_uvw_deriv and not self._uvw_table_missing():
+        uvwT = self._uvw_table_node(self.ns.uvw_ifr_table.qadd(radec0),
+                                    ifr_index=[ (ip,iq) for (ip,p),(iq,q) in self.ifr_index() ]);
+        for i,ifr in enumerate(self.ifrs()):
+          uvw_ifr(*ifr) << Meq.Selector(uvwT,index=range(3*i,3*i+3),multi=True);
+      elif self._ms_uvw:
         for (ip,p),(iq,q) in self.ifr_index():
           uvw_ifr(p,q) << Meq.Spigot(station_1_index=ip,station_2_index=iq,input_col='UVW',include_deriv=self._include_uvw_deriv)
       else:
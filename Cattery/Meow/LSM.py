@@ -29,12 +29,16 @@
 
 from Timba.TDL import *
 from Cattery.LSM.LSM import LSM as LSMClass
+from Cattery.LSM.LSM_columns import SourceColumns,punit_row
+from Cattery.LSM.common_utils import PATCH_TYPE
 from Timba.utils import curry
 import traceback
 import Meow
 import Meow.OptionTools
 import Meow.Context
+from Meow.Direction import radec_to_lmn
 import math
+import numpy
 from math import *
 
 # constants for available LSM formats
@@ -49,6 +53,19 @@ VIZIER = "VizieR file";
 OR_GSM = "OR_GSM file";
 SKA = "SKA model catalog file";
 
+# namespace for evaluating beam expressions on arrays: math functions are replaced by their
+# numpy equivalents where these exist, min/max become element-wise
+_array_beam_namespace = dict(vars(math));
+_array_beam_namespace.update([ (name,getattr(numpy,name)) for name in dir(math) if hasattr(numpy,name) ]);
+_array_beam_namespace.update(asin=numpy.arcsin,acos=numpy.arccos,atan=numpy.arctan,atan2=numpy.arctan2,
+                             pow=numpy.power,min=numpy.minimum,max=numpy.maximum,abs=numpy.abs);
+
+# source_columns() columns, and the LSM source table fields they are read from. The first 12 are in
+# getEssentialParms()+getExtParms() order
+_SOURCE_COLUMNS = [ ('ra','ra'),('dec','dec'),('I','I'),('Q','Q'),('U','U'),('V','V'),
+                    ('spi','spi'),('freq0','f0'),('RM','RM'),('eX','eX'),('eY','eY'),('eP','eP'),
+                    ('l','l'),('m','m') ];
+
 class MeowLSM (object):
   def __init__ (self,filename=None,format=NATIVE,include_options=True,option_namespace='lsm'):
     """Initializes a MeowLSM object.
@@ -122,6 +139,14 @@ class MeowLSM (object):
       self._subset_parser = Meow.OptionTools.ListOptionParser(minval=0,name="source");
       subset_opt.set_validator(self._subset_parser.validator);
       self._compile_opts.append(subset_opt);
+      self._compile_opts.append(
+        TDLOption('min_flux',"Skip sources with apparent flux below",[None],more=float,namespace=self,
+          doc="""<P>If set, sources with an apparent flux (see "Primary beam expression" above) below this
+          value are not included in the model.</P>"""));
+      self._compile_opts.append(
+        TDLOption('max_radius',"Skip sources further from phase centre than (deg)",[None],more=float,namespace=self,
+          doc="""<P>If set, sources further than this from the phase centre are not included in the model.
+          Use this to limit a wide-field model to the primary beam.</P>"""));
       solve_subset_opt = TDLOption("solve_subset","For which sources",["all"],
             more=str,namespace=self,doc=subset_doc);
       self._solve_subset_parser = Meow.OptionTools.ListOptionParser(minval=0,name="source");
@@ -170,7 +195,8 @@ class MeowLSM (object):
     filename = filename or self.filename;
     format = format or self.format;
 
-    self.lsm = LSMClass();
+    # a columnar LSM, so that catalog readers can add sources in bulk
+    self.lsm = LSMClass(columnar=True);
 
     # set up table of format readers
     # all are expected to take an lsm object (e.g. self) as arg 1,
@@ -207,6 +233,91 @@ class MeowLSM (object):
 #    if self.show_gui:
 #      self.lsm.display()
 
+  def source_columns (self,ns):
+    """Reads LSM and returns a dict of per-source columns for the point and extended sources,
+    in LSM brightness order. 'name' is a list, 'ra', 'dec', 'I', 'Q', 'U', 'V', 'spi', 'freq0', 'RM',
+    'eX', 'eY', 'eP', 'l' and 'm' are float arrays (l,m is NaN where a source has no beam l,m).
+    'objects' is the set of names whose parameters must be read from their PUnit (see source_parms()).
+    For a columnar LSM, this reads the LSM's source table directly, without making any PUnits.
+    """;
+    if self.lsm is None:
+      self.load(ns);
+    if self.lsm.columns is not None:
+      table = self.lsm.columns;
+      data = table.data();
+      data = data[table.source_mask()&(data['patch']<0)];
+      # PUnits that already exist may have been changed, and sixpacks made of nodes have no column values
+      objects = set([ name for name in data['name'] if self.lsm.p_table.is_materialized(name)
+                                                    or name in self.lsm._node_sixpacks ]);
+    else:
+      table = SourceColumns();
+      for pu in self.lsm.p_table.itervalues():
+        if pu.getType() != PATCH_TYPE and pu._patch_name is None:
+          table.append(pu.name,**punit_row(pu));
+      data = table.data();
+      objects = set(data['name']);
+    # stable sort, so that sources of equal brightness keep their table order
+    data = data[numpy.argsort(-data['brightness'],kind='mergesort')];
+    columns = dict(name=data['name'].tolist(),objects=objects);
+    for col,field in _SOURCE_COLUMNS:
+      columns[col] = data[field].astype(float);
+    return columns;
+
+  def source_parms (self,ns,columns,isrc):
+    """Returns the getEssentialParms()+getExtParms() tuple of source #isrc of the given columns. This is read
+    from the columns, unless the source is in columns['objects'], in which case its PUnit is used.""";
+    name = columns['name'][isrc];
+    if name in columns['objects']:
+      pu = self.lsm.p_table[name];
+      return tuple(pu.getEssentialParms(ns))+tuple(pu.getExtParms());
+    return tuple([ float(columns[col][isrc]) for col,field in _SOURCE_COLUMNS[:12] ]);
+
+  def query_cone (self,ns,ra,dec,radius,min_brightness=None):
+    """Reads LSM and returns names of sources (PUnits) within 'radius' of ra,dec (all in radians),
+    in LSM brightness order. Uses the spatial index of the LSM.""";
+    if self.lsm is None:
+      self.load(ns);
+    return self.lsm.getSpatialIndex().cone(ra,dec,radius,min_brightness);
+
+  def query_box (self,ns,min_ra,max_ra,min_dec,max_dec,min_brightness=None):
+    """Reads LSM and returns names of sources (PUnits) in the given RA/Dec box (radians), in LSM
+    brightness order. If min_ra>max_ra, the box wraps around RA=0.""";
+    if self.lsm is None:
+      self.load(ns);
+    return self.lsm.getSpatialIndex().box(min_ra,max_ra,min_dec,max_dec,min_brightness);
+
+  def query_nearest (self,ns,ra,dec,k=1,min_brightness=None):
+    """Reads LSM and returns names of the k sources (PUnits) nearest to ra,dec (radians), nearest first.""";
+    if self.lsm is None:
+      self.load(ns);
+    return self.lsm.getSpatialIndex().nearest(ra,dec,k,min_brightness);
+
+  def apparent_flux (self,columns):
+    """Returns array of apparent fluxes for the given source columns, as per the beam expression.
+    If there is no beam expression, or the phase centre is not static, intrinsic fluxes are returned.""";
+    I = columns['I'];
+    if self.beam_expr is None or self.solve_pos or not len(I):
+      return I;
+    try:
+      beam_func = eval("lambda r,fq:"+self.beam_expr);
+      array_beam_func = eval("lambda r,fq:"+self.beam_expr,_array_beam_namespace);
+    except:
+      raise RuntimeError,"invalid beam expression";
+    radec0 = Meow.Context.get_dir0(None).radec_static();
+    if radec0 is None:
+      return I;
+    ra0,dec0 = radec0;
+    ra,dec = columns['ra'],columns['dec'];
+    l,m,n = radec_to_lmn(ra,dec,ra0,dec0);
+    r = numpy.sqrt(l**2+m**2);
+    fq = numpy.where(columns['freq0'] != 0,columns['freq0']*1e-9,1.4);  # use 1.4 GHz if ref frequency not specified
+    # evaluate on arrays, falling back to a per-source evaluation if the expression can't handle them
+    try:
+      beam = numpy.zeros_like(I) + array_beam_func(r,fq);
+    except:
+      beam = numpy.array([ beam_func(r1,fq1) for r1,fq1 in zip(r,fq) ]);
+    return I*beam;
+
   def source_list (self,ns,max_sources=None,**kw):
     """Reads LSM and returns a list of Meow objects.
     ns is node scope in which they will be created.
@@ -214,53 +325,45 @@ class MeowLSM (object):
     created as Parms, use e.g. I=Meow.Parm(tags="flux") for this.
     The use_parms option may override this.
     """;
+    return list(self.iter_sources(ns,max_sources=max_sources,**kw));
+
+  def iter_sources (self,ns,max_sources=None,**kw):
+    """Generator version of source_list(): yields Meow objects one by one, in order of
+    decreasing apparent flux. The subset and flux cut options are applied to the source
+    columns, so Meow objects are only made for sources that are actually used. If
+    max_sources is given, at most that many are made.
+    """;
     if self.filename is None:
-      return [];
-    if self.lsm is None:
-      self.load(ns);
-    # all=1 returns unsorted list, so use a large count instead, to get a sorted list
-    plist = self.lsm.queryLSM(count=9999999);
-    
-    # parse the beam expression
-    if self.beam_expr is not None:
-      try:
-        beam_func = eval("lambda r,fq:"+self.beam_expr);
-      except:
-        raise RuntimeError,"invalid beam expression";
-    else:
-      beam_func = None;
-    
-    # make list of direction,punit,I,I_apparent tuples
-    parm = Meow.Parm(tags="source solvable");
-    srclist = [];
-    for pu in plist:
-      ra,dec,I,Q,U,V,spi,freq0,RM = pu.getEssentialParms(ns);
-      if self.solve_pos:
-        ra = parm.new(ra);
-        dec = parm.new(dec);
-      direction = Meow.Direction(ns,pu.name,ra,dec,static=not self.solve_pos);
-      Iapp = I;
-      if beam_func is not None:
-      # if phase centre is already set (i.e. static), then lmn will be computed here, and we
-      # can apply a beam expression
-        lmn = direction.lmn_static();
-        if lmn is not None:
-          r = sqrt(lmn[0]**2+lmn[1]**2);
-          Iapp = I*beam_func(r,freq0*1e-9 or 1.4);  # use 1.4 GHz if ref frequency not specified
-      # append to list
-      srclist.append((pu.name,direction,pu,I,Iapp));
-    # sort list by decreasing apparent flux
-    srclist.sort(lambda a,b:cmp(b[4],a[4]));
-    
-    srclist_full = srclist;
-    # extract active subset
-    srclist = self._subset_parser.apply(self.lsm_subset,srclist_full,names=[src[0] for src in srclist_full]);
+      return;
+    columns = self.source_columns(ns);
+    nsrc = len(columns['name']);
+    if not nsrc:
+      return;
+    Iapp = self.apparent_flux(columns);
+    # sort by decreasing apparent flux. Mergesort is stable, so equal fluxes keep their LSM order
+    order = numpy.argsort(-Iapp,kind='mergesort');
+    names = [ columns['name'][i] for i in order ];
+    # extract active subset (as indices into the sorted list)
+    selected = self._subset_parser.apply(self.lsm_subset,range(nsrc),names=names);
+    min_flux = getattr(self,'min_flux',None);
+    if min_flux is not None:
+      bright = Iapp[order] >= min_flux;
+      selected = [ i for i in selected if bright[i] ];
+    max_radius = getattr(self,'max_radius',None);
+    if max_radius is not None:
+      radec0 = Meow.Context.get_dir0(None).radec_static();
+      if radec0 is not None:
+        inside = set(self.query_cone(ns,radec0[0],radec0[1],max_radius*math.pi/180));
+        selected = [ i for i in selected if names[i] in inside ];
+    if max_sources is not None:
+      selected = selected[:max_sources];
     # extract solvable subset
-    solve_subset = self._subset_parser.apply(self.solve_subset,srclist_full,names=[src[0] for src in srclist_full]);
-    solve_subset = set([src[0] for src in solve_subset]);
+    solve_subset = self._subset_parser.apply(self.solve_subset,range(nsrc),names=names);
+    solve_subset = set([ names[i] for i in solve_subset ]);
 
     # make copy of kw dict to be used for sources not in solvable set
     kw_nonsolve = dict(kw);
+    parm = Meow.Parm(tags="source solvable");
     # and update kw dict to be used for sources in solvable set
     if self.solvable_sources:
       if self.solve_I:
@@ -283,19 +386,21 @@ class MeowLSM (object):
         kw.setdefault("sy",parm);
         kw.setdefault("phi",parm);
 
-    # make Meow list
-    source_model = []
-
   ## Note: conversion from AIPS++ componentlist Gaussians to Gaussian Nodes
   ### eX, eY : multiply by 2
   ### eP: change sign
-    for name,direction,pu,I,Iapp in srclist:
-#      print "%-20s %12f %12f"%(pu.name,I,Iapp);
+    for i in selected:
+      isrc = order[i];
+      name = columns['name'][isrc];
       src = {};
       ( src['ra'],src['dec'],
         src['I'],src['Q'],src['U'],src['V'],
-        src['spi'],src['freq0'],src['RM']    ) = pu.getEssentialParms(ns)
-      (eX,eY,eP) = pu.getExtParms()
+        src['spi'],src['freq0'],src['RM'],eX,eY,eP ) = self.source_parms(ns,columns,isrc);
+      ra,dec = src['ra'],src['dec'];
+      if self.solve_pos:
+        ra = parm.new(ra);
+        dec = parm.new(dec);
+      direction = Meow.Direction(ns,name,ra,dec,static=not self.solve_pos);
       # scale 2 difference
       src['sx'] = eX*2
       src['sy'] = eY*2
@@ -329,24 +434,21 @@ class MeowLSM (object):
           size,phi = [src['sx'],src['sy']],src['phi'];
         else:
           size,phi = src['sx'],None;
-        src = Meow.GaussianSource(ns,name=pu.name,
+        src = Meow.GaussianSource(ns,name=name,
                 I=src['I'],Q=src['Q'],U=src['U'],V=src['V'],
                 direction=direction,
                 spi=src['spi'],freq0=src['freq0'],RM=src['RM'],
                 size=size,phi=phi);
       else:
-        src = Meow.PointSource(ns,name=pu.name,
+        src = Meow.PointSource(ns,name=name,
                 I=src['I'],Q=src['Q'],U=src['U'],V=src['V'],
                 direction=direction,
                 spi=src['spi'],freq0=src['freq0'],RM=src['RM']);
                 
       # check for beam LM
-      if pu._lm is not None:
-        src.set_attr('beam_lm',pu._lm);
+      if not numpy.isnan(columns['l'][isrc]):
+        src.set_attr('beam_lm',(float(columns['l'][isrc]),float(columns['m'][isrc])));
               
       src.solvable = solvable;
-      src.set_attr('Iapp',Iapp);
-      source_model.append(src);
-      
-    return source_model;
-
+      src.set_attr('Iapp',float(Iapp[isrc]));
+      yield src;
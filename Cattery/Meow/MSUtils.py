@@ -37,6 +37,8 @@ import os
 import os.path
 import math
 import fnmatch
+import cPickle
+import numpy
 
 _addImagingColumns = None;
 # figure out which table implementation to use -- try pyrap/casacore first
@@ -138,6 +140,374 @@ def longest_prefix (*strings):
         return s1[:i];
   return strings[0];
 
+# subtables snapshotted by MSMetadata
+METADATA_SUBTABLES = [ "ANTENNA","DATA_DESCRIPTION","SPECTRAL_WINDOW","FIELD","POLARIZATION","OBSERVATION" ];
+
+def _table_mtime (path,files=None):
+  """helper function, returns the latest modification time of a table's files (ignoring the lock file),
+  or 0 if not available. If 'files' is given, only these files are checked.""";
+  try:
+    files = files or [ f for f in os.listdir(path) if f.startswith("table.") and f != "table.lock" ];
+    return max([ os.path.getmtime(os.path.join(path,f)) for f in files ] or [0]);
+  except OSError:
+    return 0;
+
+class MSMetadata (object):
+  """MSMetadata is a snapshot of the MS metadata used by MSSelector and MSContentSelector: data columns,
+  antenna names and positions, observatory, spectral windows, fields and correlation types, plus
+  UVW extrema (see uvw_stats()). Use get_ms_metadata() rather than creating one directly:
+  snapshots are cached in-process and on disk, keyed by the MS path and table modification times,
+  so the subtables only need to be read once.""";
+  # bump this when attributes change, to invalidate older on-disk caches
+  version = 2;
+  # name of on-disk cache file, inside the MS directory
+  cache_filename = "MeqTrees.metadata.cache";
+
+  def __init__ (self,msname,ms=None):
+    self.msname = msname;
+    self.cache_version = self.version;
+    self.fingerprint = self.get_fingerprint(msname);
+    ms = ms or TABLE(msname,lockoptions='autonoread');
+    self.nrows = ms.nrows();
+    self.data_columns = [ name for name in ms.colnames() if name.endswith('DATA') ];
+    # antennas
+    anttable = TABLE(ms.getkeyword('ANTENNA'),lockoptions='autonoread');
+    self.num_antennas = anttable.nrows();
+    self.antenna_names = list(anttable.getcol('NAME'));
+    self.antenna_positions = anttable.getcol('POSITION');
+    anttable.close();
+    # observatory is from observation subtable
+    try:
+      self.observatory = TABLE(ms.getkeyword("OBSERVATION"),lockoptions='autonoread').getcol("TELESCOPE_NAME")[0];
+    except:
+      self.observatory = None;
+    # DDIDs
+    ddid_tab = TABLE(ms.getkeyword('DATA_DESCRIPTION'),lockoptions='autonoread');
+    self.ddid_spws = list(ddid_tab.getcol('SPECTRAL_WINDOW_ID'));
+    self.ddid_polarization_ids = list(ddid_tab.getcol('POLARIZATION_ID'));
+    ddid_tab.close();
+    # channels per spectral window
+    self.spw_numchannels = list(TABLE(ms.getkeyword('SPECTRAL_WINDOW'),lockoptions='autonoread').getcol('NUM_CHAN'));
+    # fields
+    field = TABLE(ms.getkeyword('FIELD'),lockoptions='autonoread');
+    self.field_names = list(field.getcol('NAME'));
+    self.field_phase_dir = field.getcol('PHASE_DIR');
+    field.close();
+    # correlation type enums for each row of polarization table
+    pol_tab = TABLE(ms.getkeyword('POLARIZATION'),lockoptions='autonoread');
+    self.corr_types = [ list(pol_tab.getcol('CORR_TYPE',pol_id,1)[0]) for pol_id in range(pol_tab.nrows()) ];
+    pol_tab.close();
+
+  @staticmethod
+  def get_fingerprint (msname):
+    """Returns a tuple of modification times identifying the state of the MS. The main table is
+    represented by its table.dat only, so writing to data columns does not invalidate the snapshot.""";
+    return tuple([ _table_mtime(msname,["table.dat"]) ] +
+                 [ _table_mtime(os.path.join(msname,subtable)) for subtable in METADATA_SUBTABLES ]);
+
+  @staticmethod
+  def load (msname):
+    """Loads snapshot from on-disk cache. Returns None if n/a or out of date.""";
+    cachefile = os.path.join(msname,MSMetadata.cache_filename);
+    if not os.path.exists(cachefile):
+      return None;
+    try:
+      meta = cPickle.load(file(cachefile));
+    except:
+      Meow.dprint("  Meow.MSUtils: error reading %s, ignoring"%cachefile);
+      return None;
+    if getattr(meta,'cache_version',None) != MSMetadata.version or \
+       meta.fingerprint != MSMetadata.get_fingerprint(msname):
+      return None;
+    meta.msname = msname;
+    return meta;
+
+  def save (self):
+    """Saves snapshot to on-disk cache. Failures (e.g. read-only MS) are not fatal.""";
+    try:
+      cPickle.dump(self,file(os.path.join(self.msname,self.cache_filename),"w"),cPickle.HIGHEST_PROTOCOL);
+    except:
+      Meow.dprint("  Meow.MSUtils: can't write metadata cache for %s, ignoring"%self.msname);
+
+  def uvw_stats (self):
+    """Returns tuple of uvw_min,uvw_max,ifr_max_abs_w, where uvw_min and uvw_max are (u,v,w) arrays of per-component
+    extrema, and ifr_max_abs_w is a dict of (ant1,ant2):max_abs_w. These come from get_column_stats(), so
+    are computed on first use, and then cached.""";
+    stats = get_column_stats(self.msname,"UVW",group_by=("ANTENNA1","ANTENNA2"));
+    if not stats.nrows:
+      return numpy.zeros(3),numpy.zeros(3),{};
+    return stats.min,stats.max,dict([ (key,float(gabsmax[2])) for key,(gmin,gmax,gabsmax) in stats.groups.iteritems() ]);
+
+  def max_abs_w (self,ifrs=None):
+    """Returns max |w| over the given list of (ip,iq) antenna number pairs, or over the whole MS if None""";
+    uvw_min,uvw_max,ifr_max_abs_w = self.uvw_stats();
+    if ifrs is None:
+      return max(abs(uvw_min[2]),abs(uvw_max[2]));
+    return max([ max(ifr_max_abs_w.get((ip,iq),0),ifr_max_abs_w.get((iq,ip),0)) for ip,iq in ifrs ] or [0]);
+
+# in-process cache of MSMetadata objects, keyed by MS path
+_ms_metadata = {};
+
+def get_ms_metadata (msname,ms=None):
+  """Returns an MSMetadata snapshot for the given MS. This comes from the in-process cache if up to date,
+  else from the on-disk cache if up to date, else the MS is read (and the snapshot is cached).
+  'ms' may be given as an already-open table object, to avoid reopening the MS.""";
+  path = os.path.realpath(msname);
+  meta = _ms_metadata.get(path);
+  if meta is None or meta.fingerprint != MSMetadata.get_fingerprint(path):
+    meta = MSMetadata.load(path);
+    if meta is None:
+      Meow.dprint("  Meow.MSUtils: reading metadata for %s"%msname,2);
+      meta = MSMetadata(path,ms);
+      meta.save();
+    _ms_metadata[path] = meta;
+  return meta;
+
+# max size of column chunks read in by get_column_stats(), in bytes
+column_stats_chunk_size = 64*1024*1024;
+
+class ColumnStats (object):
+  """ColumnStats holds statistics of an MS column, as computed by get_column_stats().
+  'min', 'max' and 'absmax' are per-element extrema, i.e. have the shape of a single cell (so for
+  UVW, stats.max[2] is the max w). If histogram bins were requested, 'histogram' and 'bin_edges'
+  are as returned by numpy.histogram() over all elements of the column. If grouping columns were given,
+  'groups' is a dict of key:(min,max,absmax), where key is a tuple of grouping column values.""";
+  def __init__ (self,column,bins=None,range=None):
+    self.column = column;
+    self.nrows = 0;
+    self.min = self.max = self.absmax = None;
+    self.groups = {};
+    if bins:
+      self.bin_edges = numpy.linspace(range[0],range[1],bins+1);
+      self.histogram = numpy.zeros(bins,int);
+    else:
+      self.bin_edges = self.histogram = None;
+
+  def update (self,data,keys=None):
+    """Accumulates statistics over a chunk of rows. 'keys' is a list of grouping column chunks, or None.""";
+    if not len(data):
+      return;
+    self.nrows += len(data);
+    absdata = abs(data);
+    cmin,cmax,cabsmax = data.min(0),data.max(0),absdata.max(0);
+    if self.min is None:
+      self.min,self.max,self.absmax = cmin,cmax,cabsmax;
+    else:
+      self.min = numpy.minimum(self.min,cmin);
+      self.max = numpy.maximum(self.max,cmax);
+      self.absmax = numpy.maximum(self.absmax,cabsmax);
+    if self.histogram is not None:
+      self.histogram += numpy.histogram(data,self.bin_edges)[0];
+    if keys:
+      # sort rows by group, and reduce over each run of the same key
+      keys = numpy.rec.fromarrays(keys);
+      uniq,inverse = numpy.unique(keys,return_inverse=True);
+      order = numpy.argsort(inverse,kind='mergesort');
+      starts = numpy.searchsorted(inverse[order],numpy.arange(len(uniq)));
+      gmin = numpy.minimum.reduceat(data[order],starts,axis=0);
+      gmax = numpy.maximum.reduceat(data[order],starts,axis=0);
+      gabsmax = numpy.maximum.reduceat(absdata[order],starts,axis=0);
+      for i,key in enumerate(uniq.tolist()):
+        stats = self.groups.get(key);
+        if stats is None:
+          self.groups[key] = gmin[i],gmax[i],gabsmax[i];
+        else:
+          self.groups[key] = numpy.minimum(stats[0],gmin[i]),numpy.maximum(stats[1],gmax[i]), \
+                             numpy.maximum(stats[2],gabsmax[i]);
+
+def _column_mtime (ms,msname,columns):
+  """helper function, returns latest modification time of the files holding the given columns (plus the table.dat
+  of the table itself), so that writing to other columns does not change it.
+  Falls back to the modification time of the whole table if storage manager info is not available.""";
+  try:
+    files = set(["table.dat"]);
+    for column in columns:
+      prefix = "table.f%d"%ms.getdminfo(column)['SEQNR'];
+      files.update([ f for f in os.listdir(msname) if f == prefix or f.startswith(prefix+"_") ]);
+    return _table_mtime(msname,list(files));
+  except:
+    return _table_mtime(msname);
+
+# in-process cache of ColumnStats objects, keyed by (MS path,column,group_by,bins,range)
+_column_stats = {};
+# name of on-disk cache file, inside the MS directory
+COLUMN_STATS_CACHE = "MeqTrees.colstats.cache";
+
+def get_column_stats (msname,column,group_by=(),bins=None,range=None,chunk_size=None):
+  """Returns a ColumnStats object with statistics of the given MS column, computed in a single pass
+  that reads the column in chunks of at most 'chunk_size' bytes (default is column_stats_chunk_size),
+  so memory use is bounded no matter how big the MS is.
+  'group_by' is a list of columns (e.g. ("ANTENNA1","ANTENNA2")) to compute per-group extrema over.
+  If 'bins' is given, a histogram is also computed. Its 'range' defaults to the column's [min,max]
+  (which costs an extra pass the first time around.)
+  Results are cached in-process and on disk (in the MS directory), keyed by the modification time of
+  the files holding the columns.""";
+  path = os.path.realpath(msname);
+  group_by = tuple(group_by);
+  if bins and range is None:
+    stats = get_column_stats(path,column,chunk_size=chunk_size);
+    range = (stats.min.min(),stats.max.max()) if stats.nrows else (0,1);
+  key = (path,column,group_by,bins,range and tuple(range));
+  ms = TABLE(path,lockoptions='autonoread');
+  try:
+    mtime = _column_mtime(ms,path,(column,)+group_by);
+    # check in-process cache, then disk cache
+    cachefile = os.path.join(path,COLUMN_STATS_CACHE);
+    if key not in _column_stats and os.path.exists(cachefile):
+      try:
+        for key1,entry in cPickle.load(file(cachefile)).iteritems():
+          _column_stats.setdefault(key1,entry);
+      except:
+        Meow.dprint("  Meow.MSUtils: error reading %s, ignoring"%cachefile);
+    entry = _column_stats.get(key);
+    if entry and entry[0] == mtime:
+      return entry[1];
+    # read column in chunks
+    Meow.dprint("  Meow.MSUtils: computing stats for column %s of %s"%(column,msname),2);
+    stats = ColumnStats(column,bins,range);
+    nrows = ms.nrows();
+    if nrows:
+      rowsize = numpy.asarray(ms.getcell(column,0)).nbytes + 8*len(group_by);
+      chunk = max((chunk_size or column_stats_chunk_size)//max(rowsize,1),1);
+      for row0 in xrange(0,nrows,chunk):
+        nr = min(chunk,nrows-row0);
+        stats.update(ms.getcol(column,row0,nr),[ ms.getcol(col,row0,nr) for col in group_by ]);
+  finally:
+    ms.close();
+  _column_stats[key] = mtime,stats;
+  # write out disk cache (entries for this MS only)
+  try:
+    cPickle.dump(dict([ (key1,entry) for key1,entry in _column_stats.iteritems() if key1[0] == path ]),
+                 file(cachefile,"w"),cPickle.HIGHEST_PROTOCOL);
+  except:
+    Meow.dprint("  Meow.MSUtils: can't write column stats cache for %s, ignoring"%msname);
+  return stats;
+
+# name of on-disk station UVW table files, inside the MS directory (formatted with the reference antenna number,
+# plus the DDID and field suffixes below if the table is for a subset of the MS)
+UVW_TABLE_CACHE = "MeqTrees.uvw-ref%d";
+UVW_TABLE_DDID_SUFFIX = "-ddid%d";
+UVW_TABLE_FIELD_SUFFIX = "-field%d";
+# bump this when the table layout changes, to invalidate older on-disk tables
+UVW_TABLE_VERSION = 2;
+# in-process cache of station UVW tables, keyed by (MS path,refant,ddid,field)
+_uvw_tables = {};
+
+def _dprint (msg,level=1):
+  """helper function, prints via Meow.dprint() if available. This is not defined on the kernel side,
+  where UVWTableNode may call get_uvw_table(), so there we only print level-0 messages""";
+  dprint = getattr(Meow,'dprint',None);
+  if dprint:
+    dprint(msg,level);
+  elif level <= 0:
+    print msg;
+
+def add_refant_baselines (uvw,valid,itime,a1,a2,data,refant):
+  """Fills in station UVWs from a chunk of MS rows. 'uvw' is a [ntime,nant,3] table of UVWs relative
+  to antenna 'refant', and 'valid' is a [ntime,nant] boolean array marking its filled-in entries.
+  'itime' gives the timeslot (row index into the table) of each MS row, 'a1', 'a2' and 'data' are the
+  ANTENNA1, ANTENNA2 and UVW columns. Only baselines to refant are used.""";
+  # refant-q baselines give uvw(q) directly, p-refant baselines give -uvw(p)
+  for sel,ant,sign in ((a1==refant)&(a2!=refant),a2,1),((a2==refant)&(a1!=refant),a1,-1):
+    uvw[itime[sel],ant[sel]] = sign*data[sel];
+    valid[itime[sel],ant[sel]] = True;
+
+def fill_uvw_gaps (times,uvw,valid):
+  """Fills in entries of a station UVW table that are not marked as valid, by interpolating in time.
+  Returns list of antennas with no valid entries at all (i.e. ones that never form a baseline with the
+  reference antenna), whose UVWs are left at (0,0,0).""";
+  missing = [];
+  for ant in range(uvw.shape[1]):
+    ok = valid[:,ant];
+    if not ok.any():
+      missing.append(ant);
+    elif not ok.all():
+      for i in range(3):
+        uvw[~ok,ant,i] = numpy.interp(times[~ok],times[ok],uvw[ok,ant,i]);
+  return missing;
+
+def get_uvw_table (msname,refant=0,ddid=None,field=None,chunk_size=None):
+  """Returns station UVWs for the MS, as a tuple of (times,uvw,missing). 'times' is the sorted array of
+  timeslots, and 'uvw' is a [ntime,nant,3] array of UVWs relative to antenna number 'refant' (which gets
+  (0,0,0)), so that the UVW of baseline p-q is uvw[:,q]-uvw[:,p]. Antennas that have no baseline to
+  refant in some timeslot are interpolated in time. 'missing' is a list of antennas that have no baseline
+  to refant at all: their UVWs cannot be derived from the table, and are left at (0,0,0).
+  If 'ddid' and/or 'field' is given, only rows with that DATA_DESC_ID and/or FIELD_ID are used.
+  The table is derived from the UVW column in a single pass over chunks of at most 'chunk_size' bytes
+  (default is column_stats_chunk_size), and saved as .npy files inside the MS (keyed by the modification
+  time of the columns involved), which are then memory-mapped, so looking up a tile's worth of UVWs is
+  a cheap slice. If the MS is not writable, the table is kept in memory.""";
+  path = os.path.realpath(msname);
+  key = (path,refant,ddid,field);
+  columns = ("TIME","ANTENNA1","ANTENNA2","UVW");
+  selcolumns = [ (col,value) for col,value in (("DATA_DESC_ID",ddid),("FIELD_ID",field)) if value is not None ];
+  ms = TABLE(path,lockoptions='autonoread');
+  try:
+    mtime = _column_mtime(ms,path,columns+tuple([ col for col,value in selcolumns ]));
+    entry = _uvw_tables.get(key);
+    if entry and entry[0] == mtime:
+      return entry[1];
+    basename = os.path.join(path,UVW_TABLE_CACHE%refant);
+    if ddid is not None:
+      basename += UVW_TABLE_DDID_SUFFIX%ddid;
+    if field is not None:
+      basename += UVW_TABLE_FIELD_SUFFIX%field;
+    # check disk cache
+    try:
+      version,mtime0,missing = cPickle.load(file(basename+".key"));
+      if (version,mtime0) == (UVW_TABLE_VERSION,mtime):
+        table = numpy.load(basename+".times.npy"),numpy.load(basename+".npy",mmap_mode='r'),missing;
+        _uvw_tables[key] = mtime,table;
+        return table;
+    except:
+      pass;
+    _dprint("  Meow.MSUtils: making UVW table for %s"%msname,2);
+    nrows = ms.nrows();
+    chunk = max((chunk_size or column_stats_chunk_size)//(3*8+8+2*4+4*len(selcolumns)),1);
+    # returns rows of the given column in the given chunk, applying the DDID/field selection
+    def getcol (column,row0,selection=None):
+      data = ms.getcol(column,row0,min(chunk,nrows-row0));
+      return data if selection is None else data[selection];
+    def select_rows (row0):
+      selection = None;
+      for col,value in selcolumns:
+        sel = getcol(col,row0) == value;
+        selection = sel if selection is None else selection&sel;
+      return selection;
+    times = numpy.unique(numpy.concatenate([ numpy.unique(getcol("TIME",row0,select_rows(row0)))
+                                             for row0 in xrange(0,nrows,chunk) ] or [numpy.zeros(0)]));
+    nant = get_ms_metadata(path,ms).num_antennas;
+    try:
+      uvw = numpy.lib.format.open_memmap(basename+".npy",mode="w+",dtype=float,shape=(len(times),nant,3));
+    except:
+      _dprint("  Meow.MSUtils: can't write UVW table for %s, keeping it in memory"%msname);
+      uvw = numpy.zeros((len(times),nant,3),float);
+      basename = None;
+    valid = numpy.zeros((len(times),nant),bool);
+    valid[:,refant] = True;
+    for row0 in xrange(0,nrows,chunk):
+      selection = select_rows(row0);
+      itime = numpy.searchsorted(times,getcol("TIME",row0,selection));
+      add_refant_baselines(uvw,valid,itime,getcol("ANTENNA1",row0,selection),getcol("ANTENNA2",row0,selection),
+                           getcol("UVW",row0,selection),refant);
+    missing = fill_uvw_gaps(times,uvw,valid);
+  finally:
+    ms.close();
+  if missing:
+    _dprint("  Meow.MSUtils: WARNING: antenna(s) %s of %s have no baseline to reference antenna %d, their UVWs can't be looked up"%
+            (",".join(map(str,missing)),msname,refant),0);
+  # the table stays memory-mapped, so only write out the key files
+  if basename:
+    try:
+      uvw.flush();
+      numpy.save(basename+".times.npy",times);
+      cPickle.dump((UVW_TABLE_VERSION,mtime,missing),file(basename+".key","w"));
+    except:
+      _dprint("  Meow.MSUtils: can't write UVW table for %s, keeping it in memory"%msname);
+      uvw = numpy.array(uvw);
+  _uvw_tables[key] = mtime,(times,uvw,missing);
+  return times,uvw,missing;
+
 class MSContentSelector (object):
   def __init__ (self,ddid=[0],field=None,channels=True,namespace='ms_sel'):
     """Creates options for selecting a subset of an MS.
@@ -254,23 +624,18 @@ class MSContentSelector (object):
       selection.selection_string =  taql;
     return selection;
 
-  def _select_new_ms (self,ms):
-    """Called (from MSSelector) when a new MS is selected. ms is a pycasatable.table
+  def _select_new_ms (self,meta):
+    """Called (from MSSelector) when a new MS is selected. meta is an MSMetadata
     object. Fills ddid/field/channel selectors from the MS.
     """;
     # DDIDs
-    ddid_tab = TABLE(ms.getkeyword('DATA_DESCRIPTION'),lockoptions='autonoread');
-    self.ms_spws = list(ddid_tab.getcol('SPECTRAL_WINDOW_ID'));
-    self.ms_polarization_ids = list(ddid_tab.getcol('POLARIZATION_ID'));
-    ddid_tab = None;
+    self.ms_spws = list(meta.ddid_spws);
+    self.ms_polarization_ids = list(meta.ddid_polarization_ids);
     # channels per spectral window
-    numchans = TABLE(ms.getkeyword('SPECTRAL_WINDOW'),
-                                  lockoptions='autonoread').getcol('NUM_CHAN');
-    self.ms_ddid_numchannels = [ numchans[spw] for spw in self.ms_spws ];
+    self.ms_ddid_numchannels = [ meta.spw_numchannels[spw] for spw in self.ms_spws ];
     # Fields
-    field = TABLE(ms.getkeyword('FIELD'),lockoptions='autonoread');
-    self.ms_field_names = list(field.getcol('NAME'));
-    self.ms_field_phase_dir = field.getcol('PHASE_DIR');
+    self.ms_field_names = list(meta.field_names);
+    self.ms_field_phase_dir = meta.field_phase_dir;
     # update selectors
     self._update_ms_options();
 
@@ -551,7 +916,7 @@ class MSSelector (object):
     self.tdloption_namespace = namespace;
     self._content_selectors = [];
     self.ms_antenna_names = [];
-    self.ms_ifrset = self.ms_observatory = None;
+    self.ms_ifrset = self.ms_observatory = self.ms_metadata = None;
     ms_option = self._ms_option = \
       TDLOption('msname',"MS",TDLDirSelect(pattern,default=True),namespace=self,mandatory=True);
     self._compile_opts = [ ms_option ];
@@ -802,15 +1167,14 @@ class MSSelector (object):
     # get max W, if needed
     if Meow.Context.discover_max_abs_w:
       # add baseline selection string
+      # this is looked up in the (cached) per-interferometer UVW stats of the MS
       if TABLE:
-        ms = TABLE(self.msname,lockoptions='autonoread');
         subset = self.get_ifr_subset();
+        ifrs = None;
         if len(subset.ifrs()) < len(self.ms_ifrset.ifrs()):
-#          print "Applying TaQL subset",subset.taql_string();
-          ms = ms.query(subset.taql_string());
-        Meow.Context.max_abs_w = max(abs(ms.getcol("UVW")[:,2]));
+          ifrs = subset.ifr_numbers();
+        Meow.Context.max_abs_w = get_ms_metadata(self.msname).max_abs_w(ifrs);
 #        print "Max w is ",Meow.Context.max_abs_w;
-        ms.close();
     return array,observation;
 
   def make_subset_selector (self,namespace,**kw):
@@ -866,19 +1230,20 @@ class MSSelector (object):
       return True;
     try:
       ms = TABLE(msname,lockoptions='autonoread');
+      # subtable contents come from a cached snapshot
+      meta = self.ms_metadata = get_ms_metadata(msname,ms);
       # data columns
-      self.ms_data_columns = [ name for name in ms.colnames() if name.endswith('DATA') ];
+      self.ms_data_columns = list(meta.data_columns);
       self.input_col_option.set_option_list(self.ms_data_columns);
       self.model_col_option.set_option_list(self.ms_data_columns);
       outcols = [ col for col in self.ms_data_columns if col not in self._forbid_output ];
       self.output_col_option.set_option_list(outcols);
       # antennas
-      anttable = TABLE(ms.getkeyword('ANTENNA'),lockoptions='autonoread');
-      antnames = anttable.getcol('NAME');
+      antnames = meta.antenna_names;
       # if NAME column is missing, use indices
       if not antnames:
         Meow.dprint("Warning! This MS does not define ANTENNA names. Using antenna indices instead.")
-        self.ms_antenna_names = map(str,range(anttable.nrows()));
+        self.ms_antenna_names = map(str,range(meta.num_antennas));
       # else use name, but trim off longest common prefix (so that RT0,RT1,..RTD become 0,1,...,D
       else:
         prefix = len(longest_prefix(*antnames));
@@ -887,11 +1252,10 @@ class MSSelector (object):
         if len(set(self.ms_antenna_names)) < len(self.ms_antenna_names):
           Meow.dprint("Warning! This MS does not define unique ANTENNA names. Using antenna indices instead.")
           self.ms_antenna_names = [ str(i) for i in range(len(self.ms_antenna_names)) ];
-      self.ms_antenna_positions = anttable.getcol('POSITION');
+      self.ms_antenna_positions = meta.antenna_positions;
       # observatory is from observation subtable
-      try:
-        self.ms_observatory = TABLE(ms.getkeyword("OBSERVATION")).getcol("TELESCOPE_NAME")[0];
-      except:
+      self.ms_observatory = meta.observatory;
+      if self.ms_observatory is None:
         Meow.dprint("Warning! This MS does have a valid OBSERVATION table, can't establish telescope name");
         self.ms_observatory = "Unknown";
       # make IfrSet object for the full antenna set
@@ -906,13 +1270,11 @@ class MSSelector (object):
         self.ifrsel_option.show();
         self.ifrsel_option.set_doc(self.ms_ifrset.subset_doc);
       # correlations
-      # polarization IDs
-      pol_tab = TABLE(ms.getkeyword('POLARIZATION'),lockoptions='autonoread');
       # get list of corrype enums for each row of polarizxation table, and convert
       # to strings via MS_STOKES_ENUMS. self._corrnames is now a list of lists of strings
       self._corrnames = [ [ (ctype >= 0 and ctype < len(MS_STOKES_ENUMS) and MS_STOKES_ENUMS[ctype]) or
-			    None for ctype in pol_tab.getcol('CORR_TYPE',pol_id,1)[0] ]
-			  for pol_id in range(pol_tab.nrows()) ];
+			    None for ctype in corr_types ]
+			  for corr_types in meta.corr_types ];
       # convert to joined names (for ms_polariation option)
       self._corrstrings = [ " ".join(names) for names in self._corrnames ];
       self.polarization_option.set_option_list(self._corrstrings);
@@ -931,7 +1293,7 @@ class MSSelector (object):
         sel.update_flagsets(self.flagsets);
       # notify content selectors
       for sel in self._content_selectors:
-        sel._select_new_ms(ms);
+        sel._select_new_ms(meta);
       self._msname = msname;
       # notify callbacks
       for cb in self._when_changed_callbacks:
@@ -32,9 +32,12 @@ import inspect
 import types
 import re
 import fnmatch
+import itertools
+import numpy
 
 import Meow
 from Meow import StdTrees,ParmGroup,Parallelization,MSUtils
+from Meow.Direction import static_lmn_array,precompute_static_KJones
 
 DEG = math.pi/180;
 
@@ -84,10 +87,20 @@ SKYJONES_AZEL_FULL = "Az-El full sky";
 PER_SOURCE = "each source";
 PER_ALL_SOURCES = "entire model";
 
+def _resolve_identity (node):
+  """Helper: follows Meq.Identity aliases down to the node they stand for""";
+  while node.classname == 'MeqIdentity' and len(node.children) == 1:
+    node = node.children[0][1];
+  return node;
+
 class MeqMaker (object):
+  # node class used for tensor predicts, see use_tensors below
+  psv_class = "PSVTensor";
+
   def __init__ (self,namespace='me',solvable=False,
       use_correction=False,
       use_decomposition=None,
+      use_tensors=None,
       use_jones_inspectors=None,
       use_skyjones_visualizers=True):
     self.tdloption_namespace = namespace;
@@ -108,10 +121,17 @@ class MeqMaker (object):
     self._skyjones_visualizer_source = False;
     self._module_toggles = {};
     other_opt = [];
+    self.decomposition_batch = 0;
     if use_decomposition is None:
       self.use_decomposition = False;
       self.use_decomposition_opt = \
-        TDLOption('use_decomposition',"Use source coherency decomposition, if available",False,namespace=self,
+        TDLMenu("Use source coherency decomposition, if available",
+          TDLOption('decomposition_batch',"Sum decomposed sources in stacks of",[0,100,1000,10000],more=int,namespace=self,
+            doc="""<P>If set to N>0, the per-station contributions of every N sources are stacked into a single
+            (2N,2) tensor per station, and each baseline's visibility is then formed by a single matrix product of
+            two such stacks, instead of a product and a sum per source. This makes for much smaller trees for large
+            point source models. Set to 0 to form and sum up per-source visibilities.</P>"""),
+          toggle='use_decomposition',namespace=self,
           doc="""If your source models are heavy on point sources, then an alternative form of the M.E. --
           where the source coherency is decomposed into per-station contributions -- may produce
           faster and/or more compact trees. Check this option to enable. Your mileage may vary."""
@@ -120,6 +140,22 @@ class MeqMaker (object):
     else:
       self.use_decomposition = use_decomposition;
 
+    if use_tensors is None:
+      self.use_tensors = False;
+      self.use_tensors_opt = \
+        TDLMenu("Use tensor nodes to predict point and Gaussian sources",
+          TDLOption('psv_class',"Use which node for PSV tensors",
+            ["PSVTensor","CUDAPointSourceVisibility","ThrustPointSourceVisibility"],namespace=self),
+          doc="""If enabled, point and Gaussian sources subject to the same set of sky-Jones terms are
+          grouped together, and each group is predicted by a single tensor node per baseline. For large sky
+          models this produces much smaller trees that compile a lot faster. Sky-Jones modules that have
+          no tensor implementation are handled transparently.""",
+          toggle='use_tensors',namespace=self
+        );
+      other_opt.append(self.use_tensors_opt);
+    else:
+      self.use_tensors = use_tensors;
+
     if use_jones_inspectors is None:
       self.use_jones_inspectors = True;
       self.use_jones_inspectors_opt = \
@@ -824,6 +860,233 @@ class MeqMaker (object):
       #request = meq.request(cells,rqtype='ev')
       #mqs.execute('',request);
 
+  def _get_skyjones_tensor (self,ns,jt,stations,source_lists,other_sources=[]):
+    """Returns the per-source tensor node associated with the given JonesTerm ('jt').
+    If the term has been disabled (through compile-time options), returns None.
+      'stations' is a list of stations.
+      'source_lists' is a list of source groups, each is a tuple of (srclist,lmntensor)
+    Returns a tuple of (J1,J1conj),(J2,J2conj),... basenode pairs, one pair per source group.
+    If a basenode pair is None,None, then that source group does not have that Jones term.
+    Each basenode should be qualified with a station name to get the per-station tensor node.
+    If the Jones module is completely disabled, just returns None.
+
+    Note that 'other_sources', if passed in, is added to the list of sources for which Jones
+    noes are computed. This is done for compatibility with mixed models (containing both
+    tensor and non-tensor visiblities), since compute_jones() is called only once.
+    """;
+    # get the selected module
+    attrname = 'tensor_basenodes_%s'%ns.name if ns.name else 'tensor_basenodes';
+    basenodes = getattr(jt,attrname,None);
+    if basenodes is None:
+      module = self._get_selected_module(jt.label,jt.modules);
+      if not module:
+        return None;
+      # get advanced options: is this Jones term per-source?
+      advanced_opt = self.are_advanced_options_enabled(jt.label);
+      per_source = getattr(self,self._make_attr('per_source',jt.label),None) if advanced_opt else PER_SOURCE;
+      # if module has a tensor method, and we have one Jones term per source, use that
+      # (if not per source, then fall back on calling compute_jones() and then assembling a tensor)
+      if hasattr(module,"compute_jones_tensor") and per_source == PER_SOURCE:
+        basenodes = [];
+        # are we doing a per-station Jones term?
+        same_all_stations = advanced_opt and getattr(self,self._make_attr('all_stations',jt.label),False);
+        real_stations = stations[:1] if same_all_stations else stations;
+        # do we have an associated pointing error module?
+        dlm = self._get_pointing_error_nodes(ns,jt,stations);
+        # loop over source groups and create a tensor for each
+        for i,(srclist,lmnT) in enumerate(source_lists):
+          # does this only apply to a subset of sources?
+          if advanced_opt:
+            srclist = jt.subset_selector.filter(srclist);
+          if srclist:
+            # call module to get the tensor
+            inspectors = [];
+            Tbase = module.compute_jones_tensor(ns["%sT%d"%(jt.label,i)],
+                            srclist,real_stations,lmn=lmnT,pointing_offsets=dlm,inspectors=inspectors);
+            if Tbase is None:
+              # if no tensor available, fall back to Jones nodes
+              basenodes = None;
+              break;
+            # make inspectors
+            if inspectors:
+              for node in inspectors:
+                self.add_inspector_node(node);
+            # make conjugate tensor
+            Tbaseconj = ns["%sT%d^H"%(jt.label,i)];
+            # has the user specified the same Jones term for all stations, or has the module
+            # returned the same tensor for all stations? Make one conjuaget then
+            p0 = stations[0];
+            if same_all_stations or all([ Tbase(p) is Tbase(p0) for p in stations[1:] ]):
+              tbase = Tbase(p0);
+              tconj = Tbaseconj << Meq.ConjTranspose(Tbase(p0),tensor=True);
+              Tbase = lambda p,T=tbase:T;
+              Tbaseconj = lambda p,T=tconj:T;
+            # else make conjugate tensor for each station
+            else:
+              for p in stations[1:]:
+                Tbaseconj(p) << Meq.ConjTranspose(Tbase(p),tensor=True);
+            basenodes.append((Tbase,Tbaseconj));
+          else:
+            basenodes.append((None,None));
+      # if tensor method was not available, fall back to Jones matrices, and assemble a tensor from that
+      if basenodes is None:
+        basenodes = [];
+        all_sources = list(itertools.chain(other_sources,*[src for src,lmnT in source_lists]));
+        Jj,solvable = self._get_jones_nodes(ns,jt,stations,sources=all_sources);
+        if Jj is None:
+          return None;
+        # compose tensors
+        for i,(srclist,lmnT) in enumerate(source_lists):
+          # get the nodes per each source and station, replace all unitialized  nodes with unity
+          nodes = [ [ (Jj(src,p) if Jj(src,p).initialized() else 1) for src in srclist ] for p in stations ];
+          # if none of them are initialized, skip this tensor entirely
+          if all([all([n is 1 for n in nl]) for nl in nodes ]):
+            basenodes.append((None,None));
+          else:
+            Tbase = ns["%sT%d"%(jt.label,i)];
+            Tbaseconj = ns["%sT%dconj"%(jt.label,i)];
+            for p in stations:
+              # compose base tensor, using unity for uninitialized nodes
+              nodes = [ Jj(src,p) for src in srclist ];
+              Tbase(p) << Meq.Composer(dims=[0],*[ n if n.initialized() else 1 for n in nodes ]);
+              # make conjugate tensor
+              if p is not stations[0]:
+                Tbaseconj(p) << Meq.ConjTranspose(Tbase(p),tensor=True);
+            basenodes.append((Tbase,Tbaseconj));
+      setattr(jt,attrname,basenodes);
+    # return basenodes
+    return basenodes;
+
+  def _make_tensor_predict (self,ns,point_sources,other_sources,stations,ifrs,uvdata=None):
+    """Makes predict trees for point/Gaussian sources using tensor nodes. Sources are partitioned into groups
+    to which the same set of sky-Jones terms applies, and each group is predicted by a single
+    tensor node per baseline, so the node count scales with the number of groups rather than sources.
+    Sky-Jones modules that do not implement compute_jones_tensor() fall back to composing a tensor from
+    their per-source Jones nodes.
+    'other_sources' are the remaining sources in the model (see _get_skyjones_tensor()).
+    'uvdata', if supplied, is added to the result.
+    Returns a base node which should be qualified with a station pair.
+    """;
+    ### figure out how to split the source list into partitions with the same applicable tensors
+    # initial list has one partition: all sources
+    partitions = [ set([ src.name for src in point_sources ]) ];
+    for jt in self._sky_jones_list:
+      # if Jones term is enabled, and advanced options are enabled, and a subset
+      # is specified, recalcaulte partitions, else no change
+      if self.is_group_enabled(jt.label) and self.are_advanced_options_enabled(jt.label):
+        subset = set([src.name for src in jt.subset_selector.filter(point_sources)]);
+        if not subset:
+          continue;
+        new_partitions = [];
+        # see what the overlap is with existing partitions
+        for part in partitions:
+          overlap = part&subset;
+          # the overlap and the remainder of this partition, whatever is not empty,
+          # become new parititons
+          new_partitions += [ p1 for p1 in overlap,part-overlap if p1 ];
+          # remove overlap from subset
+          subset -= overlap;
+        partitions = new_partitions;
+    # Convert partitions to lists of sources
+    sgroups = [
+      [ src for src in point_sources if src.name in part ] for part in partitions
+    ];
+
+    ## create lmn tensor per each source group
+    source_groups = [];
+    for igrp,sources in enumerate(sgroups):
+      lmn_static = static_lmn_array([ src.direction for src in sources ]);
+      lmnT = ns["lmnT%d"%igrp];
+      # if all sources have static LMN coordinates, use a single constant node
+      if lmn_static is not None:
+        lmnT << Meq.Constant(lmn_static);
+      # else compose a tensor
+      else:
+        lmnT << Meq.Composer(dims=[0],*[src.direction.lmn() for src in sources]);
+      # add to group list
+      source_groups.append((sources,lmnT));
+
+    ### collect sky-Jones tensors per each source group
+    jones_tensors = [ list() for grp in source_groups ];
+    for jt in self._sky_jones_list:
+      # get the tensor basenodes
+      basenodes = self._get_skyjones_tensor(ns,jt,stations,source_groups,other_sources=other_sources);
+      if basenodes is not None:
+        # now for every source grouping, add those basenodes that are not None to the jones_tensor list for that group
+        for igrp,grp in enumerate(source_groups):
+          if basenodes[igrp][0] is not None:
+            jones_tensors[igrp].append(basenodes[igrp]);
+
+    uvw = Meow.Context.array.uvw_ifr();
+    ### now make the PSV tensor for esch source
+    psvts = [];
+    ns.null_shape << Meq.Constant([0,0,0]);
+    psv_kwargs = dict();
+    if getattr(self,'fix_time_smearing',None) is not None:
+      psv_kwargs['fixed_time_smearing_interval'] = self.fix_time_smearing;
+    if getattr(self,'fix_freq_smearing',None) is not None:
+      psv_kwargs['fixed_freq_smearing_interval'] = self.fix_freq_smearing;
+    for igrp,(sources,lmnT) in enumerate(source_groups):
+      ### create brightness tensor
+      any_pol = any([src.is_polarized() for src in sources])
+      # see if we have constant brightnesses
+      B_static = [ src.brightness_static() for src in sources ];
+      if all([ b is not None for b in B_static ]):
+        BT = ns["BT%d"%igrp] << Meq.Constant(B_static);
+      else:
+        BT = ns["BT%d"%igrp] << Meq.Composer(dims=[0],*[ src.brightness(always_matrix=any_pol) for src in sources ]);
+      ### create shape tensor 
+      shape_static = [ src.shape_static() if hasattr(src,'shape_static') else [0,0,0] for src in sources ];
+      if all([ s is not None for s in shape_static ]):
+        shapeT = ns["shapeT%d"%igrp] << Meq.Constant(shape_static);
+      else:
+        shapeT = ns["shapeT%d"%igrp] << Meq.Composer(dims=[0],*[Meq.Composer(*src.shape()) if hasattr(src,'shape') else ns.null_shape for src in sources]);
+      ### now make the predict nodes
+      psvt = ns["psvT%d"%igrp];
+      psvts.append(psvt);
+      for p,q in ifrs:
+        jt = [];
+        for Et,Etconj in jones_tensors[igrp]:
+          jt += [ Et(p),Etconj(q) ];
+        v = psvt(p,q) << Meq[self.psv_class](lmnT,BT,uvw(p,q),shapeT,*jt,**psv_kwargs);
+    ### if uvdata is specified, add it to the summation terms
+    if uvdata is not None:
+      psvts.append(uvdata);
+    ### generate output visibilities, as a sum of the terms
+    if len(psvts) == 1:
+      uvdata = psvts[0];
+    else:
+      uvdata = Parallelization.smart_adder(ns.psvTsum,psvts,ifrs,tensor=True);
+    return uvdata;
+
+  def _jones_product (self,basenode,chain,stations,products):
+    """Helper: returns a basenode giving the per-station matrix product of a chain of per-station
+    Jones basenodes. A chain of one term is returned as is, otherwise basenode(p) is defined as the product.
+    'products' is a dict in which products are memoized by the names of the Jones nodes making them up,
+    so sources sharing the same chain (e.g. a common beam) share the same product nodes. Jones nodes
+    shared between sources or stations are Meq.Identity aliases of one node (see _get_jones_nodes()),
+    so the key is made from the nodes they stand for.
+    """
+    if len(chain) == 1:
+      return chain[0];
+    key = tuple([ _resolve_identity(j(stations[0])).name for j in chain ]);
+    J = products.get(key);
+    if J is None:
+      J = products[key] = basenode;
+      for p in stations:
+        J(p) ** Meq.MatrixMultiply(*[j(p) for j in chain]);
+    return J;
+
+  def _jones_conj (self,J,stations,products):
+    """Helper: returns a dict of conjugate-transpose nodes of J(p) for the given stations, memoized in 'products'."""
+    if not stations:
+      return {};
+    key = J(stations[0]).name,'conj';
+    Jconj = products.get(key);
+    if Jconj is None:
+      Jconj = products[key] = dict([ (p,J(p,'conj') ** Meq.ConjTranspose(J(p))) for p in stations ]);
+    return Jconj;
+
   def make_predict_tree (self,ns,sources=None,uvdata=None,ifrs=None):
     """makes predict trees using the sky model and ME.
     'ns' is a node scope
@@ -835,8 +1098,20 @@ class MeqMaker (object):
     Meow.Context.array.enable_uvw_derivatives(self.use_smearing);
     stations = Meow.Context.array.stations();
     ifrs = ifrs or Meow.Context.array.ifrs();
+    # per-station Jones products, shared between sources (see _jones_product()). Conjugates
+    # are only needed for the second station of each baseline
+    jones_products = {};
+    conj_stations = set([ q for p,q in ifrs ]);
+    conj_stations = [ p for p in stations if p in conj_stations ];
     # use sky model if no source list is supplied
     sources = sources if sources is not None else self.get_source_list(ns);
+    # are we using tensors? Then predict point/Gaussian sources via per-group tensor nodes, and pass the
+    # result on as uv-data. All other sources get per-source trees, as below.
+    if self.use_tensors:
+      tensor_sources = [ src for src in sources if type(src) in (Meow.PointSource,Meow.GaussianSource) ];
+      if tensor_sources:
+        sources = [ src for src in sources if type(src) not in (Meow.PointSource,Meow.GaussianSource) ];
+        uvdata = self._make_tensor_predict(ns,tensor_sources,sources,stations,ifrs,uvdata=uvdata);
     if self.use_smearing:
       count = self.smearing_count;
       if count == "all":
@@ -872,14 +1147,15 @@ class MeqMaker (object):
         if uvchain:
           # if only one uv-Jones, will use it directly
           if len(uvchain) > 1:
-            for p in stations:
-              ns.uvjones(p) << Meq.MatrixMultiply(*[j(p) for j in uvchain]);
-            uvchain = [ ns.uvjones ];
+            uvchain = [ self._jones_product(ns.uvjones,uvchain,stations,jones_products) ];
         # now, form up the corrupt sqrt-visibility (and its conjugate) of each source,
         # then the final visibility
         corrvis = ns.corrupt_vis;
         sqrtcorrvis = ns.sqrt_corrupt_vis;
         sqrtcorrvis_conj = sqrtcorrvis('conj');
+        # in batched mode, the conjugates of all stations are stacked, see below
+        batch = self.decomposition_batch;
+        sqrt_conj_stations = stations if batch else stations[1:];
         for src in dec_sources:
           # terms is a list of matrices to be multiplied
           sqrtvis = src.sqrt_visibilities();
@@ -888,25 +1164,44 @@ class MeqMaker (object):
           # make a skyjones(src,p) node containing a product of all the sky-Jones
           skchain = skychain.get(src.name,[]);
           if len(skchain) > 1:
-            for p in stations:
-              ns.skyjones(src,p) << Meq.MatrixMultiply(*[j(p) for j in skchain]);
-            skchain = [ ns.skyjones(src) ];
+            skchain = [ self._jones_product(ns.skyjones(src),skchain,stations,jones_products) ];
           jones_chain = uvchain + skchain;
+          # stacking needs 2x2 matrices, so promote scalar sqrt-visibilities if nothing else will
+          if batch and not jones_chain and not src.is_polarized():
+            jones_chain = [ lambda p:ns.unit_matrix ** Meq.Matrix22(1,0,0,1) ];
           # if there's a real jones chain, multiply all the matrices
           if jones_chain:
             for p in stations:
               C(p) << Meq.MatrixMultiply(*([j(p) for j in jones_chain]+[sqrtvis(p)]));
-              if p is not stations[0]:
-                Ct(p) << Meq.ConjTranspose(C(p));
           # else use an identity relation
           else:
             for p in stations:
               C(p) << Meq.Identity(sqrtvis(p));
-              if p is not stations[0]:
-                Ct(p) << Meq.ConjTranspose(C(p));
+          for p in sqrt_conj_stations:
+            Ct(p) << Meq.ConjTranspose(C(p));
           # ok, now get the visiblity of each source by multiplying its two per-station contributions
-          for p,q in ifrs:
-            ns.corrupt_vis(src,p,q) << Meq.MatrixMultiply(C(p),Ct(q));
+          if not batch:
+            for p,q in ifrs:
+              ns.corrupt_vis(src,p,q) << Meq.MatrixMultiply(C(p),Ct(q));
+        costs = [ Parallelization.component_cost(src,len(skychain.get(src.name,[]))+len(uvchain)) for src in dec_sources ];
+        # in batched mode, stack up the per-station conjugates of N sources into a (2N,2) matrix [C1(q)^H;...;CN(q)^H].
+        # Its conjugate transpose is [C1(p) ... CN(p)], so the product of the two gives the sum of Ci(p)Ci(q)^H
+        # over all sources in the stack, i.e. the visibility of the whole stack, in a single node per baseline
+        if batch:
+          vislist,batch_costs = [],[];
+          for i0 in range(0,len(dec_sources),batch):
+            batch_sources = dec_sources[i0:i0+batch];
+            stack = ns.sqrt_corrupt_vis_stack(i0);
+            stack_conj = stack('conj');
+            for p in stations:
+              stack(p) << Meq.Composer(dims=[2*len(batch_sources),2],*[ sqrtcorrvis_conj(src,p) for src in batch_sources ]);
+              stack_conj(p) << Meq.ConjTranspose(stack(p));
+            for p,q in ifrs:
+              corrvis(i0,p,q) << Meq.MatrixMultiply(stack_conj(p),stack(q));
+            vislist.append(corrvis(i0));
+            batch_costs.append(sum(costs[i0:i0+batch]));
+        else:
+          vislist,batch_costs = [ corrvis(src) for src in dec_sources ],costs;
         # finally, sum up all the source contributions
         # if no non-decomposable sources, then call the output 'visibility:sky', since
         # it already contains everything
@@ -914,7 +1209,7 @@ class MeqMaker (object):
           dec_sky = ns.visibility('sky1');
         else:
           dec_sky = ns.visibility('sky');
-        Parallelization.add_visibilities(dec_sky,[ns.corrupt_vis(src) for src in dec_sources],ifrs);
+        Parallelization.add_visibilities(dec_sky,vislist,ifrs,batch_costs);
         if not sources and not uvdata:
           return self._apply_vpm_list(ns,dec_sky);
 
@@ -936,6 +1231,11 @@ class MeqMaker (object):
         # if this Jones is enabled (Jj not None), corrupt each source
         if Jj:
           joneslist.append((Jj,solvable));
+      # static source directions get their KJones from a few per-station phase tensors, rather
+      # than from per-source lmn and phase shift nodes. This doesn't work with smearing, which needs
+      # UVW derivatives.
+      if not self.use_smearing:
+        precompute_static_KJones(ns,[ src.direction for name,src in sourcelist ]);
       # now make multiplication node per each source
       for name,src in sourcelist:
         # get KJones and smear factor for source
@@ -948,22 +1248,32 @@ class MeqMaker (object):
         if src.get_solvables():
           solvable_skyjones.add(name);
         coh = src.coherency();
+        # make the chain of sky-Jones terms for this source (outermost first), and reduce it
+        # to a per-station product and its conjugate. These are formed once per station rather than
+        # once per baseline, and are shared with any other source that has the same chain.
+        chain = [];
+        for Jones,solvable in joneslist:
+          J = Jones(name);
+          if J(stations[0]).initialized():
+            chain.insert(0,J);
+            solvable and solvable_skyjones.add(name);
+        # (the product is not called skyjones, since correct_uv_data() takes that to be the decomposition product)
+        if chain:
+          J = self._jones_product(ns.skyjones_prod(name),chain,stations,jones_products);
+          Jconj = self._jones_conj(J,conj_stations,jones_products);
+        if Kj:
+          Kjconj = dict([ (q,Kj(q)('conj') ** Meq.ConjTranspose(Kj(q))) for q in conj_stations ]);
         # loop over baselines
         for p,q in ifrs:
           mulops = [ coh(p,q) ];
           # add KJones and smear factor to list of multiplication operands
           if Kj:
-            mulops.insert(0,Kj(p));
-            mulops.append(Kj(q)('conj') ** Meq.ConjTranspose(Kj(q)));
+            mulops = [ Kj(p) ] + mulops + [ Kjconj[q] ];
             if smear:
               mulops.insert(0,smear(p,q));
           # add other Jones terms to list
-          for Jones,solvable in joneslist:
-            J = Jones(name);
-            if J(p).initialized():
-              mulops.insert(0,J(p));
-              mulops.append(J(q,'conj') ** Meq.ConjTranspose(J(q)));
-              solvable and solvable_skyjones.add(name);
+          if chain:
+            mulops = [ J(p) ] + mulops + [ Jconj[q] ];
           # now make multiply node to compute sky visibility
           if len(mulops) > 1:
             ns.sky(name,p,q) << Meq.MatrixMultiply(*mulops);
@@ -998,18 +1308,12 @@ class MeqMaker (object):
       Jj,solvable = self._get_jones_nodes(ns,jt,stations);
       if Jj:
         joneslist.append(Jj);
-    # now make matrix multiplication nodes
+    # now make matrix multiplication nodes, using per-station products of the Jones terms
     if joneslist:
+      J = self._jones_product(ns.uvjones_prod,joneslist[::-1],stations,jones_products);
+      Jconj = self._jones_conj(J,conj_stations,jones_products);
       for p,q in ifrs:
-        mulops = [ skyvis(p,q) ];
-        for Jones in joneslist:
-          mulops.insert(0,Jones(p));
-          mulops.append(Jones(q,'conj') ** Meq.ConjTranspose(Jones(q)));
-        # now make multiply node to compute sky visibility
-        if len(mulops) > 1:
-          ns.visibility(p,q) << Meq.MatrixMultiply(*mulops);
-        else:
-          ns.visibility(p,q) << Meq.Identity(*mulops);
+        ns.visibility(p,q) << Meq.MatrixMultiply(J(p),skyvis(p,q),Jconj[q]);
       skyvis = ns.visibility;
 
     # form up list of visibility contributions
@@ -1097,14 +1401,14 @@ class MeqMaker (object):
     # if overall sky-Jones correction is enabled, collect all sky-Jones terms for which it hasn't been
     # individually disabled
     if sky_correct:
-      for jt in self._sky_jones_list:
-        # if using coherency decomposition, we will already have defined a "uvjones" node
-        # containing a product of all the sky-Jones terms, so use that
-        skyjones = ns.skyjones(sky_correct);
-        if skyjones(stations[0]).initialized():
-          for p in stations:
-            correction_chains[p].insert(0,skyjones(p));
-        else:
+      # if using coherency decomposition, we will already have defined a "skyjones" node
+      # containing a product of all the sky-Jones terms, so use that
+      skyjones = ns.skyjones(sky_correct);
+      if skyjones(stations[0]).initialized():
+        for p in stations:
+          correction_chains[p].insert(0,skyjones(p));
+      else:
+        for jt in self._sky_jones_list:
           skip = self.are_advanced_options_enabled(jt.label) and \
                     getattr(self,self._make_attr('skip_correct',jt.label),False);
           if not skip:
@@ -1288,15 +1592,24 @@ class SourceSubsetSelector (object):
     except:
       None;
 
+  # cache of compiled subset plans, see _compile_subset() below
+  _compiled_subsets = {};
+
   @staticmethod
-  def filter_subset (subset,srclist0,tag_accessor=Meow.SkyComponent.get_attr):
-    all = set([src.name for src in srclist0]);
-    srcs = set();
+  def _compile_subset (subset):
+    """Compiles a subset string into a plan: a list of (spec,op,kind,args) clauses, where op is one
+    of "|", "&" or "-", and kind is "all", "tagcomp" (args=tag,predicate,value), "tag" (args=tag)
+    or "names" (args=compiled regex). Consecutive name patterns with the same "|" or "-" modifier are
+    merged into a single regex union. Plans are cached, so each subset string is parsed only once.""";
+    plan = SourceSubsetSelector._compiled_subsets.get(subset);
+    if plan is not None:
+      return plan;
+    plan = [];
     for ispec,spec0 in enumerate(re.split("[\s,]+",subset)):
       spec = spec0.strip();
       # "all" selects all sources
       if spec.lower() == "all":
-        srcs = all;
+        plan.append((spec0,"=","all",None));
         continue;
       if not spec:
         continue;
@@ -1308,7 +1621,7 @@ class SourceSubsetSelector (object):
         op = "|";
       # if first modifier is AND or EXCEPT, then implictly select all sources first
       if not ispec and op in "&-":
-        srcs = all;
+        plan.append((spec0,"=","all",None));
       # check for tag**value construct first
       match_tagcomp = SourceSubsetSelector._re_tagcomp.match(spec);
       if match_tagcomp:
@@ -1320,27 +1633,49 @@ class SourceSubsetSelector (object):
         if oper is None or value is None:
           print "Warning: invalid source subset selection '%s', ignoring"%spec0;
           continue;
-        value *= scale;
-        # do the selection
-        print predicate,tag,value;
-        srctag = [ (src,tag_accessor(src,tag)) for src in srclist0 ];
-        selection = [ src.name for src,tag in srctag if tag is not None and predicate(tag,value) ];
+        plan.append((spec0,op,"tagcomp",(tag,predicate,value*scale)));
       # then, a =tag construct
       elif spec.startswith("="):
-        spec = spec[1:];
-        selection = [ src.name for src in srclist0 if src.get_attr(spec) ];
-      # everything else treated as a source name (pattern)
+        plan.append((spec0,op,"tag",spec[1:]));
+      # everything else treated as a source name (pattern). Merge with previous pattern if possible
+      elif plan and plan[-1][1] == op and op in "|-" and plan[-1][2] == "names":
+        spec1,op,kind,patterns = plan[-1];
+        plan[-1] = (spec1+" "+spec0,op,kind,patterns+[spec]);
       else:
-        selection = fnmatch.filter(all,spec);
+        plan.append((spec0,op,"names",[spec]));
+    # compile name patterns into regexes
+    plan = [ (spec,op,kind,re.compile("|".join([fnmatch.translate(p) for p in args])) if kind == "names" else args)
+             for spec,op,kind,args in plan ];
+    SourceSubsetSelector._compiled_subsets[subset] = plan;
+    return plan;
+
+  @staticmethod
+  def filter_subset (subset,srclist0,tag_accessor=Meow.SkyComponent.get_attr):
+    table = SourceTable(srclist0,tag_accessor);
+    mask = numpy.zeros(len(srclist0),bool);
+    for spec,op,kind,args in SourceSubsetSelector._compile_subset(subset):
+      if kind == "all":
+        selection = numpy.ones(len(srclist0),bool);
+      elif kind == "tagcomp":
+        selection = table.compare(*args);
+      elif kind == "tag":
+        selection = table.flags(args);
+      else:
+        selection = table.match_names(args);
       # apply this selection to current source set
-      if op == "-":
-        srcs.difference_update(selection);
+      if op == "=":
+        mask = selection;
+        continue;
+      elif op == "-":
+        mask &= ~selection;
       elif op == "&":
-        srcs.intersection_update(selection);
+        mask &= selection;
       else:
-        srcs.update(selection);
+        mask |= selection;
       # print stats
-      print "applied %s (involving %d sources), %d sources now selected"%(spec0,len(selection),len(srcs));
+      print "applied %s (involving %d sources), %d sources now selected"%(spec,selection.sum(),mask.sum());
+    # selection is by name, so sources sharing a name are selected together
+    srcs = set([ name for name,sel in zip(table.names,mask) if sel ]);
     return [ src for src in srclist0 if src.name in srcs ];
 
   def filter (self,srclist0):
@@ -1357,6 +1692,52 @@ class SourceSubsetSelector (object):
         [ src.set_attr('ANNOTATION_LABEL',self.annotation_label) for src in srclist ];
     return srclist;
 
+class SourceTable (object):
+  """A columnar view of a source list, used to evaluate subset selections with array operations.
+  Columns of tag values are extracted on first use, once per tag."""
+  def __init__ (self,srclist,tag_accessor=Meow.SkyComponent.get_attr):
+    self.sources = srclist;
+    self.names = [ src.name for src in srclist ];
+    self._tag_accessor = tag_accessor;
+    self._columns = {};
+
+  def column (self,tag):
+    """Returns a (values,present,others) tuple for the given tag. 'values' is a float array of
+    tag values, 'present' is a bool array which is false for sources without the tag, and 'others'
+    is a list of (index,value) pairs for non-numeric values, which can't be placed in 'values'."""
+    col = self._columns.get(tag);
+    if col is None:
+      raw = [ self._tag_accessor(src,tag) for src in self.sources ];
+      values = numpy.zeros(len(raw),float);
+      present = numpy.zeros(len(raw),bool);
+      others = [];
+      for i,x in enumerate(raw):
+        if x is not None:
+          present[i] = True;
+          try:
+            values[i] = x;
+          except:
+            others.append((i,x));
+      col = self._columns[tag] = values,present,others;
+    return col;
+
+  def compare (self,tag,predicate,value):
+    """Returns bool array of sources for which predicate(tag,value) is true"""
+    values,present,others = self.column(tag);
+    mask = predicate(values,value)&present;
+    for i,x in others:
+      mask[i] = predicate(x,value);
+    return mask;
+
+  def flags (self,tag):
+    """Returns bool array of sources for which the given attribute is set"""
+    return numpy.array([ bool(src.get_attr(tag)) for src in self.sources ],bool);
+
+  def match_names (self,regex):
+    """Returns bool array of sources whose names match the given compiled regex"""
+    match = regex.match;
+    return numpy.array([ match(name) is not None for name in self.names ],bool);
+
 def export_karma_annotations (sources,filename,
       label_format="%N",
       sym_color='yellow',
@@ -25,19 +25,33 @@
 
 # this contains parallelization-related options
 from Timba.TDL import *
+import heapq
+import math
+import Context
 
 mpi_enable = False;
 parallelize_by_source = False;
+parallelize_by_baseline = False;
 mpi_nproc = False;
+adder_cache_budget = 0;
 
 _options = [ 
     TDLMenu('Enable MPI',
               toggle='mpi_enable',
       *[ 
           TDLOption('mpi_nproc',"Number of processors to distribute to",[2,4,8],more=int),
-          TDLOption('parallelize_by_source',"Enable parallelization by source",False),
+          TDLOption('parallelize_by_source',"Enable parallelization by source",False,
+            doc="""<P>If enabled, sources are distributed over processors so as to balance the estimated
+            cost of their visibilities (see component_cost()), and each processor sums up its own sources.</P>"""),
+          TDLOption('parallelize_by_baseline',"Enable parallelization by baseline",False,
+            doc="""<P>If enabled (and parallelization by source is not), baselines are distributed over processors,
+            and each processor sums up all sources for its own baselines.</P>"""),
         ]
-    )
+    ),
+    TDLOption('adder_cache_budget',"Cache budget per adder node, MB",[0,16,64,256],more=float,
+      doc="""<P>Large sums of visibilities are formed by a tree of Meq.Add nodes. The number of children
+      per node is chosen so that their cached results for one tile fit within this budget (given the tile size
+      and number of channels of the MS). The default of 0 disables this, and uses a fixed fan-in of 8.</P>"""),
 ];
 
 def compile_options ():
@@ -45,74 +59,215 @@ def compile_options ():
   return _options;
 
 
+# maximum fan-in of an adder node, regardless of cache budget
+max_adder_fanin = 64;
+# fixed fan-in used when the cache budget is disabled, or the tile shape is not known
+default_adder_fanin = 8;
+
+def vis_shape ():
+  """Returns the (ntime,nfreq) shape of a visibility tile, as far as it can be determined
+  from the MS selector in Meow.Context, or None if it is not known.""";
+  mssel = Context.mssel;
+  if mssel is None:
+    return None;
+  ntime = getattr(mssel,'tile_size',None);
+  subset = getattr(mssel,'subset_selector',None);
+  nfreq = None;
+  if subset is not None:
+    chans = subset.get_channels();
+    if chans:
+      start,end,step = chans;
+      nfreq = (end-start)/(step or 1) + 1;
+    else:
+      nfreq = subset.get_total_channels();
+  if not isinstance(ntime,int) or not nfreq:
+    return None;
+  return ntime,nfreq;
+
+def adder_fanin (shape=None,budget=None,default=default_adder_fanin):
+  """Returns the maximum number of children per adder node, such that the cached child results
+  (2x2 complex visibilities of the given (ntime,nfreq) shape) fit within 'budget' MB.
+  If shape or budget are not known, returns 'default'.""";
+  if budget is None:
+    budget = adder_cache_budget;
+  if not budget or not shape:
+    return default;
+  vis_bytes = shape[0]*shape[1]*4*16;
+  return max(2,min(max_adder_fanin,int(budget*1024*1024/vis_bytes)));
+
+def fixed_fanins (nterms,step):
+  """Returns a list of per-level fan-ins for summing 'nterms' terms 'step' at a time at every level
+  (the last level adds whatever is left).""";
+  fanins = [];
+  while nterms > step:
+    fanins.append(step);
+    nterms = (nterms+step-1)/step;
+  fanins.append(nterms);
+  return fanins;
+
+def level_fanins (nterms,max_fanin):
+  """Returns a list of per-level fan-ins for summing 'nterms' terms with at most 'max_fanin'
+  children per node. The tree uses the minimum number of levels, with the fan-in at each level
+  as even as possible, so that no level ends up with a handful of near-empty nodes.""";
+  fanins = [];
+  while nterms > max_fanin:
+    nlevels = 1;
+    while max_fanin**nlevels < nterms:
+      nlevels += 1;
+    fanin = max(2,int(math.ceil(nterms**(1./nlevels))));
+    while fanin**nlevels < nterms:
+      fanin += 1;
+    fanins.append(fanin);
+    nterms = (nterms+fanin-1)/fanin;
+  fanins.append(nterms);
+  return fanins;
+
 # This is a function to add a large number of visibilities in a clever way.
 # The problem is that having too many children on a node leads to huge cache 
 # usage. So instead we make a hierarchical tree to only add N things at a time.
+# If adder_cache_budget is set, N is picked per level so that the cached children fit in it,
+# see adder_fanin() and level_fanins() above.
 #
 # 'nodes' are output (sum) nodes
 # 'visibilities' is a list of nodes containing visibilities (per component)
 # 'ifrs' is a list of IFRs (so that for each i,p,q, visibilities[i](p,q) is a valid node)
-# 'step' is the number of items to add at a time
+# 'step' is the number of items to add at a time. If None, the maximum is determined by the
+#       cache budget and the visibility shape, and spread evenly over the levels. If the budget is
+#       disabled (the default), items are added default_adder_fanin at a time.
+# 'shape' is the (ntime,nfreq) shape of a visibility tile. If None, this is looked up in the MS
+#       selector, if any.
+# 'tensor' is True if the visibilities are tensors (e.g. outputs of PSVTensor nodes), each one
+#       already a sum over many sources. Since there are few of these, they are added by a single
+#       variadic Meq.Add node per IFR, without intermediate levels.
 # 'kw' is passed as-is to the Meq.Add() node
 #
-def smart_adder (nodes,visibilities,ifrs,step=8,**kw):
-  sums = visibilities;
+def smart_adder (nodes,visibilities,ifrs,step=None,shape=None,tensor=False,**kw):
+  sums = list(visibilities);
+  if not sums:
+    return nodes;
+  if tensor:
+    fanins = [ len(sums) ];
+  elif step:
+    fanins = fixed_fanins(len(sums),step);
+  else:
+    max_fanin = adder_fanin(shape or vis_shape(),default=None);
+    if max_fanin is None:
+      fanins = fixed_fanins(len(sums),default_adder_fanin);
+    else:
+      fanins = level_fanins(len(sums),max_fanin);
   nsum = 1;
-  while sums:
-    # if down to 'step' terms or less, generate final nodes
+  for step in fanins:
+    # final level: generate output nodes
     if len(sums) <= step:
       for ifr in ifrs:
         nodes(*ifr) << Meq.Add(*[x(*ifr) for x in sums],**kw)
       break;
     # else generate intermediate sums
-    else:
-      newsums = [];
-      for i in range(0,len(sums),step):
-        # if we're dealing with one odd term out, propagate it to newsums list as-is
-        if i == len(sums)-1:
-          newsums.append(sums[i]);
-        else:
-          newnode = nodes('(%d:%d)'%(i*nsum,min(i+step-1,len(sums)-1)*nsum));  # create unique name for intermediate sum node
-          for ifr in ifrs:
-            newnode(*ifr) << Meq.Add(*[x(*ifr) for x in sums[i:i+step]],**kw);
-          newsums.append(newnode);
-      sums = newsums;
-      nsum *= step;
+    newsums = [];
+    for i in range(0,len(sums),step):
+      # if we're dealing with one odd term out, propagate it to newsums list as-is
+      if i == len(sums)-1:
+        newsums.append(sums[i]);
+      else:
+        newnode = nodes('(%d:%d)'%(i*nsum,min(i+step-1,len(sums)-1)*nsum));  # create unique name for intermediate sum node
+        for ifr in ifrs:
+          newnode(*ifr) << Meq.Add(*[x(*ifr) for x in sums[i:i+step]],**kw);
+        newsums.append(newnode);
+    sums = newsums;
+    nsum *= step;
   return nodes;
 
-def add_visibilities (nodes,vislist,ifrs):
+# Cost model for load balancing. Costs are relative to an unpolarized, unsmeared point source
+# with constant flux. Component types are looked up by class name along the class hierarchy,
+# so e.g. a Shapelet or DiskSource falls back on the PointSource cost unless listed here.
+component_type_cost = dict(
+  PointSource=1.,
+  GaussianSource=3.,
+  DiskSource=3.,
+  Shapelet=6.,
+  SixpackComponent=20.,   # FFT brick plus uv-interpolation
+  KnownVisComponent=.5,
+);
+default_component_cost = 2.;
+smearing_cost_factor = 2.;       # per-baseline smearing factors
+freq_variable_cost_factor = 1.5; # spectral index or RM: flux varies in frequency
+solvable_cost_factor = 2.;       # solvable parameters carry derivatives
+jones_cost = .5;                 # each Jones term applied to the component
+
+def component_cost (comp,njones=0):
+  """Estimates the relative cost of computing visibilities for a sky component.
+  'njones' is the number of Jones terms applied to the component outside of
+  the component itself. Things that are not sky components (e.g. plain nodes)
+  are given a default cost.
+  """
+  classes = [ cls.__name__ for cls in type(comp).__mro__ ];
+  if "Patch" in classes:
+    return sum([ component_cost(c) for c in comp._components ]) + njones*jones_cost;
+  if "CorruptComponent" in classes:
+    return component_cost(comp.skycomp,njones+len(comp.jones_list()));
+  if "SkyComponent" not in classes:
+    return default_component_cost + njones*jones_cost;
+  cost = default_component_cost;
+  for name in classes:
+    if name in component_type_cost:
+      cost = component_type_cost[name];
+      break;
+  if comp.is_smeared():
+    cost *= smearing_cost_factor;
+  if getattr(comp,'_has_spi',False) or getattr(comp,'_has_rm',False):
+    cost *= freq_variable_cost_factor;
+  if comp.get_solvables():
+    cost *= solvable_cost_factor;
+  return cost + njones*jones_cost;
+
+def partition (costs,nbins):
+  """Partitions items with the given costs into 'nbins' bins of roughly equal total cost,
+  using the greedy LPT (longest processing time first) heuristic: items are taken in order of
+  decreasing cost, and each goes into the currently least-loaded bin.
+  Returns a list of 'nbins' lists of item indices. Items within a bin retain their original order.
+  """
+  heap = [ (0.,ibin) for ibin in range(nbins) ];
+  bins = [ [] for ibin in range(nbins) ];
+  for i in sorted(range(len(costs)),key=lambda i:-costs[i]):
+    load,ibin = heapq.heappop(heap);
+    bins[ibin].append(i);
+    heapq.heappush(heap,(load+costs[i],ibin));
+  return [ sorted(b) for b in bins ];
+
+def add_visibilities (nodes,vislist,ifrs,costs=None):
   """Smart method to add a list of visibility nodes in various clever ways
   (depending on our parallelization settings).
   'nodes' is an unqualified output node.
   'vislist' is a list of unqualified visibilities (presumably, per source)
   'ifrs' is a list of p,q pairs, such that for every vis in vislist, vis(p,q) yields a valid node.
+  'costs' is an optional list of relative costs of each element of vislist (see component_cost()),
+    used to balance the load across processors. If not given, all are assumed to be equal.
   
   Upon return, for each p,q, nodes(p,q) will contain the sum of vis(p,q) for each vis in vislist
   """
   # If Parallelization is enabled, divide visibilities into batches and
   # place on each processor
   if mpi_enable and parallelize_by_source:
-    # how many sources per processor?
-    nsrc = len(vislist);
-    src_per_proc = [nsrc/mpi_nproc]*mpi_nproc;
-    # distriebute remainder over a few processors
-    remainder = nsrc%mpi_nproc;
-    if remainder != 0:
-      for i in range(1,remainder+1):
-        src_per_proc[i] += 1;
+    if costs is None:
+      costs = [1]*len(vislist);
     # now loop over processors
     per_proc_nodes = [];
-    isrc0 = 0;
-    for proc in range(mpi_nproc):
-      isrc1 = isrc0 + src_per_proc[proc];
+    for proc,isrcs in enumerate(partition(costs,mpi_nproc)):
+      if not isrcs:
+        continue;
       # this node will contain the per-processor sum
       procnode = nodes('P%d'%proc);
       per_proc_nodes.append(procnode);
       # now, make nodes to add contributions of every source on that processor
-      smart_adder(procnode,vislist[isrc0:isrc1],ifrs,proc=proc);
-      isrc0 = isrc1;
+      smart_adder(procnode,[ vislist[i] for i in isrcs ],ifrs,proc=proc);
     # now, make one final sum of per-processor contributions
     smart_adder(nodes,per_proc_nodes,ifrs,proc=0,mt_polling=True);
+  elif mpi_enable and parallelize_by_baseline:
+    # every baseline costs the same, so this simply deals them out evenly. Each processor
+    # forms the complete sum for its baselines, so no final cross-processor sum is needed
+    for proc,iifrs in enumerate(partition([1]*len(ifrs),mpi_nproc)):
+      if iifrs:
+        smart_adder(nodes,vislist,[ ifrs[i] for i in iifrs ],proc=proc);
   else:
     # No parallelization, all sourced added up on one machine.
     smart_adder(nodes,vislist,ifrs);
@@ -49,20 +49,23 @@ class Patch (SkyComponent):
       # for up list of (component,visibility_node) pairs, where component=None if component is directly a node
       cv_list = [ (comp,comp.visibilities(array,observation)) if isinstance(comp,SkyComponent) else (None,comp) for comp in self._components ];
       # determine which components are now solvable
-      solvables    = [ vis for comp,vis in cv_list if comp and comp.get_solvables() ];
-      nonsolvables = [ vis for comp,vis in cv_list if not (comp and comp.get_solvables()) ];
+      solvables    = [ (comp,vis) for comp,vis in cv_list if comp and comp.get_solvables() ];
+      nonsolvables = [ (comp,vis) for comp,vis in cv_list if not (comp and comp.get_solvables()) ];
+      # per-visibility cost estimates, for load balancing
+      costs = lambda cvs:[ Parallelization.component_cost(comp) for comp,vis in cvs ];
+      visibilities = lambda cvs:[ vis for comp,vis in cvs ];
       # if both types are present, add separately for optimum cache reuse
       if solvables and nonsolvables:
         solv = nodes('solv');
         nonsolv = nodes('nonsolv');
         # use the intelligence in Parallelization to add in a smart way, depending on out
         # parallelization settings
-        Parallelization.add_visibilities(solv,solvables,ifrs);
-        Parallelization.add_visibilities(nonsolv,nonsolvables,ifrs);
+        Parallelization.add_visibilities(solv,visibilities(solvables),ifrs,costs(solvables));
+        Parallelization.add_visibilities(nonsolv,visibilities(nonsolvables),ifrs,costs(nonsolvables));
         for ifr in ifrs:
           nodes(*ifr) << Meq.Add(solv(*ifr),nonsolv(*ifr));
       else:
         # use the intelligence in Parallelization to add in a smart way, depending on out
         # parallelization settings
-        Parallelization.add_visibilities(nodes,solvables+nonsolvables,ifrs);
+        Parallelization.add_visibilities(nodes,visibilities(solvables+nonsolvables),ifrs,costs(solvables+nonsolvables));
     return nodes;
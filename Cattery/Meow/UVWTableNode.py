@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+#% $Id$
+#
+#
+# Copyright (C) 2002-2007
+# The MeqTree Foundation &
+# ASTRON (Netherlands Foundation for Research in Astronomy)
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>,
+# or write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+"""UVWTableNode is a PyNode that serves the UVWs of a whole array from a single node, by looking them
+up in the station UVW table of the MS (see Meow.MSUtils.get_uvw_table()). This replaces the per-station
+UVW spigots made by IfrArray.uvw(). See IfrArray for how it is used.
+""";
+
+from Timba import pynode
+from Timba.Meq import meq
+import numpy
+
+from Meow import MSUtils
+
+def interpolate_uvw (times,uvw,t):
+  """Returns a [len(t),nant,3] array of station UVWs at times t, given the times,uvw arrays returned
+  by get_uvw_table(). Requested times normally coincide with the table timeslots, in which case this is
+  a straight lookup, else UVWs are interpolated linearly (and extrapolated as constants).""";
+  t = numpy.atleast_1d(t);
+  if len(times) < 2:
+    return numpy.repeat(numpy.asarray(uvw[:1]),len(t),0);
+  i1 = numpy.clip(numpy.searchsorted(times,t),1,len(times)-1);
+  i0 = i1-1;
+  w = numpy.clip((t-times[i0])/(times[i1]-times[i0]),0,1)[:,numpy.newaxis,numpy.newaxis];
+  # fancy-indexing a memory-mapped table only reads the rows needed
+  uvw0,uvw1 = uvw[i0],uvw[i1];
+  return uvw0 + (uvw1-uvw0)*w;
+
+class UVWTableNode (pynode.PyNode):
+  """Returns UVWs for a list of stations (given by 'station_index', a list of antenna numbers) or of
+  interferometers (given by 'ifr_index', a list of (ip,iq) antenna number pairs), for the time grid
+  of the request. The result is a flat 3N-vector of u1,v1,w1,u2,v2,w2,...
+  'ddid' and 'field' select the rows of the MS that the table is made from (None for all).
+  """;
+  def update_state (self,mystate):
+    mystate('ms_name',None);
+    mystate('refant',0);
+    mystate('ddid',None);
+    mystate('field',None);
+    mystate('station_index',[]);
+    mystate('ifr_index',[]);
+    self._table = None;
+
+  def get_result (self,request,*children):
+    if self._table is None:
+      self._table = MSUtils.get_uvw_table(self.ms_name,self.refant,self.ddid,self.field);
+    times,uvw,missing = self._table;
+    t = request.cells.grid.time;
+    uvw = interpolate_uvw(times,uvw,t);
+    if self.ifr_index:
+      ip,iq = numpy.array(self.ifr_index).T;
+      uvw = uvw[:,iq,:] - uvw[:,ip,:];
+    else:
+      uvw = uvw[:,list(self.station_index),:];
+    vellsets = [];
+    for i in range(uvw.shape[1]):
+      for j in range(3):
+        vells = meq.vells(shape=meq.shape(len(t),));
+        vells[...] = uvw[:,i,j];
+        vellsets.append(meq.vellset(vells));
+    result = meq.result(None,request.cells);
+    result.vellsets = vellsets;
+    return result;
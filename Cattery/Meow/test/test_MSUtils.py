@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Tests for the station UVW table builder in Meow.MSUtils""";
+
+import os.path
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..",".."));
+
+from Meow import MSUtils
+
+def synthetic_rows (times,xyz,refant_baselines=True):
+  """Returns TIME,ANTENNA1,ANTENNA2,UVW columns of a synthetic MS with all baselines p<q of
+  the given antenna positions, at the given times. UVWs rotate with time.
+  If refant_baselines is False, baselines to the last antenna are only kept for antenna 1.""";
+  nant = len(xyz);
+  rows = [];
+  for t in times:
+    c,s = numpy.cos(t),numpy.sin(t);
+    rot = numpy.array([[c,-s,0],[s,c,0],[0,0,1]]);
+    uvw = numpy.dot(xyz,rot.T);
+    for p in range(nant):
+      for q in range(p+1,nant):
+        if refant_baselines or q != nant-1 or p == 1:
+          rows.append((t,p,q,uvw[q]-uvw[p]));
+  time,a1,a2,uvw = zip(*rows);
+  return numpy.array(time),numpy.array(a1),numpy.array(a2),numpy.array(uvw);
+
+def make_table (time,a1,a2,uvw,nant,refant,chunk=7):
+  """Builds a station UVW table from MS columns, the way get_uvw_table() does (in chunks of rows)""";
+  times = numpy.unique(time);
+  table = numpy.zeros((len(times),nant,3));
+  valid = numpy.zeros((len(times),nant),bool);
+  valid[:,refant] = True;
+  for row0 in range(0,len(time),chunk):
+    sl = slice(row0,row0+chunk);
+    MSUtils.add_refant_baselines(table,valid,numpy.searchsorted(times,time[sl]),a1[sl],a2[sl],uvw[sl],refant);
+  missing = MSUtils.fill_uvw_gaps(times,table,valid);
+  return times,table,missing;
+
+class UVWTableTest (unittest.TestCase):
+
+  def setUp (self):
+    numpy.random.seed(1);
+    self.xyz = numpy.random.uniform(-1000,1000,(5,3));
+    self.times = numpy.arange(10.)*.1;
+
+  def check_baselines (self,times,table,time,a1,a2,uvw):
+    itime = numpy.searchsorted(times,time);
+    numpy.testing.assert_allclose(table[itime,a2]-table[itime,a1],uvw,atol=1e-6);
+
+  def test_baselines (self):
+    time,a1,a2,uvw = synthetic_rows(self.times,self.xyz);
+    for refant in 0,2,4:
+      times,table,missing = make_table(time,a1,a2,uvw,len(self.xyz),refant);
+      self.assertEqual(missing,[]);
+      self.assertTrue((table[:,refant] == 0).all());
+      self.check_baselines(times,table,time,a1,a2,uvw);
+
+  def test_gaps (self):
+    time,a1,a2,uvw = synthetic_rows(self.times,self.xyz);
+    # drop the 0-3 baseline in a timeslot: antenna 3 gets interpolated there
+    drop = (time == self.times[4])&(a1 == 0)&(a2 == 3);
+    times,table,missing = make_table(time[~drop],a1[~drop],a2[~drop],uvw[~drop],len(self.xyz),0);
+    self.assertEqual(missing,[]);
+    numpy.testing.assert_allclose(table[4,3],(table[3,3]+table[5,3])/2);
+    keep = ~((a1 == 3)|(a2 == 3));
+    self.check_baselines(times,table,time[keep],a1[keep],a2[keep],uvw[keep]);
+
+  def test_missing (self):
+    time,a1,a2,uvw = synthetic_rows(self.times,self.xyz,refant_baselines=False);
+    times,table,missing = make_table(time,a1,a2,uvw,len(self.xyz),0);
+    self.assertEqual(missing,[4]);
+    self.assertTrue((table[:,4] == 0).all());
+    keep = (a2 != 4);
+    self.check_baselines(times,table,time[keep],a1[keep],a2[keep],uvw[keep]);
+
+if __name__ == '__main__':
+  unittest.main();
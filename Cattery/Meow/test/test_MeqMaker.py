@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Tests for MeqMaker tree construction.
+
+Trees are only defined in a TDL NodeScope, so no meqserver is needed.
+""";
+
+import os.path
+import sys
+import math
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..",".."));
+
+from Timba.TDL import *
+import Meow
+from Meow import Context,MeqMaker
+import Siamese.OMS.analytic_beams as analytic_beams
+import Siamese.OMS.oms_gain_models as oms_gain_models
+
+STATIONS = range(1,4);
+
+def _children (node):
+  """Returns the child stubs of a node stub""";
+  return [ child for label,child in node.children ];
+
+class CorrectAfterPredictTest (unittest.TestCase):
+  """A non-decomposition predict followed by correct_uv_data(), with two
+  uv-Jones and two sky-Jones terms""";
+
+  def setUp (self):
+    self.ns = ns = NodeScope();
+    self.array = Meow.IfrArray(ns,STATIONS);
+    Context.set(self.array,Meow.Observation(ns));
+    self.sources = [ Meow.PointSource(ns,name,Meow.LMDirection(ns,name,l,m),I=1)
+                     for name,l,m in ("S0",0,0),("S1",math.pi/360,0) ];
+    self.mm = mm = MeqMaker.MeqMaker(namespace='test');
+    for label in "G","B":
+      mm.add_uv_jones(label,label,oms_gain_models,flaggable=True);
+    for label in "E","P":
+      mm.add_sky_jones(label,label,analytic_beams);
+    for label in "G","B","E","P":
+      setattr(mm,mm._group_togglename(label),True);
+    TDLCompileOptions(*mm.compile_options());
+    # set up G-Jones flagging
+    for attr,value in ("flag_jones",True),("flag_jones_type",mm.JonesTerm.FLAG_ABS),  \
+                      ("flag_jones_min",None),("flag_jones_max",10),("flag_jones_freqmean",False):
+      setattr(mm,mm._make_attr(attr,"G"),value);
+    setattr(mm,mm._make_attr("flag_jones","B"),False);
+    mm.make_predict_tree(ns,sources=self.sources);
+    mm.correct_uv_data(ns,self.array.spigots(),sky_correct=self.sources[0]);
+
+  def test_no_decomposition_products (self):
+    ns = self.ns;
+    self.assertTrue(ns.uvjones_prod(STATIONS[0]).initialized());
+    self.assertFalse(ns.uvjones(STATIONS[0]).initialized());
+    self.assertFalse(ns.skyjones(self.sources[0])(STATIONS[0]).initialized());
+
+  def test_correction_chain (self):
+    ns = self.ns;
+    for p in STATIONS:
+      chain = [ child.name for child in _children(ns.correct('Jprod')(p)) ];
+      # one entry per Jones term, each applied exactly once
+      self.assertEqual(len(chain),4,chain);
+      self.assertEqual(len(set(chain)),4,chain);
+      # G-Jones goes in through its flagger, B-Jones does not
+      self.assertEqual(len([ name for name in chain if ':flag' in name ]),1,chain);
+
+class SharedBeamTest (unittest.TestCase):
+  """A predict where the sky-Jones terms are the same for the entire model, so every
+  source should share one per-station Jones product""";
+
+  def setUp (self):
+    self.ns = ns = NodeScope();
+    self.array = Meow.IfrArray(ns,STATIONS);
+    Context.set(self.array,Meow.Observation(ns));
+    self.sources = [ Meow.PointSource(ns,"S%d"%i,Meow.LMDirection(ns,"S%d"%i,i*math.pi/360,0),I=1)
+                     for i in range(4) ];
+    self.mm = mm = MeqMaker.MeqMaker(namespace='test');
+    for label in "E","P":
+      mm.add_sky_jones(label,label,analytic_beams);
+      setattr(mm,mm._group_togglename(label),True);
+      setattr(mm,mm._make_attr("advanced",label),True);
+      setattr(mm,mm._make_attr("per_source",label),MeqMaker.PER_ALL_SOURCES);
+    TDLCompileOptions(*mm.compile_options());
+    mm.make_predict_tree(ns,sources=self.sources);
+
+  def test_one_product (self):
+    ns = self.ns;
+    products = [ src.name for src in self.sources if ns.skyjones_prod(src.name)(STATIONS[0]).initialized() ];
+    self.assertEqual(len(products),1,products);
+
+if __name__ == '__main__':
+  unittest.main();
@@ -11,7 +11,7 @@ pyfits = Kittens.utils.import_pyfits();
 
 import Siamese.OMS.InterpolatedBeams
 
-from Siamese.OMS.InterpolatedBeams import _verbosity,dprint,dprintf,DEG,LMVoltageBeam
+from Siamese.OMS.InterpolatedBeams import _verbosity,dprint,dprintf,DEG,LMVoltageBeam,get_cached_beams,set_cached_beams
 
 from Timba import pynode
 from Timba.Meq import meq
@@ -30,11 +30,6 @@ class FITSCompoundBeamInterpolatorNode (pynode.PyNode):
   """
   def __init__ (self,*args):
     pynode.PyNode.__init__(self,*args);
-    # Maintain a global dict of VoltageBeam objects per each filename set, so that we reuse them
-    # We also reset this dict each time a node is created (otherwise the objects end up being reused
-    # even after the tree has been rebuilt.)
-    global _voltage_beams;
-    _voltage_beams = {};
 
   def update_state (self,mystate):
     """Standard function to update our state""";
@@ -53,6 +48,9 @@ class FITSCompoundBeamInterpolatorNode (pynode.PyNode):
       self._vb_key = tuple(zip(self.filename_real,self.filename_imag));
     else:
       raise ValueError,"filename_real/filename_imag: two lists of filenames of 2N elements each expected";
+    # the in-process beam cache is keyed by everything that goes into loading the beams
+    self._vb_cache_key = (self.__class__.__name__,self._vb_key,self.spline_order,self.ampl_interpolation,
+                          self.l_0,self.m_0,self.missing_is_null);
     # other init
     mequtils.add_axis('l');
     mequtils.add_axis('m');
@@ -62,12 +60,10 @@ class FITSCompoundBeamInterpolatorNode (pynode.PyNode):
   def init_voltage_beams (self):
     """initializes VoltageBeams for the given set of FITS files (per each _vb_key, that is).
     Returns list of 1 or 4 VoltageBeam objects."""
-    # maintain a global dict of VoltageBeam objects per each filename set, so that we reuse them
-    global _voltage_beams;
-    if not '_voltage_beams' in globals():
-      _voltage_beams = {};
-    # get VoltageBeam object from global dict, or init new one if not already defined
-    vbs,beam_max = _voltage_beams.get(self._vb_key,(None,None));
+    # get VoltageBeam objects from the in-process cache (if the files haven't changed since),
+    # or init new ones
+    filenames = [ f for pair in self._vb_key for f in pair ];
+    vbs,beam_max = get_cached_beams(self._vb_cache_key,filenames) or (None,None);
     if not vbs:
       vbs = [];
       for filename_real,filename_imag in self._vb_key:
@@ -89,7 +85,7 @@ class FITSCompoundBeamInterpolatorNode (pynode.PyNode):
       xx = [ vb.beam() if vb else numpy.array([0]) for vb in vbs[:len(vbs)/2] ];
       yy = [ vb.beam() if vb else numpy.array([0]) for vb in vbs[len(vbs)/2:] ];
       beam_max = math.sqrt(max([ (abs(x)**2+abs(y)**2).max() for x,y in zip(xx,yy)]));
-      _voltage_beams[self._vb_key] = vbs,beam_max;
+      set_cached_beams(self._vb_cache_key,filenames,(vbs,beam_max));
     return vbs,beam_max;
 
   def get_result (self,request,*children):
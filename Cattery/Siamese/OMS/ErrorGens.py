@@ -154,8 +154,8 @@ class RandomPolc (ErrorGenerator):
     Meow.Context.mssel.when_changed(self.set_ms);
 
   def set_ms (self,msname):
-    times = Meow.MSUtils.TABLE(msname).getcol("TIME");
-    t0,t1 = min(times),max(times);
+    stats = Meow.MSUtils.get_column_stats(msname,"TIME");
+    t0,t1 = stats.min,stats.max;
     self._offset_opt.set_custom_value(t0/(24*3600));
     self._scale_opt.set_custom_value((t1-t0)/3600);
     
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import os
 import os.path
 import math
+import hashlib
+import tempfile
 import numpy
 from scipy.ndimage import interpolation
 from scipy import interpolate
@@ -18,6 +21,78 @@ pyfits = Kittens.utils.import_pyfits();
 
 DEG = math.pi/180;
 
+# Prefiltered spline coefficients are saved as .npy files in this directory, keyed by a hash of
+# the beam plane and the spline order, and memory-mapped when loaded, so that they are shared
+# between processes, and the (slow) spline_filter() only runs once per beam pattern.
+SPLINE_CACHE_DIR = os.environ.get("MEQTREES_BEAM_CACHE") or \
+                   os.path.join(os.path.expanduser("~"),".cache","meqtrees","beams");
+# bump this when the cache layout changes, to invalidate older cache files
+SPLINE_CACHE_VERSION = 1;
+
+def prefiltered_spline (data,order):
+  """Returns the spline coefficients of a real array, as given by interpolation.spline_filter().
+  For order<=1 no prefiltering is needed, and the array is returned as is. The coefficients come
+  from the on-disk cache (SPLINE_CACHE_DIR) if available, else they are computed and saved there.
+  If the cache is not writable, the coefficients are kept in memory."""
+  if order <= 1:
+    return data;
+  data = numpy.ascontiguousarray(data,float);
+  digest = hashlib.sha1("%d %s"%(SPLINE_CACHE_VERSION,data.shape));
+  digest.update(data.data);
+  cachefile = os.path.join(SPLINE_CACHE_DIR,"spline-%s-order%d.npy"%(digest.hexdigest(),order));
+  # check disk cache
+  try:
+    coeff = numpy.load(cachefile,mmap_mode='r');
+    if coeff.shape == data.shape:
+      dprint(1,"using cached spline coefficients from",cachefile);
+      return coeff;
+  except:
+    pass;
+  dprint(1,"computing spline coefficients for array of shape",data.shape);
+  coeff = interpolation.spline_filter(data,order=order);
+  # write to a temporary file and rename it, so that other processes never see a partial file
+  try:
+    if not os.path.isdir(SPLINE_CACHE_DIR):
+      os.makedirs(SPLINE_CACHE_DIR);
+    fd,tmpfile = tempfile.mkstemp(dir=SPLINE_CACHE_DIR,suffix=".tmp");
+    try:
+      numpy.save(os.fdopen(fd,"wb"),coeff);
+      os.rename(tmpfile,cachefile);
+    except:
+      os.unlink(tmpfile);
+      raise;
+    return numpy.load(cachefile,mmap_mode='r');
+  except:
+    dprint(0,"can't write spline cache",cachefile,", keeping coefficients in memory");
+    return coeff;
+
+def files_fingerprint (filenames):
+  """Returns a tuple of (mtime,size) of the given files (None for missing files or null names),
+  used to check whether beams loaded from these files are still up to date."""
+  fingerprint = [];
+  for filename in filenames:
+    try:
+      st = os.stat(filename);
+      fingerprint.append((st.st_mtime,st.st_size));
+    except:
+      fingerprint.append(None);
+  return tuple(fingerprint);
+
+# In-process cache of loaded VoltageBeams, keyed by node class, filenames and beam parameters.
+# This is kept across tree rebuilds, entries are reloaded when the files change.
+_voltage_beams = {};
+
+def get_cached_beams (key,filenames):
+  """Returns the value cached under key, or None if n/a or if any of the files have changed."""
+  entry = _voltage_beams.get(key);
+  if entry and entry[0] == files_fingerprint(filenames):
+    return entry[1];
+  return None;
+
+def set_cached_beams (key,filenames,value):
+  """Caches a value under key, along with the current fingerprint of the files."""
+  _voltage_beams[key] = files_fingerprint(filenames),value;
+
 def expand_axis (x,axis,n):
   """Expands an array to N elements along the given axis. Array must have
   1 element along the given axis (or have fewer axes)"""
@@ -60,6 +135,26 @@ def unite_shapes (a,b):
         raise TypeError,"error: trying to unite incompatible shapes %s and %s"%(sa,sb);
   return a,b;
 
+def stack_arrays (arrays):
+  """Stacks a list of arrays (or scalars) into a single array, with a new first axis. The arrays
+  are expanded to a common shape as in unite_shapes(): missing (trailing) axes count as length 1,
+  and length-1 axes are expanded.
+  """
+  arrays = [ numpy.asarray(x) for x in arrays ];
+  # work out the common shape
+  shape = [1]*max([x.ndim for x in arrays]+[1]);
+  for x in arrays:
+    for axis,n in enumerate(x.shape):
+      if n != 1 and shape[axis] != n:
+        if shape[axis] != 1:
+          raise TypeError,"error: trying to unite incompatible shapes %s and %s"%(shape,x.shape);
+        shape[axis] = n;
+  # pad shapes on the right, numpy will then broadcast each array to the common shape
+  stack = numpy.empty([len(arrays)]+shape,float);
+  for i,x in enumerate(arrays):
+    stack[i,...] = x.reshape(list(x.shape)+[1]*(len(shape)-x.ndim));
+  return stack;
+
 class FITSAxes (object):
   """Helper class encapsulating a FITS header."""
   def __init__ (self,hdr):
@@ -213,6 +308,10 @@ class LMVoltageBeam (object):
       dprint(1,"%s axis unit is %s"%(axes.type(ax),axes.unit(ax)));
       if not axes.unit(ax) or axes.unit(ax).upper() == "DEG":
         axes.setUnitScale(ax,DEG);
+    # beams with the same key map l/m/freq to the same pixel coordinates (see transformCoordinates())
+    self._coord_key = (self.__class__.__name__,self.l0,self.m0,self._l_axis_sign,self._m_axis_sign,
+                       tuple(axes.grid(laxis)),tuple(axes.grid(maxis)),
+                       tuple(axes.grid(freqaxis)) if self._freqToPixel else None);
     # transpose array into L,M order and reshape
     dprint(1,"beam array has shape",beam.shape);
     beam = beam.transpose(used_axes+other_axes);
@@ -226,18 +325,13 @@ class LMVoltageBeam (object):
     dprint(2,"m grid is",axes.grid(maxis));
     if self._freqToPixel:
       dprint(2,"freq grid is",axes.grid(freqaxis));
-    # prefilter beam for interpolator
+    # prefilter beam for interpolator (coefficients come from the spline cache if available)
     self._beam = beam;
-    if self._spline_order > 1:
-      self._beam_real = interpolation.spline_filter(beam.real,order=self._spline_order);
-      self._beam_imag = interpolation.spline_filter(beam.imag,order=self._spline_order);
-      if not beam_ampl is None:
-        self._beam_ampl = interpolation.spline_filter(beam_ampl,order=self._spline_order);
-      else:
-        self._beam_ampl = beam_ampl
+    self._beam_real = prefiltered_spline(beam.real,self._spline_order);
+    self._beam_imag = prefiltered_spline(beam.imag,self._spline_order);
+    if not beam_ampl is None:
+      self._beam_ampl = prefiltered_spline(beam_ampl,self._spline_order);
     else:
-      self._beam_real = beam.real;
-      self._beam_imag = beam.imag;
       self._beam_ampl = beam_ampl
 
   def hasFrequencyAxis (self):
@@ -246,7 +340,12 @@ class LMVoltageBeam (object):
   def beam (self):
     return self._beam;
 
-  def interpolate (self,l,m,time=None,freq=None,freqaxis=None,output=None):
+  def coordinateKey (self):
+    """Returns a key such that beams with equal keys have the same pixel coordinates for the same l/m/freq,
+    i.e. the output of transformCoordinates() for one can be used with interpolatePixels() of the other."""
+    return self._coord_key;
+
+  def interpolate (self,l,m,time=None,freq=None,freqaxis=None,output=None,extra_axes=0):
     """Interpolates l/m coordinates in the beam.
     l,m may be arrays (both must be the same shape, or will be promoted to the same shape)
 
@@ -274,12 +373,21 @@ class LMVoltageBeam (object):
     (D) No dependence on frequency in the beam.
         We simply interpolate every l/m value as is. Output array is same shape as l/m.
 
+    'extra_axes' is the number of extra leading axes in l/m (e.g. a source axis, when many sources
+    are interpolated at once), which shifts the frequency axis along.
+
     'time' is currently ignored -- provided for later compatibility (i.e. beams with time planes)
     """
+    coords,shape = self.transformCoordinates(l,m,freq=freq,freqaxis=freqaxis,extra_axes=extra_axes);
+    return self.interpolatePixels(coords,shape,output=output);
+
+  def transformCoordinates (self,l,m,freq=None,freqaxis=None,extra_axes=0):
+    """Converts l/m (and freq, if the beam has a frequency dependence) into pixel coordinates of the beam.
+    Arguments are as for interpolate(). Returns tuple of (coords,shape), where coords is an array of pixel
+    coordinates for map_coordinates(), and shape is the shape of the output (see interpolatePixels())."""
     # make sure inputs are arrays
     l = numpy.array(l) + self.l0;
     m = numpy.array(m) + self.m0;
-    freq = numpy.array(freq);
     # promote l,m to the same shape
     l,m = unite_shapes(l,m);
     dprint(3,"input l/m [0] is",l.ravel()[0],m.ravel()[0],"and shapes are",l.shape);
@@ -290,7 +398,7 @@ class LMVoltageBeam (object):
     if self.hasFrequencyAxis():
       if freq is None:
         raise ValueError,"frequencies not specified, but beam has a frequency dependence";
-      freq = numpy.array(freq);
+      freq = numpy.array(freq,float);
       if not freq.ndim:
         freq = freq.reshape(1);
       dprint(3,"frequencies are",freq)
@@ -303,6 +411,7 @@ class LMVoltageBeam (object):
       scale[above] = freq[above]/self._freqgrid[-1]
       freq[below] = self._freqgrid[0]
       freq[above] = self._freqgrid[-1]
+      chanscale = scale
       # convert frequency to fractional channel index
       chan = self._freqToPixel(freq)
       dprint(3,"in frequency plane coordinates we have",chan)
@@ -316,6 +425,7 @@ class LMVoltageBeam (object):
         # first turn chan vector into an array of the proper shape
         if freqaxis is None:
           raise ValueError,"frequency axis not specified, but beam has a frequency dependence";
+        freqaxis += extra_axes;
         freqshape = [1]*(freqaxis+1);
         freqshape[freqaxis] = len(chan);
         chan = chan.reshape(freqshape)
@@ -332,7 +442,7 @@ class LMVoltageBeam (object):
         lm[0,:] *= scale
         lm[1,:] *= scale
         dprint(3,"some points were extrapolated for OOB frequencies using scale factors",
-          scale if numpy.isscalar(scale) else scale[above|below])
+          chanscale[above|below])
     # case (D): no frequency dependence in the beam
     else:
       lm = numpy.vstack((l.ravel(),m.ravel()));
@@ -340,19 +450,23 @@ class LMVoltageBeam (object):
     lm[0,:] = self._lToPixel(lm[0,:])
     lm[1,:] = self._mToPixel(lm[1,:])
     dprint(3,"xy pixel coordinates are [0]",lm[0,0],lm[1,0]);
-    # interpolate and reshape back to shape of L
+    return lm,l.shape;
+
+  def interpolatePixels (self,coords,shape,output=None):
+    """Interpolates the beam at the pixel coordinates returned by transformCoordinates().
+    Result is a complex array of the given shape (placed into output, if supplied)."""
     if output is None:
-      output = numpy.zeros(l.shape,complex);
-    elif output.shape != l.shape:
-      output.resize(l.shape);
-    dprint(3,"interpolating %d lm points"%lm.shape[1]);
-    output.real = interpolation.map_coordinates(self._beam_real,lm,order=self._spline_order,
-                  prefilter=(self._spline_order==1),mode='nearest').reshape(l.shape);
-    output.imag = interpolation.map_coordinates(self._beam_imag,lm,order=self._spline_order,
-                  prefilter=(self._spline_order==1),mode='nearest').reshape(l.shape);
+      output = numpy.zeros(shape,complex);
+    elif output.shape != shape:
+      output.resize(shape);
+    dprint(3,"interpolating %d lm points"%coords.shape[1]);
+    output.real = interpolation.map_coordinates(self._beam_real,coords,order=self._spline_order,
+                  prefilter=(self._spline_order==1),mode='nearest').reshape(shape);
+    output.imag = interpolation.map_coordinates(self._beam_imag,coords,order=self._spline_order,
+                  prefilter=(self._spline_order==1),mode='nearest').reshape(shape);
     if not self._beam_ampl is None:
-      output_ampl = interpolation.map_coordinates(self._beam_ampl,lm,order=self._spline_order,
-                  prefilter=(self._spline_order==1),mode='nearest').reshape(l.shape);
+      output_ampl = interpolation.map_coordinates(self._beam_ampl,coords,order=self._spline_order,
+                  prefilter=(self._spline_order==1),mode='nearest').reshape(shape);
       phase_array = numpy.arctan2(output.imag,output.real)
       output.real = output_ampl * numpy.cos(phase_array)
       output.imag = output_ampl * numpy.sin(phase_array)
@@ -423,18 +537,18 @@ class LMVoltageMultifreqBeam (LMVoltageBeam):
     dprint(2,"m grid is",self._axes.grid(maxis));
     dprint(2,"freq grid is",freqs);
     self._freqaxis = freqs;
+    self._freqgrid = numpy.array(freqs);
+    self._coord_key = (self.__class__.__name__,self.l0,self.m0,1,1,
+                       tuple(self._axes.grid(laxis)),tuple(self._axes.grid(maxis)),tuple(freqs));
     self._freq_interpolator = interpolate.interp1d(freqs,range(len(freqs)),'linear');
-    # prefilter beam for interpolator
+    # prefilter beam for interpolator (coefficients come from the spline cache if available)
     self._beam = beamcube;
-    self._beam_ampl = numpy.abs(beamcube) if self.ampl_interpolation else None;
-    if self._spline_order > 1:
-      self._beam_real = interpolation.spline_filter(beamcube.real,order=self._spline_order);
-      self._beam_imag = interpolation.spline_filter(beamcube.imag,order=self._spline_order);
-      if self._beam_ampl:
-        self._beam_ampl = interpolation.spline_filter(self._beam_ampl,order=self._spline_order);
+    self._beam_real = prefiltered_spline(beamcube.real,self._spline_order);
+    self._beam_imag = prefiltered_spline(beamcube.imag,self._spline_order);
+    if self.ampl_interpolation:
+      self._beam_ampl = prefiltered_spline(numpy.abs(beamcube),self._spline_order);
     else:
-      self._beam_real = beamcube.real;
-      self._beam_imag = beamcube.imag;
+      self._beam_ampl = None;
 
   def hasFrequencyAxis (self):
     return True;
@@ -462,11 +576,6 @@ if not standalone:
   class FITSBeamInterpolatorNode (pynode.PyNode):
     def __init__ (self,*args):
       pynode.PyNode.__init__(self,*args);
-      # Maintain a global dict of VoltageBeam objects per each filename set, so that we reuse them
-      # We also reset this dict each time a node is created (otherwise the objects end up being reused
-      # even after the tree has been rebuilt.)
-      global _voltage_beams;
-      _voltage_beams = {};
 
     def update_state (self,mystate):
         """Standard function to update our state""";
@@ -489,6 +598,9 @@ if not standalone:
           self._vb_key = tuple(zip(self.filename_real,self.filename_imag));
         else:
           raise ValueError,"filename_real/filename_imag: either a single filename, or a list of 4 filenames expected";
+        # the in-process beam cache is keyed by everything that goes into loading the beams
+        self._vb_cache_key = (self.__class__.__name__,self._vb_key,self.spline_order,self.ampl_interpolation,
+                              self.l_beam_offset,self.m_beam_offset,self.l_axis,self.m_axis,self.missing_is_null);
         # other init
         mequtils.add_axis('l');
         mequtils.add_axis('m');
@@ -498,12 +610,10 @@ if not standalone:
     def init_voltage_beams (self):
         """initializes VoltageBeams for the given set of FITS files (per each _vb_key, that is).
         Returns list of 1 or 4 VoltageBeam objects."""
-        # maintain a global dict of VoltageBeam objects per each filename set, so that we reuse them
-        global _voltage_beams;
-        if not '_voltage_beams' in globals():
-          _voltage_beams = {};
-        # get VoltageBeam object from global dict, or init new one if not already defined
-        vbs,beam_max = _voltage_beams.get(self._vb_key,(None,None));
+        # get VoltageBeam objects from the in-process cache (if the files haven't changed since),
+        # or init new ones
+        filenames = [ f for pair in self._vb_key for f in pair ];
+        vbs,beam_max = get_cached_beams(self._vb_cache_key,filenames) or (None,None);
         if not vbs:
           vbs = [];
           for filename_real,filename_imag in self._vb_key:
@@ -535,7 +645,7 @@ if not standalone:
             xx,xy,yx,yy = [ vb.beam() if vb else 0 for vb in vbs ];
             beam_max = math.sqrt((abs(xx)**2+abs(xy)**2+abs(yx)**2+abs(yy)**2).max()/2);
           dprint(1,"beam max is",beam_max);
-          _voltage_beams[self._vb_key] = vbs,beam_max;
+          set_cached_beams(self._vb_cache_key,filenames,(vbs,beam_max));
         return vbs,beam_max;
 
     def get_result (self,request,*children):
@@ -570,28 +680,41 @@ if not standalone:
           values = _cells_grid(request,axis);
         if values is not None:
           grid[axis] = values;
+      # stack l,m of all sources into [nsrc,...] cubes (broadcasting their shapes if they differ),
+      # and subtract the pointing offsets (which get a leading source axis)
+      lcube = stack_arrays([ lm.vellsets[isrc*nlm].value for isrc in range(nsrc) ]);
+      mcube = stack_arrays([ lm.vellsets[isrc*nlm+1].value for isrc in range(nsrc) ]);
+      dl,dm = [ stack_arrays([x]) for x in dl,dm ];
+      lcube,dl = unite_shapes(lcube,dl);
+      mcube,dm = unite_shapes(mcube,dm);
+      # interpolate all sources at once. The coordinate transform is shared between beams
+      # with the same pixel coordinates (normally all of them).
+      coords = {};
+      beams = [];
+      for vb in vbs:
+        if vb is None:
+          beams.append(None);
+        else:
+          key = vb.coordinateKey();
+          if key not in coords:
+            coords[key] = vb.transformCoordinates(lcube-dl,mcube-dm,freq=grid.get('freq'),
+                                                  freqaxis=self._freqaxis,extra_axes=1);
+          beam = vb.interpolatePixels(*coords[key]);
+          if self.normalize and beam_max != 0:
+            beam /= beam_max;
+          beams.append(beam);
+      # make vellsets, per source and per beam
       vellsets = [];
-      # now loop over sources and interpolte
       for isrc in range(nsrc):
-        # put l,m into grid
-        l,m = lm.vellsets[isrc*nlm].value,lm.vellsets[isrc*nlm+1].value;
-        l,dl = unite_shapes(l,dl);
-        m,dm = unite_shapes(m,dm);
-        grid['l'] = l - dl;
-        grid['m'] = m - dm;
-        # interpolate
-        for vb in vbs:
-          if vb is None:
+        for beam in beams:
+          if beam is None:
             vellsets.append(meq.vellset(meq.sca_vells(0.)));
           else:
-            beam = vb.interpolate(freqaxis=self._freqaxis,**grid);
-            if self.normalize and beam_max != 0:
-              beam /= beam_max;
-            vells = meq.complex_vells(beam.shape);
-            vells[...] = beam[...];
-            # make vells and return result
+            vells = meq.complex_vells(beam.shape[1:]);
+            vells[...] = beam[isrc,...];
             vellsets.append(meq.vellset(vells));
       # create result object
+      vb = [ vb for vb in vbs if vb ][0];
       cells = request.cells if vb.hasFrequencyAxis() else getattr(lm,'cells',None);
       result = meq.result(vellsets[0],cells=cells);
       if len(vellsets) > 1:
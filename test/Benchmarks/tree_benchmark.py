@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tree-construction benchmarks for Meow and the Siamese/Calico scripts.
+
+Trees are defined in a TDL NodeScope, which only records node definitions
+as Python-side stubs: no meqserver is started and no nodes are created, so
+what gets measured is purely the cost of tree construction. Every case is
+run in a forked child process, so that peak memory is measured per case and
+TDL/Meow.Context state does not leak from one case into the next.
+
+For each case the wall time of the tree definition and of ns.Resolve(), the
+peak memory growth, and the number of nodes defined are reported. Results
+can be saved as JSON (--save), and compared against an earlier run (--compare),
+in which case the exit status is non-zero if any case regressed.
+
+Cases:
+  predict   MeqMaker.make_predict_tree() for a synthetic array and sky model
+  correct   MeqMaker.correct_uv_data() for a synthetic array
+  script    the _define_forest() function of a TDL script (e.g.
+            Siamese/turbo-sim.py, Calico/calico-stefcal.py), run against
+            a real MS given by --ms, with the sky model replaced by a
+            synthetic one
+""";
+
+import os
+import os.path
+import sys
+import imp
+import math
+import time
+import json
+import select
+import signal
+import resource
+import cPickle
+import traceback
+
+from Timba.TDL import *
+import Meow
+from Meow import Context,MeqMaker
+
+STATION_COUNTS = [14,27,64,128,256];
+SOURCE_COUNTS = [10,100,1000,10000,100000];
+
+# Jones terms that can be enabled in the synthetic measurement equation.
+# Each entry is label: (is_uvplane,module name)
+JONES_MODULES = dict(
+  E=(False,"Siamese.OMS.analytic_beams"),
+  G=(True,"Siamese.OMS.oms_gain_models"),
+);
+
+def _import_module (name):
+  __import__(name);
+  return sys.modules[name];
+
+def synthetic_array (ns,nstations):
+  """Sets up Meow.Context with an array of the given size and a default observation""";
+  array = Meow.IfrArray(ns,range(1,nstations+1));
+  observation = Meow.Observation(ns);
+  Context.set(array,observation);
+  return array,observation;
+
+def synthetic_sky (ns,nsources,radius=math.pi/180):
+  """Returns a list of point sources on a Fermat spiral within 'radius' of the
+  phase centre. The layout is deterministic, so node counts are reproducible.""";
+  golden = math.pi*(3-math.sqrt(5));
+  sources = [];
+  for i in range(nsources):
+    r = radius*math.sqrt((i+.5)/nsources);
+    l,m = r*math.cos(i*golden),r*math.sin(i*golden);
+    name = "S%d"%i;
+    sources.append(Meow.PointSource(ns,name,Meow.LMDirection(ns,name,l,m),I=1./(1+i%100)));
+  return sources;
+
+def make_meqmaker (jones,use_tensors=False):
+  """Makes a MeqMaker with the given Jones terms (a list of labels from JONES_MODULES) enabled""";
+  mm = MeqMaker.MeqMaker(namespace='bench',use_tensors=use_tensors);
+  for label in jones:
+    is_uvplane,modname = JONES_MODULES[label];
+    module = _import_module(modname);
+    if is_uvplane:
+      mm.add_uv_jones(label,label,module);
+    else:
+      mm.add_sky_jones(label,label,module);
+    # no GUI to switch the terms on, so enable them directly
+    setattr(mm,mm._group_togglename(label),True);
+  TDLCompileOptions(*mm.compile_options());
+  return mm;
+
+def define_predict (ns,nstations,nsources,jones,use_tensors=False):
+  array,observation = synthetic_array(ns,nstations);
+  sources = synthetic_sky(ns,nsources);
+  mm = make_meqmaker(jones,use_tensors);
+  mm.make_predict_tree(ns,sources=sources);
+
+def define_correct (ns,nstations,jones,use_tensors=False):
+  array,observation = synthetic_array(ns,nstations);
+  mm = make_meqmaker([ label for label in jones if JONES_MODULES[label][0] ],use_tensors);
+  mm.correct_uv_data(ns,array.spigots());
+
+def define_script (ns,script,msname,nsources):
+  """Loads a TDL script and runs its _define_forest() against the given MS.
+  If the script has a global 'meqmaker', its sky model is replaced by a synthetic one.""";
+  mod = imp.load_source("_benchmark_script",script);
+  mssel = getattr(mod,'mssel',None) or Context.mssel;
+  if mssel is None:
+    raise RuntimeError,"%s does not set up an MS selector"%script;
+  mssel._ms_option.set_value(msname);
+  meqmaker = getattr(mod,'meqmaker',None);
+  if meqmaker is not None and nsources:
+    # sources can only be made once _define_forest() has set up the context
+    meqmaker.get_source_list = lambda ns,_cache=[]: \
+        _cache or _cache.extend(synthetic_sky(ns,nsources)) or _cache;
+  mod._define_forest(ns);
+
+def _peak_rss ():
+  """Returns peak resident set size of this process, in MB""";
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.;
+
+def measure (define_func,*args):
+  """Runs define_func(ns,*args) on a fresh NodeScope, returns dict of measurements""";
+  rss0 = _peak_rss();
+  ns = NodeScope();
+  t0 = time.time();
+  define_func(ns,*args);
+  t1 = time.time();
+  ns.Resolve();
+  t2 = time.time();
+  return dict(define_time=t1-t0,resolve_time=t2-t1,time=t2-t0,
+              nodes=len(ns.AllNodes()),memory=_peak_rss()-rss0);
+
+def run_forked (timeout,func,*args):
+  """Runs func(*args) in a child process, returns its (picklable) result.
+  On error or timeout, returns a dict with an 'error' entry.""";
+  rfd,wfd = os.pipe();
+  pid = os.fork();
+  if not pid:
+    os.close(rfd);
+    try:
+      result = func(*args);
+    except:
+      result = dict(error=traceback.format_exc());
+    try:
+      pipe = os.fdopen(wfd,"w");
+      cPickle.dump(result,pipe,cPickle.HIGHEST_PROTOCOL);
+      pipe.close();
+    finally:
+      os._exit(0);
+  os.close(wfd);
+  try:
+    ready = select.select([rfd],[],[],timeout)[0];
+    if not ready:
+      os.kill(pid,signal.SIGKILL);
+      return dict(error="timed out after %gs"%timeout);
+    data = os.fdopen(rfd).read();
+  finally:
+    os.waitpid(pid,0);
+  if not data:
+    return dict(error="child process died");
+  return cPickle.loads(data);
+
+def compare_results (results,baseline,tolerance):
+  """Compares results to baseline. Returns list of regression messages""";
+  regressions = [];
+  base = dict([ (r['case'],r) for r in baseline if 'error' not in r ]);
+  for r in results:
+    b = base.get(r['case']);
+    if b is None:
+      continue;
+    if 'error' in r:
+      regressions.append("%s: failed (%s)"%(r['case'],r['error'].strip().split("\n")[-1]));
+      continue;
+    if r['nodes'] > b['nodes']:
+      regressions.append("%s: %d nodes, was %d"%(r['case'],r['nodes'],b['nodes']));
+    for key,unit in ('time','s'),('memory','MB'):
+      # ignore differences in the noise
+      if r[key] > b[key]*(1+tolerance) and r[key]-b[key] > (.1 if unit == 's' else 10):
+        regressions.append("%s: %s %.2f%s, was %.2f%s"%(r['case'],key,r[key],unit,b[key],unit));
+  return regressions;
+
+def _intlist (value):
+  return [ int(x) for x in value.split(",") if x ];
+
+if __name__ == '__main__':
+  from optparse import OptionParser
+  parser = OptionParser(usage="""%prog: [options] [script.py ...]""",
+      description="Measures tree construction time, peak memory and node count for Meow "
+                  "predict/correct trees built for synthetic arrays and sky models, and for "
+                  "the _define_forest() functions of any TDL scripts given (requires --ms).");
+  parser.add_option("-s","--stations",type="string",default=",".join(map(str,STATION_COUNTS)),
+                    help="comma-separated list of array sizes. Default is %default.");
+  parser.add_option("-n","--sources",type="string",default=",".join(map(str,SOURCE_COUNTS)),
+                    help="comma-separated list of sky model sizes. Default is %default.");
+  parser.add_option("-j","--jones",type="string",default="E,G",
+                    help="comma-separated list of Jones terms to enable (%s). Default is %%default."%",".join(sorted(JONES_MODULES)));
+  parser.add_option("-c","--cases",type="string",default="predict,correct",
+                    help="comma-separated list of synthetic cases to run. Default is %default.");
+  parser.add_option("--tensors",action="store_true",
+                    help="use the tensor predict path in MeqMaker");
+  parser.add_option("--ms",type="string",
+                    help="MS to run script cases against");
+  parser.add_option("--timeout",type="float",default=3600,
+                    help="give up on a case after this many seconds. Default is %default.");
+  parser.add_option("--max-size",type="float",default=0,
+                    help="skip synthetic cases where stations^2*sources exceeds this. Default is no limit.");
+  parser.add_option("--save",type="string",metavar="FILE",
+                    help="save results to JSON file");
+  parser.add_option("--compare",type="string",metavar="FILE",
+                    help="compare results to JSON file from an earlier run");
+  parser.add_option("--tolerance",type="float",default=.2,
+                    help="relative increase in time or memory counted as a regression. Default is %default.");
+  (options,scripts) = parser.parse_args();
+
+  stations = _intlist(options.stations);
+  nsources = _intlist(options.sources);
+  jones = [ x for x in options.jones.split(",") if x ];
+  for label in jones:
+    if label not in JONES_MODULES:
+      parser.error("unknown Jones term '%s'"%label);
+  if scripts and not options.ms:
+    parser.error("script cases require an MS (--ms)");
+
+  cases = [];
+  for name in [ x for x in options.cases.split(",") if x ]:
+    if name not in ("predict","correct"):
+      parser.error("unknown case '%s'"%name);
+    for nst in stations:
+      # the correct trees do not depend on the sky model
+      for nsrc in (nsources if name == "predict" else nsources[:1]):
+        if options.max_size and nst*nst*nsrc > options.max_size:
+          continue;
+        if name == "predict":
+          cases.append(("%s/%dst/%dsrc"%(name,nst,nsrc),define_predict,(nst,nsrc,jones,options.tensors)));
+        else:
+          cases.append(("%s/%dst"%(name,nst),define_correct,(nst,jones,options.tensors)));
+  for script in scripts:
+    for nsrc in nsources:
+      label = "%s/%dsrc"%(os.path.basename(script),nsrc);
+      cases.append((label,define_script,(script,options.ms,nsrc)));
+
+  print "%-40s %10s %10s %10s %10s %10s"%("case","define,s","resolve,s","total,s","memory,MB","nodes");
+  results = [];
+  for label,func,args in cases:
+    result = run_forked(options.timeout,measure,func,*args);
+    result['case'] = label;
+    results.append(result);
+    if 'error' in result:
+      print "%-40s FAILED: %s"%(label,result['error'].strip().split("\n")[-1]);
+    else:
+      print "%-40s %10.2f %10.2f %10.2f %10.1f %10d"%(label,result['define_time'],result['resolve_time'],
+                                                     result['time'],result['memory'],result['nodes']);
+    sys.stdout.flush();
+
+  if options.save:
+    json.dump(results,file(options.save,"w"),indent=2);
+    print "Saved results to",options.save;
+
+  if options.compare:
+    regressions = compare_results(results,json.load(file(options.compare)),options.tolerance);
+    if regressions:
+      print "%d regression(s) relative to %s:"%(len(regressions),options.compare);
+      for msg in regressions:
+        print "  ",msg;
+      sys.exit(1);
+    print "No regressions relative to",options.compare;